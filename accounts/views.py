@@ -5,7 +5,7 @@ from django.shortcuts import get_object_or_404, render
 from django.views.decorators.cache import never_cache
 from django.views.decorators.debug import sensitive_post_parameters
 
-from billing.models import Customer, Plan, Subscription
+from billing.models import Customer, Plan
 from events.models import Event
 from .forms import AccountSettingsForm
 from .models import MyUser
@@ -29,8 +29,8 @@ def detail(request, user_pk):
 @sensitive_post_parameters()
 def account_settings(request):
     user = request.user
-    customer = Customer.objects.get(user=user)
-    subscription = Subscription.objects.get(customer=customer)
+    customer = Customer.objects.with_subscription().get(user=user)
+    subscription = customer.current_subscription
 
     form = AccountSettingsForm(request.POST or None,
                                request.FILES or None,
@@ -9,6 +9,7 @@ from django.views.decorators.cache import never_cache
 from django.views.decorators.debug import sensitive_post_parameters
 
 from accounts.models import MyUser
+from billing.breaker import PaymentsUnavailable, is_available
 from billing.forms import StripeCreditCardForm
 from billing.models import Customer, Plan, Subscription
 from .forms import (LoginForm, SignupForm, PasswordResetForm,
@@ -60,6 +61,11 @@ def auth_register(request):
         plan_id = request.POST['plan_id']
         plan = get_object_or_404(Plan, plan_id=plan_id)
         email = form.cleaned_data['email']
+
+        # Don't create the account while paid sign-ups are failing.
+        if plan.amount > 0 and not is_available('customer.create',
+                                                'subscription.create'):
+            raise PaymentsUnavailable('subscription.create')
         password = form.cleaned_data['password_confirm']
 
         new_user = MyUser.objects.create_user(
@@ -79,18 +85,26 @@ def auth_register(request):
                 stripe_form = StripeCreditCardForm(request.POST,
                                                    user=user,
                                                    customer=cu)
-                if stripe_form.is_valid():
-                    sub = Subscription.objects.create(customer=cu, plan=plan)
-
-                    if sub:
-                        messages.success(request,
-                                         'Your account has been successfully '
-                                         'created.')
-                        return redirect('home')
-                elif stripe_form.errors:
-                    for field in stripe_form:
-                        for error in field.errors:
+                try:
+                    if stripe_form.is_valid():
+                        sub = Subscription.objects.create(customer=cu,
+                                                          plan=plan)
+
+                        if sub:
+                            messages.success(request,
+                                             'Your account has been '
+                                             'successfully created.')
+                            return redirect('home')
+                    elif stripe_form.errors:
+                        for error in stripe_form.non_field_errors():
                             messages.error(request, error)
+                        for field in stripe_form:
+                            for error in field.errors:
+                                messages.error(request, error)
+                except PaymentsUnavailable:
+                    # Stripe went down part way; don't keep half an account.
+                    user.delete()
+                    raise
             elif plan.amount == 0:
                 sub = Subscription.objects.create(customer=cu, plan=plan)
 
@@ -1,21 +1,25 @@
-import stripe
-
-from django.conf import settings
-from django.contrib import admin
+from django.conf.urls import url
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.html import format_html
 from django.utils.translation import ugettext as _
 
 from billing.utils import (get_or_create_stripe_plan, delete_stripe_plan,
                            get_or_create_stripe_cus, delete_stripe_cus,
-                           get_or_create_stripe_sub, cancel_stripe_sub,
-                           get_or_create_stripe_charge, convert_tstamp)
-from .models import Customer, Plan, Subscription, Charge
+                           cancel_stripe_sub)
+from core.tasks import enqueue
+from .bulk import cancel_subscriptions, refresh_charges
+from .models import (Customer, Plan, Subscription, Charge, RegistrationIntent,
+                     Refund, RefundBatch, StripeEvent)
+from .refunds import resume_batch, retry_failed_refunds, write_report
+from .webhooks import apply_pending_events
 
 # Register your models here.
 
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-
 @admin.register(Plan)
 class PlanAdmin(admin.ModelAdmin):
     list_display = ('name', 'display_amount', 'is_active',)
@@ -46,6 +50,11 @@ class PlanAdmin(admin.ModelAdmin):
         return self.readonly_fields
 
     def save_model(self, request, obj, form, change):
+        if change and obj.plan_id and not set(form.changed_data) & \
+                {'name', 'statement_descriptor', 'trial_period_days'}:
+            # Nothing Stripe keeps for the plan was edited.
+            obj.save()
+            return
         plan = get_or_create_stripe_plan(
             plan_id=obj.plan_id, name=obj.name, amount=obj.amount,
             interval=obj.interval, currency=obj.currency,
@@ -70,12 +79,13 @@ class PlanAdmin(admin.ModelAdmin):
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user',)
+    list_display = ('id', 'user', 'subscription_status',)
     list_display_links = ('id', 'user',)
-    list_filter = ('created', 'currency',)
+    list_filter = ('created', 'currency', 'subscription_status',)
     fieldsets = (
         (None,
-            {'fields': ('user', 'auto_renew',)}),
+            {'fields': ('user', 'auto_renew', 'current_subscription',
+                        'subscription_status',)}),
         (_('Stripe Information'),
             {'fields': ('cu_id', 'account_balance', 'currency', 'description',
                         'email',)}),
@@ -103,16 +113,19 @@ class CustomerAdmin(admin.ModelAdmin):
         return False
 
     def save_model(self, request, obj, form, change):
-        cu = get_or_create_stripe_cus(
-            customer_id=obj.cu_id, account_balance=obj.account_balance,
-            description=obj.description, email=obj.email
-        )
-        if cu:
-            obj.cu_id = cu['id']
+        # Customers that were never billed have nothing on Stripe to update.
+        if obj.cu_id:
+            cu = get_or_create_stripe_cus(
+                customer_id=obj.cu_id, account_balance=obj.account_balance,
+                description=obj.description, email=obj.email
+            )
+            if cu:
+                obj.cu_id = cu['id']
         obj.save()
 
     def delete_model(self, request, obj):
-        delete_stripe_cus(obj.cu_id)
+        if obj.cu_id:
+            delete_stripe_cus(obj.cu_id)
         obj.delete()
 
 
@@ -133,6 +146,7 @@ class SubscriptionAdmin(admin.ModelAdmin):
     )
     search_fields = ('customer__user__first_name', 'customer__user__last_name',
                      'customer__email', 'plan__plan_id', 'sub_id')
+    actions = ('cancel_selected',)
 
     class Meta:
         model = Subscription
@@ -148,35 +162,19 @@ class SubscriptionAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         return False
 
-    def save_model(self, request, obj, form, change):
-        sub = get_or_create_stripe_sub(
-            subscription_id=obj.sub_id, customer=obj.customer.cu_id,
-            plan=obj.plan.plan_id, quantity=obj.quantity,
-            trial_end=obj.trial_end, trial_period_days=obj.trial_period_days
-        )
-
-        if obj.cancel_at_period_end:
-            sub = cancel_stripe_sub(subscription_id=obj.sub_id,
-                                    at_period_end=True)
-
-        if sub:
-            _trial_days = sub['plan']['trial_period_days']
-            obj.sub_id = sub['id']
-            obj.status = sub['status']
-            obj.trial_period_days = _trial_days if _trial_days else 0
-            obj.trial_start = convert_tstamp(sub['trial_start'])
-            obj.canceled_at = convert_tstamp(sub['canceled_at'])
-            obj.current_period_end = convert_tstamp(sub['current_period_end'])
-            obj.current_period_start = convert_tstamp(sub['current_period_start'])
-            obj.ended_at = convert_tstamp(sub['ended_at'])
-            obj.start = convert_tstamp(sub['start'])
-
-        obj.save()
-
     def delete_model(self, request, obj):
         cancel_stripe_sub(obj.sub_id)
         obj.delete()
 
+    def cancel_selected(self, request, queryset):
+        """Cancels the selected subscriptions in the background."""
+        enqueue(cancel_subscriptions,
+                list(queryset.values_list('pk', flat=True)))
+        messages.add_message(
+            request, messages.SUCCESS,
+            _('The selected subscriptions are being canceled.'))
+    cancel_selected.short_description = _("Cancel selected subscriptions")
+
 
 @admin.register(Charge)
 class ChargeAdmin(admin.ModelAdmin):
@@ -197,6 +195,7 @@ class ChargeAdmin(admin.ModelAdmin):
                        'captured', 'refunded', 'disputed', 'paid',
                        'statement_descriptor',)
     search_fields = ('charge_id',)
+    actions = ('refresh_selected',)
 
     class Meta:
         model = Charge
@@ -212,21 +211,131 @@ class ChargeAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         return False
 
-    def save_model(self, request, obj, form, change):
-        charge = get_or_create_stripe_charge(
-            charge_id=obj.charge_id, amount=obj.amount, currency=obj.currency,
-            description=obj.description,
-            statement_descriptor=obj.statement_descriptor
-        )
+    def refresh_selected(self, request, queryset):
+        """Reads the selected charges back from Stripe in the
+        background."""
+        enqueue(refresh_charges, list(queryset.values_list('pk', flat=True)))
+        messages.add_message(
+            request, messages.SUCCESS,
+            _('The selected charges are being refreshed from Stripe.'))
+    refresh_selected.short_description = _("Refresh selected charges from "
+                                           "Stripe")
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'type', 'object_id', 'status',
+                    'event_created', 'attempts',)
+    list_filter = ('status', 'type', 'event_created',)
+    readonly_fields = ('event_id', 'type', 'object_id', 'event_created',
+                       'payload', 'status', 'attempts', 'error', 'received',
+                       'processed_at',)
+    search_fields = ('event_id', 'object_id',)
+    actions = ('retry_failed',)
 
-        if charge:
-            obj.charge_id = charge['id']
-            obj.amount_refunded = charge['amount_refunded']
-            obj.paid = charge['paid']
-            obj.disputed = charge['disputed']
-            obj.refunded = charge['refunded']
-            obj.captured = charge['captured']
-            obj.receipt_sent = charge['receipt_sent']
-            obj.charge_created = charge['charge_created']
-            obj.statement_descriptor = charge['statement_descriptor']
-        obj.save()
+    class Meta:
+        model = StripeEvent
+
+    def has_add_permission(self, request):
+        return False
+
+    def retry_failed(self, request, queryset):
+        """Queues the selected failed events to be applied again."""
+        queryset.filter(status=StripeEvent.FAILED) \
+            .update(status=StripeEvent.PENDING)
+        enqueue(apply_pending_events)
+        messages.add_message(
+            request, messages.SUCCESS, _('Failed events are being retried.'))
+    retry_failed.short_description = _("Retry failed events")
+
+
+@admin.register(RegistrationIntent)
+class RegistrationIntentAdmin(admin.ModelAdmin):
+    list_display = ('email', 'event', 'amount', 'status', 'attempts',
+                    'created',)
+    list_filter = ('status', 'created',)
+    readonly_fields = ('key', 'event', 'hold', 'email', 'first_name',
+                       'last_name', 'amount', 'stripe_token',
+                       'idempotency_key', 'charge', 'status', 'attempts',
+                       'error', 'created', 'modified',)
+    search_fields = ('email', 'event__name',)
+    raw_id_fields = ('event', 'hold', 'charge',)
+
+    class Meta:
+        model = RegistrationIntent
+
+    def has_add_permission(self, request):
+        return False
+
+
+class RefundInline(admin.TabularInline):
+    model = Refund
+    extra = 0
+    can_delete = False
+    fields = ('charge', 'refund_id', 'amount', 'status', 'error', 'created',)
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(RefundBatch)
+class RefundBatchAdmin(admin.ModelAdmin):
+    list_display = ('id', 'event', 'status', 'refunded_count', 'failed_count',
+                    'amount_refunded', 'created', 'finished_at',)
+    list_display_links = ('id', 'event',)
+    list_filter = ('status', 'created',)
+    fields = ('event', 'reason', 'status', 'refunded_count', 'failed_count',
+              'amount_refunded', 'report', 'created', 'modified',
+              'finished_at',)
+    readonly_fields = fields
+    inlines = [RefundInline]
+    actions = ('resume', 'retry_failed',)
+
+    class Meta:
+        model = RefundBatch
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        return [
+            url(r'^(?P<pk>\d+)/report/$',
+                self.admin_site.admin_view(self.report_view),
+                name='billing_refundbatch_report'),
+        ] + super(RefundBatchAdmin, self).get_urls()
+
+    def report(self, obj):
+        return format_html(
+            '<a href="{0}">{1}</a>',
+            reverse('admin:billing_refundbatch_report', args=[obj.pk]),
+            _('Download CSV'))
+    report.short_description = _('Report')
+
+    def report_view(self, request, pk):
+        """Downloads the outcome of every refund of the batch."""
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        batch = get_object_or_404(RefundBatch, pk=pk)
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = \
+            'attachment; filename="refunds-{0}.csv"'.format(batch.pk)
+        write_report(batch, response)
+        return response
+
+    def resume(self, request, queryset):
+        """Continues unfinished batches with the charges still paid."""
+        for batch in queryset.exclude(status__in=[RefundBatch.REFUNDED,
+                                                  RefundBatch.FAILED]):
+            resume_batch(batch)
+        messages.add_message(
+            request, messages.SUCCESS, _('Refunds have been resumed.'))
+    resume.short_description = _("Resume refunds")
+
+    def retry_failed(self, request, queryset):
+        """Refunds again the charges that failed in the selected batches."""
+        for batch in queryset.filter(status=RefundBatch.FAILED):
+            retry_failed_refunds(batch)
+        messages.add_message(
+            request, messages.SUCCESS, _('Failed refunds are being retried.'))
+    retry_failed.short_description = _("Retry failed refunds")
@@ -5,3 +5,8 @@ from django.apps import AppConfig
 
 class BillingConfig(AppConfig):
     name = 'billing'
+
+    def ready(self):
+        from .client import configure
+        configure()
+        from . import signals  # noqa
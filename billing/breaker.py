@@ -0,0 +1,187 @@
+"""
+Circuit breakers around Stripe operations.
+
+Every Stripe request made through `billing.utils.call` passes through the
+breaker of its operation (e.g. 'charge.create', 'customer.save'). After
+enough consecutive outage-type failures (connection errors, timeouts,
+5xx responses) the breaker opens, and calls fail at once with
+PaymentsUnavailable instead of each waiting out its timeouts. Once the
+reset timeout has passed a single probe request is let through (half
+open): if it succeeds the breaker closes, otherwise it opens again.
+
+Card declines and other 4xx errors are the caller's problem, not
+Stripe's, and never trip a breaker. Breakers are kept per worker
+process.
+
+Settings:
+
+    STRIPE_BREAKER_THRESHOLD      failures that open a breaker (default 5)
+    STRIPE_BREAKER_THRESHOLDS     per-operation overrides, e.g.
+                                  {'charge.create': 3}
+    STRIPE_BREAKER_RESET_SECONDS  seconds before probing again (default 30)
+"""
+
+import threading
+import time
+
+import stripe
+
+from django.conf import settings
+
+# Create your breakers here.
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class PaymentsUnavailable(Exception):
+    """Raised instead of calling Stripe while the operation's breaker is
+    open."""
+
+    def __init__(self, operation, retry_after=None):
+        super(PaymentsUnavailable, self).__init__(
+            'Stripe {0} calls are temporarily disabled.'.format(operation))
+        self.operation = operation
+        self.retry_after = retry_after
+
+
+def is_outage(error):
+    """Whether the error says Stripe is down or slow, as opposed to the
+    request being wrong."""
+    if isinstance(error, stripe.error.APIConnectionError):
+        return True
+    status = getattr(error, 'http_status', None)
+    return isinstance(error, stripe.error.APIError) and \
+        not isinstance(error, stripe.error.RateLimitError) and \
+        (status is None or status >= 500)
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self.rejected = 0
+        self._probing = False
+
+    def before_call(self):
+        """Raises PaymentsUnavailable unless a request may be made now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.time()
+            if self.state == OPEN and remaining <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                # Only one request finds out whether Stripe is back.
+                self._probing = True
+                return
+            self.rejected += 1
+            raise PaymentsUnavailable(self.name, max(remaining, 1))
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self, error):
+        with self._lock:
+            if not is_outage(error):
+                # Stripe answered, so it is up.
+                if self.state == HALF_OPEN:
+                    self.state = CLOSED
+                    self.opened_at = None
+                self.failures = 0
+                self._probing = False
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.trips += 1
+                self.state = OPEN
+                self.opened_at = time.time()
+                self._probing = False
+
+    @property
+    def is_open(self):
+        """Whether calls would currently be rejected, without taking the
+        half-open probe."""
+        with self._lock:
+            if self.state == OPEN:
+                return time.time() < self.opened_at + self.reset_timeout
+            return self.state == HALF_OPEN and self._probing
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'failure_threshold': self.failure_threshold,
+                'trips': self.trips,
+                'rejected': self.rejected,
+                'opened_at': self.opened_at,
+            }
+
+
+def operation_name(func):
+    """Names the Stripe operation a bound stripe-python method performs,
+    e.g. 'charge.create' for stripe.Charge.create."""
+    owner = getattr(func, '__self__', None)
+    if owner is None:
+        return 'stripe.{0}'.format(getattr(func, '__name__', 'call'))
+    resource = owner if isinstance(owner, type) else type(owner)
+    class_name = getattr(resource, 'class_name', None)
+    prefix = class_name() if class_name else resource.__name__.lower()
+    return '{0}.{1}'.format(prefix, getattr(func, '__name__', 'call'))
+
+
+def get_breaker(operation):
+    breaker = _breakers.get(operation)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(operation)
+            if breaker is None:
+                thresholds = getattr(settings, 'STRIPE_BREAKER_THRESHOLDS', {})
+                breaker = CircuitBreaker(
+                    operation,
+                    failure_threshold=thresholds.get(
+                        operation,
+                        getattr(settings, 'STRIPE_BREAKER_THRESHOLD', 5)),
+                    reset_timeout=getattr(
+                        settings, 'STRIPE_BREAKER_RESET_SECONDS', 30))
+                _breakers[operation] = breaker
+    return breaker
+
+
+def is_available(*operations):
+    """Whether none of the operations' breakers is open, for views that
+    want to degrade before starting any work."""
+    return not any(_breakers[operation].is_open for operation in operations
+                   if operation in _breakers)
+
+
+def stats():
+    """Returns the state and trip counts of every breaker in this
+    process."""
+    return dict((name, breaker.stats())
+                for name, breaker in sorted(_breakers.items()))
+
+
+def reset():
+    """Forgets every breaker, e.g. between tests."""
+    with _breakers_lock:
+        _breakers.clear()
@@ -0,0 +1,88 @@
+"""
+Bulk Stripe tasks for admin actions and management commands.
+
+The Stripe requests of each task run on a StripeExecutor. The results
+are written back from the calling thread with `reconcile.apply_changes`,
+one CASE UPDATE per chunk of rows, so a few thousand objects take
+minutes and a handful of queries rather than hours of serial calls.
+"""
+
+import logging
+
+import stripe
+
+from django.utils import timezone
+
+from .executor import StripeExecutor
+from .mirror import remember
+from .models import Charge, Subscription
+from .reconcile import Change, apply_changes
+from .signals import update_rows
+from .utils import call, cancel_stripe_sub, charge_values, subscription_values
+
+# Create your bulk tasks here.
+
+
+logger = logging.getLogger(__name__)
+
+CHARGE_FIELDS = ('amount_refunded', 'paid', 'refunded', 'captured',
+                 'disputed')
+
+
+def _retrieve_charge(charge_id):
+    return remember(call(stripe.Charge.retrieve, charge_id))
+
+
+def refresh_charges(charge_pks, executor=None, progress=None):
+    """Reads the charges back from Stripe and corrects any local drift.
+    Returns the BulkReport and the changes written."""
+    rows = dict((row['charge_id'], row) for row in Charge.objects
+                .filter(pk__in=charge_pks)
+                .exclude(charge_id__isnull=True)
+                .values('pk', 'charge_id', *CHARGE_FIELDS))
+    report = (executor or StripeExecutor()).map(_retrieve_charge, list(rows),
+                                                progress=progress)
+
+    changes = []
+    for result in report.succeeded:
+        row = rows[result.item]
+        changed = dict((name, value)
+                       for name, value in charge_values(result.value).items()
+                       if row[name] != value)
+        if changed:
+            changes.append(Change(row['pk'], result.item, changed))
+    apply_changes(Charge, changes)
+    logger.info('Refreshed %d charges (%d changed, %d failed) in %.1fs.',
+                report.total, len(changes), len(report.failed),
+                report.elapsed)
+    return report, changes
+
+
+def cancel_subscriptions(subscription_pks, at_period_end=False,
+                         executor=None, progress=None):
+    """Cancels the subscriptions on Stripe and records the outcome
+    locally. Returns the BulkReport."""
+    subscriptions = Subscription.objects.filter(pk__in=subscription_pks)
+    if not at_period_end:
+        # Free memberships never made it to Stripe.
+        now = timezone.now()
+        local_pks = list(subscriptions.filter(sub_id__isnull=True)
+                                      .exclude(status='canceled')
+                                      .values_list('pk', flat=True))
+        update_rows(Subscription, local_pks, status='canceled',
+                    canceled_at=now, ended_at=now, modified=now)
+
+    rows = dict(subscriptions.exclude(sub_id__isnull=True)
+                             .values_list('sub_id', 'pk'))
+    report = (executor or StripeExecutor()).map(
+        lambda sub_id: cancel_stripe_sub(sub_id, at_period_end=at_period_end),
+        list(rows), progress=progress)
+
+    # A None result is a subscription Stripe no longer has.
+    apply_changes(Subscription, [
+        Change(rows[result.item], result.item,
+               subscription_values(result.value))
+        for result in report.succeeded if result.value is not None])
+    logger.info('Canceled %d subscriptions (%d failed) in %.1fs.',
+                report.total, len(report.failed), report.elapsed)
+    return report
@@ -0,0 +1,170 @@
+"""
+The HTTP client every Stripe call in this process goes through.
+
+stripe-python opens a fresh connection for most requests when left to
+its defaults, which costs a TLS handshake per round trip. `configure`
+(called from BillingConfig.ready) installs a single PooledHTTPClient per
+worker process instead: a requests Session whose keep-alive connections
+are reused across calls, with explicit connect and read timeouts.
+
+Settings:
+
+    STRIPE_POOL_SIZE        connections kept open per host (default 10)
+    STRIPE_CONNECT_TIMEOUT  seconds to establish a connection (default 5)
+    STRIPE_READ_TIMEOUT     seconds to wait for a response (default 30)
+    STRIPE_API_BASE         API root, e.g. a billing.fakestripe server
+
+Inside a `deadline` block the timeouts are also shortened to whatever is
+left of the caller's time budget.
+"""
+
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+import requests
+import stripe
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+# Create your clients here.
+
+
+_client = None
+_client_lock = threading.Lock()
+_local = threading.local()
+
+
+@contextmanager
+def deadline(give_up_at):
+    """Bounds every request made in the block by the `give_up_at`
+    timestamp."""
+    previous = getattr(_local, 'give_up_at', None)
+    _local.give_up_at = give_up_at if previous is None \
+        else min(previous, give_up_at)
+    try:
+        yield
+    finally:
+        _local.give_up_at = previous
+
+
+class PooledHTTPClient(stripe.http_client.HTTPClient):
+    name = 'requests-pooled'
+
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=30,
+                 **kwargs):
+        super(PooledHTTPClient, self).__init__(**kwargs)
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self._lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._requests = 0
+        self._errors = 0
+        self._request_seconds = 0.0
+
+    def _get_session(self):
+        with self._lock:
+            # Pooled sockets must not be shared with a forked child.
+            if self._session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self.pool_size,
+                                      max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+                self._session_pid = os.getpid()
+                self._reset_stats()
+            return self._session
+
+    def _timeout(self):
+        give_up_at = getattr(_local, 'give_up_at', None)
+        if give_up_at is None:
+            return self.timeout
+        remaining = give_up_at - time.time()
+        if remaining <= 0:
+            raise stripe.error.APIConnectionError(
+                'Gave up on Stripe: the time budget for this call is spent.')
+        return (min(self.timeout[0], remaining),
+                min(self.timeout[1], remaining))
+
+    def request(self, method, url, headers, post_data=None):
+        session = self._get_session()
+        timeout = self._timeout()
+        proxy = getattr(self, '_proxy', None)
+        started = time.time()
+        try:
+            response = session.request(
+                method, url, headers=headers, data=post_data,
+                timeout=timeout, proxies=proxy,
+                verify=getattr(self, '_verify_ssl_certs', True))
+        except requests.exceptions.RequestException as e:
+            with self._lock:
+                self._errors += 1
+            raise stripe.error.APIConnectionError(
+                'Could not connect to Stripe ({0}: {1}).'.format(
+                    e.__class__.__name__, e))
+        finally:
+            with self._lock:
+                self._requests += 1
+                self._request_seconds += time.time() - started
+        return response.content, response.status_code, response.headers
+
+    def stats(self):
+        """Returns connection reuse metrics for this process."""
+        connections = 0
+        pooled_requests = 0
+        session = self._session if self._session_pid == os.getpid() else None
+        if session is not None:
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools[key]
+                    connections += pool.num_connections
+                    pooled_requests += pool.num_requests
+
+        requests_made = self._requests
+        return {
+            'pid': os.getpid(),
+            'requests': requests_made,
+            'errors': self._errors,
+            'connections_opened': connections,
+            'connections_reused': max(pooled_requests - connections, 0),
+            'reuse_ratio': round(1 - float(connections) / pooled_requests, 3)
+            if pooled_requests else None,
+            'avg_request_ms': round(
+                self._request_seconds * 1000 / requests_made, 1)
+            if requests_made else None,
+            'pool_size': self.pool_size,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+        }
+
+
+def get_client():
+    """Returns this process's Stripe HTTP client."""
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PooledHTTPClient(
+                    pool_size=getattr(settings, 'STRIPE_POOL_SIZE', 10),
+                    connect_timeout=getattr(settings,
+                                            'STRIPE_CONNECT_TIMEOUT', 5),
+                    read_timeout=getattr(settings, 'STRIPE_READ_TIMEOUT', 30))
+    return _client
+
+
+def configure():
+    """Points the stripe module at our key and pooled client."""
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.api_base = getattr(settings, 'STRIPE_API_BASE', stripe.api_base)
+    stripe.default_http_client = get_client()
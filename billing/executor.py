@@ -0,0 +1,172 @@
+"""
+Runs bulk Stripe work on a bounded pool of threads.
+
+`StripeExecutor.map(func, items)` calls `func(item)` for every item on
+STRIPE_BULK_WORKERS threads and returns a BulkReport with one Result per
+item, in the order of the items. A failing item never stops the others.
+
+Every Stripe request the workers make through `billing.utils.call` first
+takes a token from the executor's TokenBucket, which keeps the whole
+pool under STRIPE_BULK_RATE requests a second. A 429 halves the rate and
+pauses the pool for the response's Retry-After; each success then wins
+back a little of the rate, so the pool settles just under what Stripe
+allows.
+
+`func` should only talk to Stripe. Write the results back from the
+report in the calling thread, in bulk, so the workers never hold
+database connections.
+
+Settings:
+
+    STRIPE_BULK_WORKERS  threads per executor (default 8)
+    STRIPE_BULK_RATE     requests a second across the pool (default 20;
+                         Stripe allows 25 in test mode and 100 live)
+    STRIPE_BULK_BURST    requests that may be sent at once (default the
+                         rate)
+"""
+
+import logging
+import threading
+import time
+
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+
+# Create your executor here.
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+Result = namedtuple('Result', ['item', 'value', 'error'])
+
+
+class TokenBucket(object):
+    """Hands out `rate` tokens a second, at most `capacity` at a time,
+    adjusting the rate to the 429s Stripe answers with."""
+
+    def __init__(self, rate, capacity=None, min_rate=1):
+        self.max_rate = self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.paused_until = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Blocks until a request may be sent. Returns the seconds
+        waited."""
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.time()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = max(self.paused_until - now,
+                            (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def slow_down(self, retry_after=0):
+        """Halves the rate after a 429 and holds every request back for
+        `retry_after` seconds."""
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            self.paused_until = max(self.paused_until, now + retry_after)
+            self.throttled += 1
+
+    def speed_up(self):
+        """Wins back a twentieth of the full rate after a success."""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(time.time())
+                self.rate = min(self.max_rate,
+                                self.rate + self.max_rate / 20)
+
+
+def current_bucket():
+    """The bucket of the executor running on this thread, if any."""
+    return getattr(_local, 'bucket', None)
+
+
+class BulkReport(object):
+    """The per-item results of an executor run."""
+
+    def __init__(self, total):
+        self.total = total
+        self.results = []
+        self.elapsed = 0
+        self.throttled = 0
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.error is None]
+
+    @property
+    def failed(self):
+        return [result for result in self.results
+                if result.error is not None]
+
+
+class StripeExecutor(object):
+
+    def __init__(self, workers=None, rate=None, burst=None):
+        self.workers = workers or getattr(settings, 'STRIPE_BULK_WORKERS', 8)
+        self.bucket = TokenBucket(
+            rate or getattr(settings, 'STRIPE_BULK_RATE', 20),
+            burst or getattr(settings, 'STRIPE_BULK_BURST', None))
+
+    def _run(self, func, index, item):
+        _local.bucket = self.bucket
+        try:
+            return index, Result(item, func(item), None)
+        except Exception as e:
+            logger.warning('Bulk Stripe call for %r failed: %s', item, e)
+            return index, Result(item, None, e)
+        finally:
+            _local.bucket = None
+
+    def map(self, func, items, progress=None):
+        """Runs `func(item)` for every item and returns a BulkReport.
+        `progress(done, total)` is called from the calling thread as
+        items finish."""
+        items = list(items)
+        report = BulkReport(len(items))
+        if not items:
+            return report
+
+        started = time.time()
+        throttled = self.bucket.throttled
+        results = [None] * len(items)
+        pool = ThreadPool(min(self.workers, len(items)))
+        try:
+            done = 0
+            for index, result in pool.imap_unordered(
+                    lambda args: self._run(func, *args), enumerate(items)):
+                results[index] = result
+                done += 1
+                if progress is not None:
+                    progress(done, len(items))
+        finally:
+            pool.close()
+            pool.join()
+
+        report.results = results
+        report.elapsed = time.time() - started
+        report.throttled = self.bucket.throttled - throttled
+        return report
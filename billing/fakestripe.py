@@ -0,0 +1,588 @@
+"""
+An in-process stand-in for the parts of the Stripe API billing uses.
+
+FakeStripeServer keeps plans, customers, cards, tokens, subscriptions,
+charges and refunds in memory and answers in Stripe's wire format, so the stripe
+library cannot tell the difference. Point it at the server with
+
+    STRIPE_API_BASE = 'http://127.0.0.1:12111'
+
+(see `manage.py run_fake_stripe`), or start one for a test case with
+FakeStripeTestMixin.
+
+`latency` (plus up to `jitter`) seconds are added to every response.
+`error_rate` and `rate_limit_rate` are the fractions of requests
+answered with a 500 or a 429, for exercising retries. The card number
+4000000000000002 is always declined.
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+import stripe
+
+from django.core.cache import cache
+from django.utils.six.moves import BaseHTTPServer, socketserver
+from django.utils.six.moves.urllib.parse import parse_qsl, urlparse
+
+from . import breaker
+
+# Create your fake Stripe here.
+
+
+DECLINED_CARD = '4000000000000002'
+
+KEY_RE = re.compile(r'^([^\[]+)((?:\[[^\]]*\])*)$')
+
+
+def parse_form(body):
+    """Decodes Stripe's bracketed form encoding (`card[number]=...`,
+    `items[0][plan]=...`) into nested dicts."""
+    params = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        match = KEY_RE.match(key)
+        if not match:
+            continue
+        path = [match.group(1)] + re.findall(r'\[([^\]]*)\]', match.group(2))
+        target = params
+        for name in path[:-1]:
+            target = target.setdefault(name, {})
+        target[path[-1]] = value
+    return params
+
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _bool(value):
+    return value in (True, 'true', 'True', '1')
+
+
+class StripeError(Exception):
+    def __init__(self, status, error_type, message, param=None, code=None,
+                 headers=None):
+        super(StripeError, self).__init__(message)
+        self.status = status
+        self.headers = headers or {}
+        self.body = {'error': {'type': error_type, 'message': message}}
+        if param:
+            self.body['error']['param'] = param
+        if code:
+            self.body['error']['code'] = code
+
+
+def not_found(resource, object_id):
+    return StripeError(404, 'invalid_request_error',
+                       'No such {0}: {1}'.format(resource, object_id),
+                       param='id')
+
+
+class FakeStripe(object):
+    """The in-memory state and the endpoint implementations."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.objects = {}
+            self.order = []
+            self.idempotent = {}
+            self.requests = 0
+
+    def new_id(self, prefix):
+        return '{0}_{1}'.format(prefix, uuid.uuid4().hex[:24])
+
+    def store(self, obj):
+        if obj['id'] not in self.objects:
+            self.order.append(obj['id'])
+        self.objects[obj['id']] = obj
+        return obj
+
+    def get(self, object_name, object_id):
+        obj = self.objects.get(object_id)
+        if obj is None or obj['object'] != object_name or \
+                obj.get('deleted'):
+            raise not_found(object_name, object_id)
+        return obj
+
+    def list(self, object_name, params, match=None):
+        """Pages through the objects in creation order, newest first, like
+        Stripe's list endpoints."""
+        limit = min(_int(params.get('limit'), 10), 100)
+        items = [self.objects[pk] for pk in reversed(self.order)
+                 if self.objects[pk]['object'] == object_name and
+                 not self.objects[pk].get('deleted') and
+                 (match is None or match(self.objects[pk]))]
+        after = params.get('starting_after')
+        if after:
+            ids = [item['id'] for item in items]
+            items = items[ids.index(after) + 1:] if after in ids else []
+        return {'object': 'list', 'url': '/v1/{0}s'.format(object_name),
+                'data': items[:limit], 'has_more': len(items) > limit}
+
+    # Plans
+
+    def create_plan(self, params):
+        plan_id = params.get('id') or self.new_id('plan')
+        if plan_id in self.objects and \
+                not self.objects[plan_id].get('deleted'):
+            raise StripeError(400, 'invalid_request_error',
+                              'Plan already exists.', param='id')
+        return self.store({
+            'id': plan_id, 'object': 'plan', 'created': int(time.time()),
+            'livemode': False, 'name': params.get('name'),
+            'amount': _int(params.get('amount')),
+            'currency': params.get('currency', 'usd'),
+            'interval': params.get('interval'),
+            'interval_count': _int(params.get('interval_count'), 1),
+            'metadata': params.get('metadata') or {},
+            'statement_descriptor': params.get('statement_descriptor') or None,
+            'trial_period_days': _int(params.get('trial_period_days')) or None,
+        })
+
+    def update_plan(self, plan_id, params):
+        plan = self.get('plan', plan_id)
+        for name in ('name', 'statement_descriptor'):
+            if name in params:
+                plan[name] = params[name] or None
+        if 'trial_period_days' in params:
+            plan['trial_period_days'] = \
+                _int(params['trial_period_days']) or None
+        if 'metadata' in params:
+            plan['metadata'] = params['metadata'] or {}
+        return plan
+
+    # Customers and cards
+
+    def card(self, params, customer=None):
+        number = re.sub(r'\D', '', params.get('number', ''))
+        if len(number) < 12:
+            raise StripeError(402, 'card_error',
+                              'Your card number is incorrect.',
+                              param='number', code='incorrect_number')
+        return {
+            'id': self.new_id('card'), 'object': 'card',
+            'brand': 'Visa', 'last4': number[-4:],
+            'fingerprint': hashlib.sha1(number.encode('utf-8'))
+                                  .hexdigest()[:16],
+            'exp_month': _int(params.get('exp_month')),
+            'exp_year': _int(params.get('exp_year')),
+            'name': params.get('name'), 'customer': customer,
+            'address_city': params.get('address_city'),
+            'address_line1': params.get('address_line1'),
+            'address_zip': params.get('address_zip'),
+            '_declined': number == DECLINED_CARD,
+        }
+
+    def _sources(self, customer):
+        cards = [dict((k, v) for k, v in card.items() if not k.startswith('_'))
+                 for card in customer['_cards']]
+        return {'object': 'list', 'data': cards,
+                'has_more': False, 'total_count': len(customer['_cards']),
+                'url': '/v1/customers/{0}/sources'.format(customer['id'])}
+
+    def render_customer(self, customer):
+        rendered = dict((k, v) for k, v in customer.items()
+                        if not k.startswith('_'))
+        rendered['sources'] = self._sources(customer)
+        return rendered
+
+    def create_customer(self, params):
+        customer = self.store({
+            'id': self.new_id('cus'), 'object': 'customer',
+            'created': int(time.time()), 'livemode': False,
+            'account_balance': _int(params.get('account_balance')),
+            'currency': None, 'default_source': None,
+            'description': params.get('description') or None,
+            'email': params.get('email') or None,
+            'metadata': params.get('metadata') or {},
+            'shipping': params.get('shipping') or None,
+            '_cards': [],
+        })
+        if params.get('source'):
+            self.add_source(customer['id'], {'source': params['source']})
+        return customer
+
+    def update_customer(self, customer_id, params):
+        customer = self.get('customer', customer_id)
+        for name in ('description', 'email', 'shipping'):
+            if name in params:
+                customer[name] = params[name] or None
+        if 'account_balance' in params:
+            customer['account_balance'] = _int(params['account_balance'])
+        if 'metadata' in params:
+            customer['metadata'] = params['metadata'] or {}
+        if params.get('source'):
+            # Updating the source replaces the default card.
+            card = self.add_source(customer_id, {'source': params['source']})
+            customer['default_source'] = card['id']
+        return customer
+
+    def add_source(self, customer_id, params):
+        customer = self.get('customer', customer_id)
+        source = self._source_ref(params.get('source'))
+        if isinstance(source, dict):
+            card = self.card(source, customer=customer_id)
+        else:
+            card = dict(self.token_card(source), customer=customer_id)
+        customer['_cards'].append(card)
+        if not customer['default_source']:
+            customer['default_source'] = card['id']
+        return card
+
+    def _source_ref(self, source):
+        """Returns a token id for token references, or the raw card
+        details."""
+        if isinstance(source, dict) and source.get('id'):
+            return source['id']
+        return source
+
+    def create_token(self, params):
+        return self.store({
+            'id': self.new_id('tok'), 'object': 'token',
+            'created': int(time.time()), 'livemode': False,
+            'type': 'card', 'used': False,
+            'card': self.card(params.get('card') or {}),
+        })
+
+    def token_card(self, token_id):
+        token = self.get('token', token_id)
+        if token['used']:
+            raise StripeError(400, 'invalid_request_error',
+                              'You cannot use a Stripe token more than '
+                              'once: {0}.'.format(token_id))
+        token['used'] = True
+        return token['card']
+
+    # Subscriptions
+
+    def create_subscription(self, params):
+        customer = self.get('customer', params.get('customer'))
+        plan = self.get('plan', params.get('plan'))
+        now = int(time.time())
+        trial_days = _int(params.get('trial_period_days')) or \
+            plan['trial_period_days'] or 0
+        trial_end = _int(params.get('trial_end')) or \
+            (now + trial_days * 86400 if trial_days else None)
+        period = 86400 * (365 if plan['interval'] == 'year' else 30) * \
+            plan['interval_count']
+        return self.store({
+            'id': self.new_id('sub'), 'object': 'subscription',
+            'created': now, 'livemode': False, 'customer': customer['id'],
+            'plan': plan, 'quantity': _int(params.get('quantity'), 1),
+            'metadata': params.get('metadata') or {},
+            'status': 'trialing' if trial_end else 'active',
+            'start': now, 'trial_start': now if trial_end else None,
+            'trial_end': trial_end, 'cancel_at_period_end': False,
+            'canceled_at': None, 'ended_at': None,
+            'current_period_start': now,
+            'current_period_end': (trial_end or now) + period,
+        })
+
+    def update_subscription(self, subscription_id, params):
+        sub = self.get('subscription', subscription_id)
+        if params.get('plan'):
+            sub['plan'] = self.get('plan', params['plan'])
+            if sub['cancel_at_period_end'] and sub['status'] != 'canceled':
+                # Setting the plan reactivates the subscription.
+                sub['cancel_at_period_end'] = False
+                sub['canceled_at'] = None
+        if 'quantity' in params:
+            sub['quantity'] = _int(params['quantity'], 1)
+        if 'metadata' in params:
+            sub['metadata'] = params['metadata'] or {}
+        return sub
+
+    def cancel_subscription(self, subscription_id, params):
+        sub = self.get('subscription', subscription_id)
+        now = int(time.time())
+        sub['canceled_at'] = now
+        if _bool(params.get('at_period_end')):
+            sub['cancel_at_period_end'] = True
+        else:
+            sub['status'] = 'canceled'
+            sub['ended_at'] = now
+        return sub
+
+    # Charges
+
+    def create_charge(self, params):
+        amount = _int(params.get('amount'))
+        if amount < 50:
+            raise StripeError(400, 'invalid_request_error',
+                              'Amount must be at least 50 cents.',
+                              param='amount')
+        source = self._source_ref(params.get('source'))
+        if isinstance(source, dict):
+            card = self.card(source)
+        elif source:
+            card = self.token_card(source)
+        elif params.get('customer'):
+            customer = self.get('customer', params['customer'])
+            if not customer['_cards']:
+                raise StripeError(402, 'card_error',
+                                  'This customer has no attached payment '
+                                  'source.', code='missing')
+            card = next(card for card in customer['_cards']
+                        if card['id'] == customer['default_source'])
+        else:
+            raise StripeError(400, 'invalid_request_error',
+                              'Must provide source or customer.')
+        if card['_declined']:
+            raise StripeError(402, 'card_error', 'Your card was declined.',
+                              code='card_declined')
+
+        card = dict((k, v) for k, v in card.items() if not k.startswith('_'))
+        return self.store({
+            'id': self.new_id('ch'), 'object': 'charge',
+            'created': int(time.time()), 'livemode': False,
+            'amount': amount, 'amount_refunded': 0,
+            'currency': params.get('currency', 'usd'),
+            'captured': params.get('capture', 'true') != 'false',
+            'paid': True, 'refunded': False, 'dispute': None,
+            'status': 'succeeded', 'source': card,
+            'customer': params.get('customer') or None,
+            'description': params.get('description') or None,
+            'receipt_email': params.get('receipt_email') or None,
+            'statement_descriptor': params.get('statement_descriptor') or None,
+            'metadata': params.get('metadata') or {},
+            'fraud_details': {}, 'shipping': None,
+        })
+
+    def update_charge(self, charge_id, params):
+        charge = self.get('charge', charge_id)
+        for name in ('description', 'receipt_email', 'shipping'):
+            if name in params:
+                charge[name] = params[name] or None
+        for name in ('metadata', 'fraud_details'):
+            if name in params:
+                charge[name] = params[name] or {}
+        return charge
+
+    # Refunds
+
+    def create_refund(self, params):
+        charge = self.get('charge', params.get('charge'))
+        remaining = charge['amount'] - charge['amount_refunded']
+        amount = _int(params.get('amount')) or remaining
+        if charge['refunded'] or amount > remaining:
+            raise StripeError(400, 'invalid_request_error',
+                              'Charge {0} has already been refunded.'.format(
+                                  charge['id']),
+                              code='charge_already_refunded')
+        charge['amount_refunded'] += amount
+        charge['refunded'] = charge['amount_refunded'] == charge['amount']
+        return self.store({
+            'id': self.new_id('re'), 'object': 'refund',
+            'created': int(time.time()), 'amount': amount,
+            'currency': charge['currency'], 'charge': charge['id'],
+            'reason': params.get('reason') or None, 'status': 'succeeded',
+            'metadata': params.get('metadata') or {},
+        })
+
+    # Routing
+
+    def handle(self, method, path, params):
+        parts = [part for part in path.split('/') if part][1:]  # drop v1
+        resource = parts[0] if parts else None
+        object_id = parts[1] if len(parts) > 1 else None
+
+        if resource == 'customers' and len(parts) == 3 and \
+                parts[2] == 'sources':
+            if method == 'POST':
+                return self.add_source(object_id, params)
+            return self._sources(self.get('customer', object_id))
+
+        routes = {
+            'plans': ('plan', self.create_plan, self.update_plan, None),
+            'customers': ('customer', self.create_customer,
+                          self.update_customer, None),
+            'tokens': ('token', self.create_token, None, None),
+            'subscriptions': ('subscription', self.create_subscription,
+                              self.update_subscription,
+                              self.cancel_subscription),
+            'charges': ('charge', self.create_charge, self.update_charge,
+                        None),
+            'refunds': ('refund', self.create_refund, None, None),
+        }
+        if resource not in routes or len(parts) > 2:
+            raise StripeError(404, 'invalid_request_error',
+                              'Unrecognized request URL ({0}: {1}).'.format(
+                                  method, path))
+        object_name, create, update, cancel = routes[resource]
+
+        if object_id is None:
+            if method == 'POST':
+                return create(params)
+            match = None
+            if params.get('customer'):
+                match = lambda obj: obj.get('customer') == params['customer']
+            return self.list(object_name, params, match)
+        elif method == 'GET':
+            return self.get(object_name, object_id)
+        elif method == 'POST' and update:
+            return update(object_id, params)
+        elif method == 'DELETE':
+            if cancel:
+                return cancel(object_id, params)
+            obj = self.get(object_name, object_id)
+            obj['deleted'] = True
+            return {'id': object_id, 'object': object_name, 'deleted': True}
+        raise StripeError(405, 'invalid_request_error',
+                          'Method not allowed.')
+
+    def render(self, obj):
+        # Deletion stubs ({'id', 'object', 'deleted'}) render as they are.
+        if isinstance(obj, dict) and obj.get('object') == 'customer' and \
+                '_cards' in obj:
+            return self.render_customer(obj)
+        if isinstance(obj, dict) and obj.get('object') == 'list':
+            return dict(obj, data=[self.render(item) for item in obj['data']])
+        if isinstance(obj, dict):
+            return dict((k, v) for k, v in obj.items()
+                        if not k.startswith('_'))
+        return obj
+
+
+class FakeStripeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+    def do_DELETE(self):
+        self.respond('DELETE')
+
+    def respond(self, method):
+        server = self.server
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        params = parse_form(body if method == 'POST' else url.query)
+        key = self.headers.get('Idempotency-Key')
+
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        fake = server.fake
+        with fake.lock:
+            fake.requests += 1
+            replay = fake.idempotent.get(key) if key else None
+        if replay is not None:
+            status, payload, headers = replay
+        else:
+            status, payload, headers = self.dispatch(method, url.path, params)
+            # Injected failures never reach the application logic, so they
+            # are not remembered under the key either.
+            if key and status not in (429, 500):
+                with fake.lock:
+                    fake.idempotent[key] = (status, payload, headers)
+
+        content = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Request-Id', 'req_{0}'.format(uuid.uuid4().hex))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def dispatch(self, method, path, params):
+        server = self.server
+        roll = random.random()
+        if roll < server.error_rate:
+            return 500, {'error': {'type': 'api_error',
+                                   'message': 'Injected server error.'}}, {}
+        elif roll < server.error_rate + server.rate_limit_rate:
+            return 429, {'error': {'type': 'rate_limit_error',
+                                   'message': 'Too many requests.'}}, \
+                {'Retry-After': '0'}
+
+        try:
+            with server.fake.lock:
+                return 200, server.fake.render(
+                    server.fake.handle(method, path, params)), {}
+        except StripeError as e:
+            return e.status, e.body, e.headers
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+
+class FakeStripeServer(socketserver.ThreadingMixIn,
+                       BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0,
+                 error_rate=0, rate_limit_rate=0, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port),
+                                           FakeStripeHandler)
+        self.fake = FakeStripe()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.verbose = verbose
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address[:2])
+
+    def start(self):
+        """Serves requests on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name='fake-stripe')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class FakeStripeTestMixin(object):
+    """Runs the test case against a fresh FakeStripeServer instead of the
+    real API."""
+    fake_stripe_options = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super(FakeStripeTestMixin, cls).setUpClass()
+        cls.fake_stripe = FakeStripeServer(**cls.fake_stripe_options).start()
+        cls._real_api_base = stripe.api_base
+        stripe.api_base = cls.fake_stripe.url
+
+    @classmethod
+    def tearDownClass(cls):
+        stripe.api_base = cls._real_api_base
+        cls.fake_stripe.stop()
+        super(FakeStripeTestMixin, cls).tearDownClass()
+
+    def setUp(self):
+        super(FakeStripeTestMixin, self).setUp()
+        self.fake_stripe.fake.reset()
+        breaker.reset()
+        # The mirror still describes the objects of the previous test.
+        cache.clear()
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from billing.webhooks import apply_pending_events, retry_failed_events
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = """Applies stored Stripe webhook events that have not been
+    applied yet, e.g. after a worker restart."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Also retry events that failed before.')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            processed = retry_failed_events()
+        else:
+            processed = apply_pending_events()
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully processed {} Stripe events.'.format(processed)))
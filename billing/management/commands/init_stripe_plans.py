@@ -1,71 +1,63 @@
-import stripe
+from django.core.management.base import BaseCommand, CommandError
 
-from django.conf import settings
-from django.core.management.base import BaseCommand
-
-from billing.models import Plan
+from billing.plan_sync import load_manifest, sync_plans
 
 # Create your commands here.
 
 
 class Command(BaseCommand):
-    help = 'Creates plans on Stripe account.'
+    help = """Creates and updates the plans listed in the plan manifest on
+    Stripe and locally."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the changes without making them.')
+        parser.add_argument('--manifest',
+                            help='Path to the plan manifest (defaults to '
+                                 'STRIPE_PLAN_MANIFEST, then '
+                                 'billing/plans.json).')
+        parser.add_argument('--workers', type=int,
+                            help='Stripe requests sent at a time.')
 
     def handle(self, *args, **options):
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-
-        plans = [
-            [
-                'Individual',
-                15000,
-                "Any person interested in the promotion and development of "
-                "the professional liability industry is eligible for "
-                "membership<br/><br/><br/><br/>"
-            ],
-            [
-                'Corporate Member',
-                100000,
-                "Must be an employee of a Corporate Sponsor\n\n"
-                "Corporate affiliates hold the same rights as an individual "
-                "member"
-            ],
-            [
-                'Future',
-                5000,
-                "Must be 35 years of age or younger and involved in the "
-                "professional liability industry\n\n"
-                "Full membership benefits, including member discounts for "
-                "event registration"
-            ],
-            [
-                'Academic',
-                0,
-                "Website access only\n\n"
-                "Must be a student or teacher at an academic institution"
-            ],
-            [
-                'Admin',
-                0,
-                "Used for administrative purposes only"
-            ]
+        try:
+            manifest = load_manifest(options['manifest'])
+        except (IOError, ValueError) as e:
+            raise CommandError('Invalid plan manifest: {}'.format(e))
+
+        report = sync_plans(manifest, dry_run=options['dry_run'],
+                            workers=options['workers'])
+        self.write_report(report, options)
+        if report.errors:
+            raise CommandError('{} plans could not be synced.'.format(
+                len(report.errors)))
+
+    def write_report(self, report, options):
+        prefix = 'Would ' if options['dry_run'] else ''
+        lines = [
+            ('create on Stripe', [spec['id'] for spec in report.create]),
+            ('update on Stripe', [c.plan_id for c in report.update]),
+            ('create locally', [spec['id'] for spec in report.local_create]),
+            ('update locally', [c.plan_id for c in report.local_update]),
         ]
-
-        for plan in plans:
-
-            if not Plan.objects.filter(name=plan[0]).exists():
-                new_p = Plan.objects.create(
-                    name=plan[0],
-                    amount=plan[1],
-                    interval='year',
-                    description=plan[2] if plan[2] else ''
-                )
-
-                if plan[0] == 'Admin':
-                    new_p.is_active = False
-                    new_p.save(update_fields=['is_active'])
-
-                self.stdout.write(
-                    self.style.WARNING('Created {} plan.'.format(new_p.name))
-                )
-        self.stdout.write(
-            self.style.SUCCESS('Successfully created all plans on Stripe.'))
+        for action, plan_ids in lines:
+            if plan_ids:
+                self.stdout.write(self.style.WARNING('{0}{1}: {2}'.format(
+                    prefix, action if prefix else action.capitalize(),
+                    ', '.join(plan_ids))))
+        for change in report.conflicts:
+            self.stdout.write(self.style.ERROR(
+                '{0}: {1} cannot change on Stripe; use a new plan id.'.format(
+                    change.plan_id, ', '.join(sorted(change.fields)))))
+        for plan_id, error in report.errors:
+            self.stdout.write(self.style.ERROR('{0}: {1}'.format(plan_id,
+                                                                 error)))
+        if report.unmanaged and options['verbosity'] > 1:
+            self.stdout.write('Not in the manifest: {}'.format(
+                ', '.join(report.unmanaged)))
+
+        if not report.has_changes:
+            self.stdout.write(self.style.SUCCESS('Plans are up to date.'))
+        elif not options['dry_run'] and not report.errors:
+            self.stdout.write(
+                self.style.SUCCESS('Successfully synced all plans.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from billing.pipeline import retry_stalled_intents
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = """Finishes paid checkouts whose background charge never
+    completed, e.g. after a worker restart or a Stripe outage."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-after', type=int, default=None,
+                            help='Seconds without progress before an '
+                                 'intent is retried (default '
+                                 'CHECKOUT_STALE_SECONDS).')
+
+    def handle(self, *args, **options):
+        retried = retry_stalled_intents(stale_after=options['stale_after'])
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully retried {} registration intents.'.format(retried)))
@@ -0,0 +1,79 @@
+import time
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.models import Charge, Customer, Subscription
+from billing.reconcile import (apply_changes, reconcile_charges,
+                               reconcile_customers, reconcile_subscriptions)
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = """Compares Stripe customers, subscriptions and charges with the
+    local rows and corrects any drift."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the drift without writing.')
+        parser.add_argument('--only', action='append',
+                            choices=('customers', 'subscriptions', 'charges'),
+                            help='Limit to one kind of object; repeatable.')
+        parser.add_argument('--since',
+                            help='Only reconcile charges created on or after '
+                                 'this date (YYYY-MM-DD).')
+        parser.add_argument('--page-size', type=int, default=100,
+                            help='Objects per Stripe list call (max 100).')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Rows written per transaction.')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = int(time.mktime(datetime.strptime(
+                    options['since'], '%Y-%m-%d').timetuple()))
+            except ValueError:
+                raise CommandError('--since must be a YYYY-MM-DD date.')
+
+        page_size = min(options['page_size'], 100)
+        kinds = [
+            ('customers', Customer,
+             lambda: reconcile_customers(page_size)),
+            ('subscriptions', Subscription,
+             lambda: reconcile_subscriptions(page_size)),
+            ('charges', Charge,
+             lambda: reconcile_charges(page_size, since=since)),
+        ]
+        for name, model, reconcile in kinds:
+            if options['only'] and name not in options['only']:
+                continue
+            started = time.time()
+            report = reconcile()
+            if report.changes and not options['dry_run']:
+                apply_changes(model, report.changes,
+                              chunk_size=options['chunk_size'])
+            self.write_report(report, time.time() - started, options)
+
+    def write_report(self, report, seconds, options):
+        verb = 'would correct' if options['dry_run'] else 'corrected'
+        self.stdout.write(
+            '{0}: {1} on Stripe, {2} {3}, {4} only on Stripe, {5} only '
+            'local ({6:.1f}s)'.format(
+                report.name, report.remote, verb, len(report.changes),
+                len(report.remote_only), len(report.local_only), seconds))
+        for field, count in sorted(report.field_counts.items()):
+            self.stdout.write('    {0}: {1}'.format(field, count))
+
+        if options['verbosity'] > 1:
+            for change in report.changes:
+                self.stdout.write('    {0} {1}'.format(
+                    change.stripe_id, ', '.join(
+                        '{0}={1!r}'.format(k, v)
+                        for k, v in sorted(change.fields.items()))))
+            for stripe_id in report.remote_only:
+                self.stdout.write('    only on Stripe: {}'.format(stripe_id))
+            for stripe_id in report.local_only:
+                self.stdout.write('    only local: {}'.format(stripe_id))
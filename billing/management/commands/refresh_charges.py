@@ -0,0 +1,56 @@
+import time
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.bulk import refresh_charges
+from billing.executor import StripeExecutor
+from billing.models import Charge
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = """Reads charges back from Stripe one by one, many at a time,
+    and corrects any local drift."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since',
+                            help='Only refresh charges created on or after '
+                                 'this date (YYYY-MM-DD).')
+        parser.add_argument('--workers', type=int,
+                            help='Threads sending Stripe requests.')
+        parser.add_argument('--rate', type=float,
+                            help='Stripe requests a second.')
+
+    def handle(self, *args, **options):
+        charges = Charge.objects.exclude(charge_id__isnull=True)
+        if options['since']:
+            try:
+                since = datetime.strptime(options['since'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError('--since must be a YYYY-MM-DD date.')
+            charges = charges.filter(charge_created__gte=since)
+
+        executor = StripeExecutor(workers=options['workers'],
+                                  rate=options['rate'])
+        started = time.time()
+
+        def progress(done, total):
+            if done % 100 == 0 or done == total:
+                self.stdout.write('{0}/{1} charges ({2:.1f}s)'.format(
+                    done, total, time.time() - started))
+
+        report, changes = refresh_charges(
+            list(charges.values_list('pk', flat=True)), executor=executor,
+            progress=progress)
+        self.stdout.write(
+            'charges: {0} read, {1} corrected, {2} failed, throttled {3} '
+            'times ({4:.1f}s)'.format(
+                len(report.succeeded), len(changes), len(report.failed),
+                report.throttled, report.elapsed))
+        if options['verbosity'] > 1:
+            for result in report.failed:
+                self.stdout.write('    {0}: {1}'.format(result.item,
+                                                        result.error))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from billing.fakestripe import FakeStripeServer
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = """Serves a local fake of the Stripe API. Set STRIPE_API_BASE to
+    the printed address to send all billing calls to it."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--latency', type=float, default=0,
+                            help='Seconds added to every response.')
+        parser.add_argument('--jitter', type=float, default=0,
+                            help='Up to this many more seconds, at random.')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='Fraction of requests answered with a 500.')
+        parser.add_argument('--rate-limit-rate', type=float, default=0,
+                            help='Fraction of requests answered with a 429.')
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer(
+            host=options['host'], port=options['port'],
+            latency=options['latency'], jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            rate_limit_rate=options['rate_limit_rate'],
+            verbose=options['verbosity'] > 1)
+        self.stdout.write(self.style.SUCCESS(
+            'Fake Stripe listening on {}'.format(server.url)))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -1,17 +1,19 @@
 import stripe
 
-from django.conf import settings
 from django.db import models
+from django.db.models import Case, Value, When
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
-from billing.utils import (convert_tstamp, get_or_create_stripe_plan,
-                           get_or_create_stripe_cus, get_or_create_stripe_sub,
-                           get_or_create_stripe_charge)
+from billing.utils import (convert_tstamp, create_stripe_plan,
+                           create_stripe_sub,
+                           create_stripe_charge, idempotency_key)
 
 # Create you managers here.
 
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+# Subscription statuses that still give access to the membership.
+LIVE_STATUSES = ('trialing', 'active', 'past_due')
 
 
 class PlanManager(models.Manager):
@@ -28,8 +30,8 @@ class PlanManager(models.Manager):
             raise ValueError(_('Plans must have an interval.'))
 
         try:
-            stripe_plan = get_or_create_stripe_plan(
-                plan_id=None, name=name, amount=amount, interval=interval,
+            stripe_plan = create_stripe_plan(
+                name=name, amount=amount, interval=interval,
                 currency=currency, interval_count=interval_count,
                 metadata=metadata, statement_descriptor=statement_descriptor,
                 trial_period_days=trial_period_days
@@ -59,23 +61,51 @@ class CustomerManager(models.Manager):
         if not user:
             raise ValueError(_('Customers must have a user.'))
 
-        try:
-            stripe_cu = get_or_create_stripe_cus(
-                customer_id=None, account_balance=account_balance,
-                description='Customer for {}'.format(user), email=user.email
-            )
-        except stripe.error.InvalidRequestError:
-            return None
-
+        # The Stripe customer is created by Customer.ensure_stripe_customer
+        # the first time something needs to be billed.
         cu = self.model(
-            user=user, cu_id=stripe_cu['id'], account_balance=account_balance,
-            currency=stripe_cu['currency'] if stripe_cu['currency'] else '',
-            description=stripe_cu['description'], email=user.email,
+            user=user, account_balance=account_balance,
+            description='Customer for {}'.format(user), email=user.email,
             **extra_fields
         )
         cu.save(using=self._db)
         return cu
 
+    def with_subscription(self):
+        """Loads the user, the current subscription and its plan along
+        with the customer, in one query."""
+        return super(CustomerManager, self).get_queryset() \
+            .select_related('user', 'current_subscription__plan')
+
+    def refresh_current_subscriptions(self, customer_pks, chunk_size=500):
+        """Points each customer at their newest live subscription, or else
+        at their newest subscription."""
+        customer_pks = list(set(customer_pks))
+        subscription_model = self.model._meta \
+            .get_field('current_subscription').related_model
+        for i in range(0, len(customer_pks), chunk_size):
+            chunk = customer_pks[i:i + chunk_size]
+            current = {}
+            subscriptions = subscription_model.objects \
+                .filter(customer__in=chunk) \
+                .annotate(ended=Case(When(status__in=LIVE_STATUSES, then=0),
+                                     default=1,
+                                     output_field=models.IntegerField())) \
+                .order_by('ended', '-start', '-pk') \
+                .values_list('customer', 'pk', 'status')
+            for customer_pk, pk, status in subscriptions:
+                current.setdefault(customer_pk, (pk, status))
+
+            self.filter(pk__in=chunk).update(
+                current_subscription=Case(
+                    *[When(pk=customer_pk, then=Value(pk))
+                      for customer_pk, (pk, status) in current.items()],
+                    default=Value(None), output_field=models.IntegerField()),
+                subscription_status=Case(
+                    *[When(pk=customer_pk, then=Value(status))
+                      for customer_pk, (pk, status) in current.items()],
+                    default=Value(''), output_field=models.CharField()))
+
 
 class SubscriptionManager(models.Manager):
     def create(self, customer, plan, metadata={}, trial_end=None, quantity=1,
@@ -86,11 +116,27 @@ class SubscriptionManager(models.Manager):
         elif not plan:
             raise ValueError(_('Subscriptions must have a plan associated.'))
 
+        if plan.amount == 0:
+            # Free plans are never billed, so they stay off Stripe.
+            sub = self.model(
+                customer=customer, plan=plan, quantity=quantity,
+                status='active', trial_period_days=trial_period_days,
+                start=timezone.now(), **extra_fields)
+            sub.save(using=self._db)
+            return sub
+
+        # Keyed on the customer's subscriptions so far: a double submit
+        # replays the same create, while subscribing again after a cancel
+        # is a new one.
+        key = idempotency_key('subscription', customer.pk,
+                              customer.created.isoformat(), plan.plan_id,
+                              quantity, self.filter(customer=customer).count())
         try:
-            stripe_sub = get_or_create_stripe_sub(
-                subscription_id=None, customer=customer.cu_id,
+            stripe_sub = create_stripe_sub(
+                customer=customer.ensure_stripe_customer(),
                 metadata=metadata, plan=plan.plan_id, quantity=quantity,
-                trial_end=trial_end, trial_period_days=trial_period_days
+                trial_end=trial_end, trial_period_days=trial_period_days,
+                key=key
             )
         except stripe.error.InvalidRequestError:
             return None
@@ -112,29 +158,39 @@ class SubscriptionManager(models.Manager):
 
 
 class ChargeManager(models.Manager):
-    def create(self, amount, source=None, currency='usd',
+    def create(self, amount, source=None, customer=None, currency='usd',
                description='', statement_descriptor='', receipt_email=None,
-               **extra_fields):
+               idempotency_key=None, **extra_fields):
 
         if not amount:
             raise ValueError(_('Charges must have an amount.'))
 
         try:
             descrip = statement_descriptor if statement_descriptor else None
-            stripe_charge = get_or_create_stripe_charge(
-                charge_id=None, amount=amount, currency=currency,
+            stripe_charge = create_stripe_charge(
+                amount=amount, currency=currency,
                 description=description, receipt_email=receipt_email,
-                source=source,
-                statement_descriptor=descrip
+                source=source, customer=customer,
+                statement_descriptor=descrip,
+                key=idempotency_key
             )
         except stripe.error.InvalidRequestError:
             return None
 
+        if stripe_charge is None:  # declined
+            return None
+
+        # A replayed idempotency key returns a charge we already stored.
+        existing = self.filter(charge_id=stripe_charge['id']).first()
+        if existing is not None:
+            return existing
+
         charge = self.model(
             amount=amount, currency=currency, description=description,
             charge_id=stripe_charge['id'],
             amount_refunded=stripe_charge['amount_refunded'],
-            paid=stripe_charge['paid'], disputed=stripe_charge['dispute'],
+            paid=stripe_charge['paid'],
+            disputed=bool(stripe_charge['dispute']),
             refunded=stripe_charge['refunded'],
             captured=stripe_charge['captured'],
             statement_descriptor=statement_descriptor,
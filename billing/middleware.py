@@ -0,0 +1,27 @@
+from django.http import JsonResponse
+from django.shortcuts import render
+from django.utils.translation import ugettext as _
+
+from .breaker import PaymentsUnavailable
+
+# Create your middleware here.
+
+
+class PaymentsUnavailableMiddleware(object):
+    """Answers with a "payments temporarily unavailable" page instead of a
+    server error when a Stripe circuit breaker is open."""
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, PaymentsUnavailable):
+            return None
+
+        if request.is_ajax():
+            response = JsonResponse(
+                {'error': _('Payments are temporarily unavailable. Please '
+                            'try again in a few minutes.')}, status=503)
+        else:
+            response = render(request, 'billing/unavailable.html',
+                              status=503)
+        if exception.retry_after:
+            response['Retry-After'] = int(exception.retry_after)
+        return response
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 20:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0009_event_search_entries'),
+        ('billing', '0002_stripe_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistrationIntent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('key', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('email', models.EmailField(max_length=120)),
+                ('first_name', models.CharField(blank=True, max_length=120)),
+                ('last_name', models.CharField(blank=True, max_length=120)),
+                ('amount', models.PositiveIntegerField(help_text='A positive integer in cents (or 0 for a free plan) representing how much to charge (on a recurring basis).')),
+                ('stripe_token', models.CharField(max_length=255)),
+                ('idempotency_key', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('confirmed', 'Confirmed'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('charge', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='billing.Charge')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='registration_intents', to='events.Event')),
+                ('hold', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='events.SeatHold')),
+            ],
+            options={
+                'verbose_name': 'registration intent',
+                'verbose_name_plural': 'registration intents',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='registrationintent',
+            index=models.Index(fields=['status', 'modified'], name='billing_intent_status_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 22:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0009_event_search_entries'),
+        ('billing', '0003_registration_intents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefundBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('reason', models.CharField(choices=[('requested_by_customer', 'Requested by customer'), ('duplicate', 'Duplicate'), ('fraudulent', 'Fraudulent')], default='requested_by_customer', max_length=25)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('refunding', 'Refunding'), ('refunded', 'Refunded'), ('failed', 'Refunded with failures')], db_index=True, default='pending', max_length=10)),
+                ('refunded_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('amount_refunded', models.PositiveIntegerField(default=0)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='refund_batches', to='events.Event')),
+            ],
+            options={
+                'verbose_name': 'refund batch',
+                'verbose_name_plural': 'refund batches',
+            },
+        ),
+        migrations.CreateModel(
+            name='Refund',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('refund_id', models.SlugField(blank=True, max_length=255, null=True)),
+                ('amount', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(choices=[('refunded', 'Refunded'), ('failed', 'Failed')], max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='refunds', to='billing.RefundBatch')),
+                ('charge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='refunds', to='billing.Charge')),
+            ],
+            options={
+                'ordering': ('pk',),
+                'verbose_name': 'refund',
+                'verbose_name_plural': 'refunds',
+            },
+        ),
+    ]
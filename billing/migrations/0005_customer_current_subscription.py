@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 00:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+LIVE_STATUSES = ('trialing', 'active', 'past_due')
+
+
+def set_current_subscriptions(apps, schema_editor):
+    Customer = apps.get_model('billing', 'Customer')
+    Subscription = apps.get_model('billing', 'Subscription')
+
+    current = {}
+    subscriptions = Subscription.objects \
+        .order_by('customer', 'start', 'pk') \
+        .values_list('customer', 'pk', 'status')
+    for customer_pk, pk, status in subscriptions.iterator():
+        # Later subscriptions win, unless only an earlier one is live.
+        previous = current.get(customer_pk)
+        if previous is None or status in LIVE_STATUSES or \
+                previous[1] not in LIVE_STATUSES:
+            current[customer_pk] = (pk, status)
+
+    for customer_pk, (pk, status) in current.items():
+        Customer.objects.filter(pk=customer_pk).update(
+            current_subscription=pk, subscription_status=status)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0004_refund_batches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='current_subscription',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='billing.Subscription'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='subscription_status',
+            field=models.CharField(blank=True, editable=False, max_length=25),
+        ),
+        migrations.RunPython(set_current_subscriptions,
+                             migrations.RunPython.noop),
+    ]
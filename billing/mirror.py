@@ -0,0 +1,71 @@
+"""
+A local mirror of the last known state of Stripe objects.
+
+Every object the billing helpers create, update or receive is stored in
+the Django cache under its Stripe object type and id. Updates compare the
+wanted values against the mirror to trim the fields they send, but the
+request itself is always sent, so a stale entry can never swallow a
+write.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Create your mirror here.
+
+
+MIRROR_KEY = 'billing:stripe:{0}:{1}'
+
+
+def _key(object_name, object_id):
+    return MIRROR_KEY.format(object_name, object_id)
+
+
+def _plain(value):
+    """Converts StripeObjects (dict subclasses) into plain, picklable
+    values."""
+    if isinstance(value, dict):
+        return dict((k, _plain(v)) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    return value
+
+
+def remember(obj):
+    """Stores the Stripe object in the mirror and returns it."""
+    if obj is not None and obj.get('id') and obj.get('object'):
+        cache.set(_key(obj['object'], obj['id']), _plain(obj),
+                  getattr(settings, 'STRIPE_MIRROR_SECONDS', 24 * 60 * 60))
+    return obj
+
+
+def recall(object_name, object_id):
+    """Returns the last known state of the object as a dict, or None."""
+    if not object_id:
+        return None
+    return cache.get(_key(object_name, object_id))
+
+
+def forget(object_name, object_id):
+    if object_id:
+        cache.delete(_key(object_name, object_id))
+
+
+def changed_fields(object_name, object_id, fields):
+    """Returns the subset of `fields` that differs from the mirrored
+    object; all of them if the object is not mirrored."""
+    known = recall(object_name, object_id)
+    if known is None:
+        return dict(fields)
+
+    changed = {}
+    for name, value in fields.items():
+        current = known.get(name)
+        # Expanded references (e.g. a subscription's plan) are compared
+        # by id.
+        if isinstance(current, dict) and 'id' in current and \
+                not isinstance(value, dict):
+            current = current['id']
+        if current != value:
+            changed[name] = value
+    return changed
@@ -1,14 +1,18 @@
 from __future__ import unicode_literals
 
+import uuid
+
 from django.conf import settings
 from django.contrib.humanize.templatetags.humanize import intcomma
 from django.db import models
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 
 from core.models import TimeStampedModel
 from .managers import (PlanManager, CustomerManager, ChargeManager,
                        SubscriptionManager)
+from .utils import attach_stripe_source, create_stripe_cus, idempotency_key
 
 # Create your models here.
 
@@ -79,6 +83,12 @@ class Customer(TimeStampedModel):
     description = models.TextField(blank=True)
     email = models.EmailField(max_length=120)
     auto_renew = models.BooleanField(default=True)
+    # Denormalized from the subscriptions by billing.signals.
+    current_subscription = models.ForeignKey(
+        'Subscription', on_delete=models.SET_NULL, related_name='+',
+        null=True, blank=True, editable=False)
+    subscription_status = models.CharField(max_length=25, blank=True,
+                                           editable=False)
 
     is_active = models.BooleanField(default=True)
 
@@ -92,6 +102,31 @@ class Customer(TimeStampedModel):
     def __str__(self):
         return str(self.user)
 
+    def ensure_stripe_customer(self, source=None):
+        """Returns the Stripe customer id, creating the Stripe customer
+        first if this customer has never been billed. A `source` (card
+        token) is attached in the same request."""
+        if self.cu_id:
+            if source:
+                attach_stripe_source(self.cu_id, source)
+            return self.cu_id
+
+        # The create is keyed on this row and the source, so concurrent
+        # callers end up with the same Stripe customer, while a customer
+        # deleted and signed up again gets a new one. `created` tells rows
+        # apart when the database reuses a pk.
+        description = self.description or 'Customer for {}'.format(self.user)
+        stripe_cu = create_stripe_cus(
+            account_balance=self.account_balance, description=description,
+            email=self.email, source=source or {},
+            key=idempotency_key('customer', self.pk, self.created.isoformat(),
+                                source or ''))
+        Customer.objects.filter(pk=self.pk, cu_id__isnull=True).update(
+            cu_id=stripe_cu['id'], currency=stripe_cu['currency'] or '',
+            modified=timezone.now())
+        self.refresh_from_db(fields=['cu_id', 'currency', 'modified'])
+        return self.cu_id
+
 
 @python_2_unicode_compatible
 class Subscription(TimeStampedModel):
@@ -160,3 +195,169 @@ class Charge(models.Model):
 
     def __str__(self):
         return str(self.charge_id)
+
+
+@python_2_unicode_compatible
+class StripeEvent(models.Model):
+    """A webhook event as received from Stripe. Events are stored as soon
+    as they arrive and applied to the local rows later, in order, by
+    billing.webhooks."""
+    PENDING = 'pending'
+    APPLIED = 'applied'
+    IGNORED = 'ignored'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('Pending')),
+        (APPLIED, _('Applied')),
+        (IGNORED, _('Ignored')),
+        (FAILED, _('Failed')),
+    )
+
+    event_id = models.SlugField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    object_id = models.SlugField(max_length=255, blank=True)
+    event_created = models.DateTimeField()
+    payload = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    received = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'billing'
+        indexes = [
+            models.Index(fields=['status', 'event_created', 'id'],
+                         name='billing_event_pending_idx'),
+            models.Index(fields=['object_id', 'event_created'],
+                         name='billing_event_object_idx'),
+        ]
+        verbose_name = _('Stripe event')
+        verbose_name_plural = _('Stripe events')
+
+    def __str__(self):
+        return u'{0} ({1})'.format(self.event_id, self.type)
+
+
+@python_2_unicode_compatible
+class RegistrationIntent(TimeStampedModel):
+    """A paid event registration waiting on its charge. Checkout stores
+    the intent and returns at once; the charge and the registration are
+    made on a background task by billing.pipeline."""
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    CONFIRMED = 'confirmed'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('Pending')),
+        (PROCESSING, _('Processing')),
+        (CONFIRMED, _('Confirmed')),
+        (FAILED, _('Failed')),
+    )
+
+    key = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    event = models.ForeignKey('events.Event', on_delete=models.CASCADE,
+                              related_name='registration_intents')
+    hold = models.ForeignKey('events.SeatHold', on_delete=models.SET_NULL,
+                             null=True, blank=True)
+    email = models.EmailField(max_length=120)
+    first_name = models.CharField(max_length=120, blank=True)
+    last_name = models.CharField(max_length=120, blank=True)
+    amount = models.PositiveIntegerField(help_text=HELP_TXT['amount'])
+    stripe_token = models.CharField(max_length=255)
+    idempotency_key = models.CharField(max_length=64)
+    charge = models.ForeignKey(Charge, on_delete=models.SET_NULL, null=True,
+                               blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        app_label = 'billing'
+        indexes = [
+            models.Index(fields=['status', 'modified'],
+                         name='billing_intent_status_idx'),
+        ]
+        verbose_name = _('registration intent')
+        verbose_name_plural = _('registration intents')
+
+    def __str__(self):
+        return u'{0} @ {1}'.format(self.email, self.event_id)
+
+    @property
+    def is_finished(self):
+        return self.status in (RegistrationIntent.CONFIRMED,
+                               RegistrationIntent.FAILED)
+
+
+@python_2_unicode_compatible
+class RefundBatch(TimeStampedModel):
+    """Refunds every paid registration of a cancelled event. The charges
+    are refunded a chunk at a time by billing.refunds, so a restarted
+    worker resumes with the charges that are not refunded yet."""
+    PENDING = 'pending'
+    REFUNDING = 'refunding'
+    REFUNDED = 'refunded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('Pending')),
+        (REFUNDING, _('Refunding')),
+        (REFUNDED, _('Refunded')),
+        (FAILED, _('Refunded with failures')),
+    )
+    REASON_CHOICES = (
+        ('requested_by_customer', _('Requested by customer')),
+        ('duplicate', _('Duplicate')),
+        ('fraudulent', _('Fraudulent')),
+    )
+
+    event = models.ForeignKey('events.Event', on_delete=models.CASCADE,
+                              related_name='refund_batches')
+    reason = models.CharField(max_length=25, choices=REASON_CHOICES,
+                              default='requested_by_customer')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING, db_index=True)
+    refunded_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    amount_refunded = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'billing'
+        verbose_name = _('refund batch')
+        verbose_name_plural = _('refund batches')
+
+    def __str__(self):
+        return u'{0} ({1})'.format(self.event, self.get_status_display())
+
+
+@python_2_unicode_compatible
+class Refund(TimeStampedModel):
+    """The outcome of refunding one charge of a RefundBatch."""
+    REFUNDED = RefundBatch.REFUNDED
+    FAILED = RefundBatch.FAILED
+    STATUS_CHOICES = (
+        (REFUNDED, _('Refunded')),
+        (FAILED, _('Failed')),
+    )
+
+    batch = models.ForeignKey(RefundBatch, on_delete=models.CASCADE,
+                              related_name='refunds')
+    charge = models.ForeignKey(Charge, on_delete=models.CASCADE,
+                               related_name='refunds')
+    refund_id = models.SlugField(max_length=255, null=True, blank=True)
+    amount = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        app_label = 'billing'
+        ordering = ('pk',)
+        verbose_name = _('refund')
+        verbose_name_plural = _('refunds')
+
+    def __str__(self):
+        return self.refund_id or u'{0} ({1})'.format(self.charge,
+                                                    self.get_status_display())
@@ -0,0 +1,199 @@
+"""
+The checkout charge pipeline.
+
+Checkout only validates the card token, holds a seat and stores a
+RegistrationIntent, then sends the buyer to a "processing" page. The
+Stripe charge, the registration and the newsletter signup run on a
+core.tasks worker in `process_intent`, so a slow Stripe never ties up
+the web workers. The processing page polls the checkout_status view
+until the intent is confirmed or failed.
+
+An intent is claimed with a conditional UPDATE, so only one worker ever
+processes it at a time. An intent left behind by a failed or restarted
+worker is picked up again by `retry_stalled_intents`
+(`manage.py process_registration_intents`); the charge's idempotency
+key keeps a retry from charging the card twice.
+
+With TASKS_ALWAYS_EAGER the whole pipeline runs inline, which is enough
+to run checkout offline against billing.fakestripe.
+"""
+
+import logging
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.encoding import force_text
+from django.utils.translation import ugettext as _
+
+from contact.models import Newsletter
+from core.tasks import enqueue_on_commit
+from events.models import Attendee, Registration, SeatHold
+from .breaker import PaymentsUnavailable
+from .models import Charge, RegistrationIntent
+from .utils import create_stripe_refund
+
+# Create your pipeline here.
+
+
+logger = logging.getLogger(__name__)
+
+
+def add_to_event(event, email, first_name, last_name, charge=None):
+    """
+    Adds a user to the event, and adds them to the newsletter.
+    Returns False if the email was already registered for the event.
+    """
+    try:
+        with transaction.atomic():
+            attendee = Attendee.objects.create(email=email,
+                                               first_name=first_name,
+                                               last_name=last_name)
+            Registration.objects.create(event=event, attendee=attendee,
+                                        charge=charge)
+    except IntegrityError:
+        return False
+    Newsletter.objects.get_or_create(email=email, first_name=first_name,
+                                     last_name=last_name)
+    return True
+
+
+def submit_intent(event, hold, form, amount):
+    """Stores the registration and queues its charge. `form` is a valid
+    StripeCreditCardForm."""
+    email = form.cleaned_data['email'].lower()
+    intent = RegistrationIntent.objects.create(
+        event=event, hold=hold, email=email,
+        first_name=form.cleaned_data['first_name'],
+        last_name=form.cleaned_data['last_name'],
+        amount=amount, stripe_token=form.token,
+        idempotency_key=form.charge_key(amount, email, event=event))
+    enqueue_on_commit(process_intent, intent.pk)
+    return intent
+
+
+def process_intent(intent_pk):
+    """Charges the intent's card and registers the buyer. Returns the
+    intent, or None if another worker has it or it is finished."""
+    claimed = RegistrationIntent.objects \
+        .filter(pk=intent_pk, status=RegistrationIntent.PENDING) \
+        .update(status=RegistrationIntent.PROCESSING,
+                attempts=F('attempts') + 1, modified=timezone.now())
+    if not claimed:
+        return None
+    intent = RegistrationIntent.objects.select_related('event', 'hold') \
+        .get(pk=intent_pk)
+
+    if intent.hold is not None and intent.hold.status == SeatHold.RELEASED:
+        # The checkout took longer than the hold; the seat may be gone.
+        return _finish(intent, RegistrationIntent.FAILED,
+                       error=_('Your seat reservation expired. Please try '
+                               'again.'))
+
+    try:
+        charge = Charge.objects.create(
+            amount=intent.amount,
+            description='Charge from {} for {}'.format(intent.email,
+                                                       intent.event.name),
+            receipt_email=intent.email, source=intent.stripe_token,
+            idempotency_key=intent.idempotency_key)
+    except PaymentsUnavailable as e:
+        # Stripe is known to be down; wait for it without using up the
+        # intent's attempts.
+        return _retry_later(intent, force_text(e), counted=False)
+    except Exception as e:
+        # Stripe stayed unreachable for the whole retry budget.
+        logger.exception('Charge for registration intent %s failed.',
+                         intent.pk)
+        return _retry_later(intent, force_text(e) or e.__class__.__name__)
+
+    if charge is None:
+        return _finish(intent, RegistrationIntent.FAILED,
+                       error=_('Your card was declined.'))
+
+    if not add_to_event(event=intent.event, email=intent.email,
+                        first_name=intent.first_name,
+                        last_name=intent.last_name, charge=charge):
+        # The email was registered meanwhile, e.g. by a second checkout.
+        try:
+            refund_duplicate(intent, charge)
+        except Exception as e:
+            logger.exception('Refund for registration intent %s failed.',
+                             intent.pk)
+            # The charge and the refund are both idempotent, so a retry
+            # only finishes the refund.
+            return _retry_later(intent, force_text(e) or
+                                e.__class__.__name__)
+        return _finish(intent, RegistrationIntent.FAILED, charge=charge,
+                       error=_('This email address is already registered '
+                               'for the event. Your card has been '
+                               'refunded.'))
+    if intent.hold is not None:
+        intent.hold.commit()
+    return _finish(intent, RegistrationIntent.CONFIRMED, charge=charge)
+
+
+def refund_duplicate(intent, charge):
+    """Refunds the charge of an intent whose buyer turned out to be
+    registered already."""
+    refund = create_stripe_refund(
+        charge.charge_id, reason='duplicate',
+        metadata={'registration_intent': intent.pk})
+    Charge.objects.filter(pk=charge.pk).update(
+        amount_refunded=refund['amount'],
+        refunded=refund['amount'] >= charge.amount)
+
+
+def _retry_later(intent, error, counted=True):
+    max_attempts = getattr(settings, 'CHECKOUT_MAX_ATTEMPTS', 3)
+    if counted and intent.attempts >= max_attempts:
+        return _finish(intent, RegistrationIntent.FAILED,
+                       error=_('There was an error processing your '
+                               'request.'))
+    RegistrationIntent.objects.filter(pk=intent.pk).update(
+        status=RegistrationIntent.PENDING, error=error,
+        attempts=F('attempts') - (0 if counted else 1),
+        modified=timezone.now())
+    intent.status = RegistrationIntent.PENDING
+    intent.error = error
+    return intent
+
+
+def _finish(intent, status, charge=None, error=''):
+    if status == RegistrationIntent.FAILED and intent.hold is not None:
+        intent.hold.release()
+    RegistrationIntent.objects.filter(pk=intent.pk).update(
+        status=status, charge=charge, error=error, modified=timezone.now())
+    intent.status = status
+    intent.charge = charge
+    intent.error = error
+    return intent
+
+
+def retry_stalled_intents(stale_after=None):
+    """Processes again every intent that has not moved for `stale_after`
+    seconds. Returns the number of intents retried."""
+    if stale_after is None:
+        stale_after = getattr(settings, 'CHECKOUT_STALE_SECONDS', 2 * 60)
+    stale = timezone.now() - timedelta(seconds=stale_after)
+    intents = RegistrationIntent.objects \
+        .filter(status__in=[RegistrationIntent.PENDING,
+                            RegistrationIntent.PROCESSING],
+                modified__lt=stale) \
+        .order_by('pk') \
+        .values_list('pk', 'modified')
+
+    retried = 0
+    for pk, modified in intents:
+        # Claim it back from the worker that stalled, unless it moved on.
+        reset = RegistrationIntent.objects \
+            .filter(pk=pk, modified=modified) \
+            .exclude(status__in=[RegistrationIntent.CONFIRMED,
+                                 RegistrationIntent.FAILED]) \
+            .update(status=RegistrationIntent.PENDING)
+        if reset and process_intent(pk) is not None:
+            retried += 1
+    return retried
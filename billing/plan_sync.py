@@ -0,0 +1,206 @@
+"""
+Keeps Stripe plans and the local Plan rows in line with a manifest.
+
+The manifest (billing/plans.json, or STRIPE_PLAN_MANIFEST) is a JSON list
+of plans:
+
+    {"id": "individual", "name": "Individual", "amount": 15000,
+     "interval": "year", "description": "..."}
+
+with optional currency, interval_count, statement_descriptor,
+trial_period_days and is_active. `sync_plans` lists the Stripe plans in
+one paginated pass, diffs them and the local rows against the manifest,
+and only sends the creates and updates that are needed, a few at a time
+on a StripeExecutor (STRIPE_PLAN_SYNC_WORKERS). When nothing changed it
+makes no Stripe writes and no database writes.
+
+Stripe never changes a plan's price. A manifest entry whose amount,
+currency or interval differs from the existing Stripe plan is reported
+as a conflict and left alone; give the new price a new id instead.
+"""
+
+import json
+import os
+
+from collections import namedtuple
+
+import stripe
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .executor import StripeExecutor
+from .mirror import remember
+from .models import Plan
+from .reconcile import iter_stripe_objects
+from .utils import create_stripe_plan, update_stripe_plan
+
+# Create your plan sync here.
+
+
+DEFAULT_MANIFEST = os.path.join(os.path.dirname(__file__), 'plans.json')
+
+# Stripe plan fields that can be updated, and those fixed at creation.
+STRIPE_MUTABLE = ('name', 'statement_descriptor', 'trial_period_days')
+STRIPE_FIXED = ('amount', 'currency', 'interval', 'interval_count')
+LOCAL_FIELDS = ('name', 'description', 'amount', 'interval', 'currency',
+                'interval_count', 'statement_descriptor', 'trial_period_days',
+                'is_active')
+
+PlanChange = namedtuple('PlanChange', ['plan_id', 'fields'])
+
+
+class PlanSyncReport(object):
+
+    def __init__(self):
+        self.create = []
+        self.update = []
+        self.conflicts = []
+        self.local_create = []
+        self.local_update = []
+        self.unmanaged = []
+        self.errors = []
+
+    @property
+    def has_changes(self):
+        return bool(self.create or self.update or self.local_create or
+                    self.local_update)
+
+
+def load_manifest(path=None):
+    """Reads the manifest and fills in the defaults. Raises ValueError for
+    an invalid manifest."""
+    path = path or getattr(settings, 'STRIPE_PLAN_MANIFEST', DEFAULT_MANIFEST)
+    with open(path) as f:
+        entries = json.load(f)
+
+    plans = []
+    seen = set()
+    for entry in entries:
+        missing = [name for name in ('name', 'amount', 'interval')
+                   if name not in entry]
+        if missing:
+            raise ValueError('Plan {0!r} is missing {1}.'.format(
+                entry.get('id') or entry.get('name'), ', '.join(missing)))
+        spec = {
+            'id': entry.get('id') or slugify(entry['name']),
+            'name': entry['name'],
+            'description': entry.get('description', ''),
+            'amount': int(entry['amount']),
+            'interval': entry['interval'],
+            'currency': entry.get('currency', 'usd'),
+            'interval_count': int(entry.get('interval_count', 1)),
+            'statement_descriptor': entry.get('statement_descriptor', ''),
+            'trial_period_days': int(entry.get('trial_period_days', 0)),
+            'is_active': bool(entry.get('is_active', True)),
+        }
+        if spec['id'] in seen:
+            raise ValueError('Plan {0!r} is listed twice.'.format(spec['id']))
+        seen.add(spec['id'])
+        plans.append(spec)
+    return plans
+
+
+def _stripe_values(obj):
+    """The manifest's view of a Stripe plan."""
+    return {
+        'name': obj.get('name'),
+        'amount': obj.get('amount'),
+        'currency': obj.get('currency'),
+        'interval': obj.get('interval'),
+        'interval_count': obj.get('interval_count') or 1,
+        'statement_descriptor': obj.get('statement_descriptor') or '',
+        'trial_period_days': obj.get('trial_period_days') or 0,
+    }
+
+
+def diff_plans(manifest, remote, local):
+    """Compares the manifest with the Stripe plans and the local rows,
+    both dicts keyed by plan id. Returns a PlanSyncReport."""
+    report = PlanSyncReport()
+    for spec in manifest:
+        obj = remote.get(spec['id'])
+        if obj is None:
+            report.create.append(spec)
+        else:
+            current = _stripe_values(obj)
+            fixed = dict((name, spec[name]) for name in STRIPE_FIXED
+                         if current[name] != spec[name])
+            if fixed:
+                report.conflicts.append(PlanChange(spec['id'], fixed))
+                continue
+            changed = dict((name, spec[name]) for name in STRIPE_MUTABLE
+                           if current[name] != spec[name])
+            if changed:
+                report.update.append(PlanChange(spec['id'], changed))
+
+        row = local.get(spec['id'])
+        if row is None:
+            report.local_create.append(spec)
+        else:
+            changed = dict((name, spec[name]) for name in LOCAL_FIELDS
+                           if row[name] != spec[name])
+            if changed:
+                report.local_update.append(PlanChange(spec['id'], changed))
+
+    managed = set(spec['id'] for spec in manifest)
+    report.unmanaged = sorted(set(remote) - managed)
+    return report
+
+
+def _push(action):
+    kind, spec = action
+    if kind == 'create':
+        return create_stripe_plan(
+            plan_id=spec['id'], name=spec['name'], amount=spec['amount'],
+            interval=spec['interval'], currency=spec['currency'],
+            interval_count=spec['interval_count'],
+            statement_descriptor=spec['statement_descriptor'],
+            trial_period_days=spec['trial_period_days'])
+    # The listed plan is in the mirror, so only the fields that differ
+    # from it are sent.
+    return update_stripe_plan(
+        spec['id'], name=spec['name'],
+        statement_descriptor=spec['statement_descriptor'] or None,
+        trial_period_days=spec['trial_period_days'] or None)
+
+
+def sync_plans(manifest=None, dry_run=False, workers=None, page_size=100):
+    """Brings Stripe and the Plan table in line with the manifest. Returns
+    the PlanSyncReport of what was (or, with dry_run, would be) done."""
+    if manifest is None:
+        manifest = load_manifest()
+    if workers is None:
+        workers = getattr(settings, 'STRIPE_PLAN_SYNC_WORKERS', 4)
+
+    remote = {}
+    for obj in iter_stripe_objects(stripe.Plan, page_size):
+        remote[obj['id']] = remember(obj)
+    local = dict((row['plan_id'], row) for row in Plan.objects
+                 .exclude(plan_id__isnull=True)
+                 .values('plan_id', *LOCAL_FIELDS))
+    report = diff_plans(manifest, remote, local)
+    if dry_run:
+        return report
+
+    specs = dict((spec['id'], spec) for spec in manifest)
+    actions = [('create', spec) for spec in report.create] + \
+        [('update', specs[change.plan_id]) for change in report.update]
+    pushed = StripeExecutor(workers=workers).map(_push, actions)
+    report.errors = [(result.item[1]['id'], result.error)
+                     for result in pushed.failed]
+
+    # Local rows only follow plans that made it to Stripe.
+    failed = set(plan_id for plan_id, error in report.errors)
+    with transaction.atomic():
+        Plan.objects.bulk_create([
+            Plan(plan_id=spec['id'],
+                 **dict((name, spec[name]) for name in LOCAL_FIELDS))
+            for spec in report.local_create if spec['id'] not in failed])
+        for change in report.local_update:
+            if change.plan_id not in failed:
+                Plan.objects.filter(plan_id=change.plan_id).update(
+                    modified=timezone.now(), **change.fields)
+    return report
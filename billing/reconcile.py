@@ -0,0 +1,145 @@
+"""
+Finds and repairs drift between Stripe and the local billing tables.
+
+Each kind of object is listed from Stripe a page at a time and compared
+in memory with the local rows, which are loaded once and keyed by their
+Stripe id. Corrections are written with one CASE UPDATE per chunk of
+rows, so even tens of thousands of objects take a handful of list calls
+and a few queries.
+"""
+
+import stripe
+
+from collections import Counter, namedtuple
+
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .models import Charge, Customer, Plan, Subscription
+from .signals import update_rows
+from .utils import (call, charge_values, convert_tstamp, customer_values,
+                    subscription_values)
+
+# Create your reconciliation here.
+
+
+Change = namedtuple('Change', ['pk', 'stripe_id', 'fields'])
+
+
+class Report(object):
+    """What a reconciliation of one kind of object found."""
+
+    def __init__(self, name):
+        self.name = name
+        self.remote = 0
+        self.changes = []
+        self.remote_only = []
+        self.local_only = []
+        self.field_counts = Counter()
+
+    def add_change(self, change):
+        self.changes.append(change)
+        self.field_counts.update(change.fields.keys())
+
+
+def iter_stripe_objects(resource, page_size=100, **params):
+    """Yields every object of a Stripe list endpoint, following
+    starting_after from page to page."""
+    starting_after = None
+    while True:
+        if starting_after:
+            params['starting_after'] = starting_after
+        page = call(resource.list, limit=page_size, **params)
+        for obj in page['data']:
+            yield obj
+        if not page['has_more'] or not page['data']:
+            return
+        starting_after = page['data'][-1]['id']
+
+
+def _diff(report, local_rows, remote_objects, wanted_values):
+    seen = set()
+    for obj in remote_objects:
+        report.remote += 1
+        seen.add(obj['id'])
+        row = local_rows.get(obj['id'])
+        if row is None:
+            report.remote_only.append(obj['id'])
+            continue
+        changed = dict((name, value)
+                       for name, value in wanted_values(obj).items()
+                       if row[name] != value)
+        if changed:
+            report.add_change(Change(row['pk'], obj['id'], changed))
+    report.local_only = sorted(set(local_rows) - seen)
+    return report
+
+
+def _local_rows(model, key, fields):
+    rows = model.objects.exclude(**{key + '__isnull': True}) \
+        .values('pk', key, *fields)
+    return dict((row[key], row) for row in rows.iterator())
+
+
+def reconcile_customers(page_size=100):
+    fields = ('account_balance', 'currency', 'description')
+    return _diff(Report('customers'), _local_rows(Customer, 'cu_id', fields),
+                 iter_stripe_objects(stripe.Customer, page_size),
+                 customer_values)
+
+
+def reconcile_subscriptions(page_size=100):
+    fields = ('status', 'quantity', 'cancel_at_period_end', 'canceled_at',
+              'current_period_start', 'current_period_end', 'ended_at',
+              'start', 'trial_start', 'trial_end', 'plan')
+    plans = dict(Plan.objects.exclude(plan_id__isnull=True)
+                             .values_list('plan_id', 'pk'))
+
+    def wanted_values(obj):
+        values = subscription_values(obj)
+        plan_pk = plans.get((obj.get('plan') or {}).get('id'))
+        if plan_pk is not None:
+            values['plan'] = plan_pk
+        return values
+
+    # Canceled subscriptions are left out of the list unless asked for.
+    return _diff(Report('subscriptions'),
+                 _local_rows(Subscription, 'sub_id', fields),
+                 iter_stripe_objects(stripe.Subscription, page_size,
+                                     status='all'),
+                 wanted_values)
+
+
+def reconcile_charges(page_size=100, since=None):
+    fields = ('amount_refunded', 'paid', 'refunded', 'captured', 'disputed')
+    params = {}
+    local = Charge.objects
+    if since is not None:
+        params['created'] = {'gte': since}
+        local = Charge.objects.filter(charge_created__gte=convert_tstamp(
+            since))
+    rows = dict((row['charge_id'], row) for row in
+                local.exclude(charge_id__isnull=True)
+                     .values('pk', 'charge_id', *fields).iterator())
+    return _diff(Report('charges'), rows,
+                 iter_stripe_objects(stripe.Charge, page_size, **params),
+                 charge_values)
+
+
+def apply_changes(model, changes, chunk_size=500):
+    """Writes the changes, one UPDATE and one transaction per chunk."""
+    for i in range(0, len(changes), chunk_size):
+        chunk = changes[i:i + chunk_size]
+        names = set(name for change in chunk for name in change.fields)
+        updates = {}
+        for name in names:
+            field = model._meta.get_field(name)
+            output_field = field.target_field if field.is_relation else field
+            whens = [When(pk=change.pk, then=Value(change.fields[name],
+                                                   output_field=output_field))
+                     for change in chunk if name in change.fields]
+            updates[field.attname] = Case(*whens, default=F(field.attname),
+                                          output_field=output_field)
+        if any(field.name == 'modified' for field in model._meta.fields):
+            updates['modified'] = timezone.now()
+        update_rows(model, [change.pk for change in chunk], **updates)
@@ -0,0 +1,166 @@
+"""
+Refunds the paid registrations of cancelled events.
+
+`cancel_event` takes the event off the site and queues a RefundBatch.
+`refund_batch` then refunds every paid charge of the event's
+registrations, REFUND_CHUNK_SIZE charges at a time. Each chunk is
+refunded concurrently on a StripeExecutor; its Refund rows, the charges'
+refund fields and the batch counters are then written in one
+transaction. A restarted batch picks up with the charges that are not
+refunded yet, and the refunds' idempotency keys make sure no charge is
+ever refunded twice.
+
+Settings:
+
+    REFUND_CHUNK_SIZE  charges refunded per chunk (default 500)
+"""
+
+import csv
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import six, timezone
+from django.utils.encoding import force_bytes, force_text
+
+from core.tasks import enqueue, enqueue_on_commit
+from events.models import Event
+from .executor import StripeExecutor
+from .models import Charge, Refund, RefundBatch
+from .reconcile import Change, apply_changes
+from .utils import create_stripe_refund
+
+# Create your refunds here.
+
+
+REPORT_HEADER = ('charge', 'email', 'first_name', 'last_name', 'amount',
+                 'refund', 'status', 'error')
+
+
+def cancel_event(event, reason='requested_by_customer'):
+    """Unpublishes the event and queues the refunds of its registrations.
+    Returns the RefundBatch."""
+    Event.objects.filter(pk=event.pk).update(is_active=False,
+                                             modified=timezone.now())
+    Event.objects.invalidate_cache()
+    batch = RefundBatch.objects.create(event=event, reason=reason)
+    enqueue_on_commit(refund_batch, batch.pk)
+    return batch
+
+
+def resume_batch(batch):
+    """Queues an interrupted batch to continue with the charges that are
+    still paid."""
+    enqueue(refund_batch, batch.pk)
+
+
+def retry_failed_refunds(batch):
+    """Queues the charges that could not be refunded to be tried again."""
+    with transaction.atomic():
+        failed = batch.refunds.filter(status=Refund.FAILED).delete()[0]
+        RefundBatch.objects.filter(pk=batch.pk).update(
+            status=RefundBatch.PENDING, finished_at=None,
+            failed_count=F('failed_count') - failed, modified=timezone.now())
+    enqueue_on_commit(refund_batch, batch.pk)
+
+
+def refundable_charges(batch):
+    """The event's paid charges that this batch has not tried yet."""
+    return Charge.objects \
+        .filter(registrations__event=batch.event_id, paid=True) \
+        .exclude(refunded=True) \
+        .exclude(charge_id__isnull=True) \
+        .exclude(refunds__batch=batch) \
+        .distinct()
+
+
+def refund_batch(batch_pk, executor=None):
+    """Refunds the batch's charges a chunk at a time. Returns the batch."""
+    batch = RefundBatch.objects.get(pk=batch_pk)
+    if batch.status in (RefundBatch.REFUNDED, RefundBatch.FAILED):
+        return batch
+    RefundBatch.objects.filter(pk=batch.pk).update(
+        status=RefundBatch.REFUNDING, modified=timezone.now())
+
+    executor = executor or StripeExecutor()
+    chunk_size = getattr(settings, 'REFUND_CHUNK_SIZE', 500)
+    last_pk = 0
+    while True:
+        chunk = list(refundable_charges(batch)
+                     .filter(pk__gt=last_pk)
+                     .order_by('pk')
+                     .values('pk', 'charge_id', 'amount',
+                             'amount_refunded')[:chunk_size])
+        if not chunk:
+            break
+        _refund_chunk(batch, chunk, executor)
+        last_pk = chunk[-1]['pk']
+
+    batch.refresh_from_db()
+    RefundBatch.objects.filter(pk=batch.pk).update(
+        status=RefundBatch.FAILED if batch.failed_count
+        else RefundBatch.REFUNDED,
+        finished_at=timezone.now(), modified=timezone.now())
+    batch.refresh_from_db()
+    return batch
+
+
+def _refund_chunk(batch, chunk, executor):
+    def refund(row):
+        return create_stripe_refund(
+            row['charge_id'],
+            amount=row['amount'] - int(row['amount_refunded'] or 0),
+            reason=batch.reason,
+            metadata={'event': batch.event_id, 'refund_batch': batch.pk})
+
+    refunds = []
+    changes = []
+    for result in executor.map(refund, chunk).results:
+        row = result.item
+        if result.error is not None:
+            refunds.append(Refund(
+                batch=batch, charge_id=row['pk'], status=Refund.FAILED,
+                error=force_text(result.error) or
+                result.error.__class__.__name__))
+            continue
+        refunded = int(row['amount_refunded'] or 0) + result.value['amount']
+        refunds.append(Refund(
+            batch=batch, charge_id=row['pk'], refund_id=result.value['id'],
+            amount=result.value['amount'], status=Refund.REFUNDED))
+        changes.append(Change(row['pk'], row['charge_id'], {
+            'amount_refunded': refunded,
+            'refunded': refunded >= row['amount'],
+        }))
+
+    with transaction.atomic():
+        Refund.objects.bulk_create(refunds)
+        apply_changes(Charge, changes)
+        RefundBatch.objects.filter(pk=batch.pk).update(
+            refunded_count=F('refunded_count') + len(changes),
+            failed_count=F('failed_count') + len(refunds) - len(changes),
+            amount_refunded=F('amount_refunded') + sum(
+                refund.amount for refund in refunds),
+            modified=timezone.now())
+
+
+def write_report(batch, out):
+    """Writes a CSV line per refund of the batch to the file-like `out`."""
+    writer = csv.writer(out)
+    writer.writerow(REPORT_HEADER)
+    rows = batch.refunds \
+        .order_by('pk') \
+        .values_list('charge__charge_id', 'charge__registrations__email',
+                     'charge__registrations__attendee__first_name',
+                     'charge__registrations__attendee__last_name',
+                     'amount', 'refund_id', 'status', 'error')
+    for row in rows.iterator():
+        writer.writerow([_report_value(value) for value in row])
+
+
+def _report_value(value):
+    if value is None:
+        return ''
+    if six.PY2:
+        # The Python 2 csv module only writes byte strings.
+        return force_bytes(value, 'utf-8')
+    return value
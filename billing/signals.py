@@ -1,3 +1,42 @@
-from django.dispatch import Signal
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .models import Customer, Subscription
 
 membership_dates_update = Signal(providing_args=['new_date_start'])
+
+# Sent with the model as sender after Charge or Subscription rows were
+# changed with queryset.update(), which sends no post_save. `previous`
+# maps each pk to the values its updated fields had before, by attname.
+rows_updated = Signal(providing_args=['pks', 'previous'])
+
+
+def update_rows(model, pks, **updates):
+    """Updates the rows with queryset.update() and sends rows_updated."""
+    pks = list(pks)
+    if not pks:
+        return
+    attnames = [model._meta.get_field(name).attname for name in updates
+                if name != 'modified']
+    rows = model.objects.filter(pk__in=pks)
+    with transaction.atomic():
+        previous = dict((row.pop('pk'), row) for row in
+                        rows.select_for_update().values('pk', *attnames))
+        rows.update(**updates)
+    rows_updated.send(sender=model, pks=pks, previous=previous)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def update_current_subscription(sender, instance, **kwargs):
+    """Keeps Customer.current_subscription and subscription_status in line
+    with the customer's subscriptions."""
+    Customer.objects.refresh_current_subscriptions([instance.customer_id])
+
+
+@receiver(rows_updated, sender=Subscription)
+def update_current_subscriptions(sender, pks, **kwargs):
+    Customer.objects.refresh_current_subscriptions(
+        Subscription.objects.filter(pk__in=pks)
+                            .values_list('customer', flat=True))
@@ -1,4 +1,5 @@
 from django import template
+from django.conf import settings
 
 
 register = template.Library()
@@ -7,3 +8,8 @@ register = template.Library()
 @register.filter(name="divide")
 def divide(value, arg):
     return "{0:.2f}".format((int(value) / int(arg)) if int(arg) != 0 else 0)
+
+
+@register.simple_tag
+def stripe_publishable_key():
+    return getattr(settings, 'STRIPE_PUBLISHABLE_KEY', '')
@@ -0,0 +1,25 @@
+import stripe
+
+from django.test import SimpleTestCase
+
+from ..client import PooledHTTPClient, get_client
+
+# Create your client tests here.
+
+
+class StripeClientUnitTest(SimpleTestCase):
+
+    def test_stripe_uses_one_pooled_client(self):
+        client = get_client()
+        self.assertIsInstance(client, PooledHTTPClient)
+        self.assertIs(client, get_client())
+        self.assertIs(stripe.default_http_client, client)
+
+    def test_stats_before_any_request(self):
+        stats = PooledHTTPClient(pool_size=3, connect_timeout=1,
+                                 read_timeout=2).stats()
+        self.assertEqual(stats['requests'], 0)
+        self.assertEqual(stats['connections_opened'], 0)
+        self.assertIsNone(stats['reuse_ratio'])
+        self.assertEqual(stats['pool_size'], 3)
+        self.assertEqual(stats['read_timeout'], 2)
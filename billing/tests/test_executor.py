@@ -0,0 +1,89 @@
+import stripe
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import MyUser
+from billing.models import Customer, Plan, Subscription
+from .. import breaker
+from ..bulk import cancel_subscriptions
+from ..executor import StripeExecutor, TokenBucket
+from ..fakestripe import FakeStripeTestMixin
+from ..utils import call
+
+# Create your executor tests here.
+
+
+@override_settings(STRIPE_MAX_ATTEMPTS=3, STRIPE_RETRY_BACKOFF=0)
+class StripeExecutorUnitTest(SimpleTestCase):
+
+    def setUp(self):
+        breaker.reset()
+
+    def test_bucket_adapts_to_rate_limits(self):
+        bucket = TokenBucket(rate=20)
+        bucket.slow_down()
+        bucket.slow_down()
+        self.assertEqual(bucket.rate, 5)
+        self.assertEqual(bucket.throttled, 2)
+
+        for i in range(20):
+            bucket.speed_up()
+        self.assertEqual(bucket.rate, 20)
+
+    def test_results_are_collected_per_item(self):
+        def halve(number):
+            if number % 2:
+                raise ValueError('Odd number.')
+            return number // 2
+
+        report = StripeExecutor(workers=3, rate=100).map(halve, range(6))
+        self.assertEqual([result.value for result in report.results],
+                         [0, None, 1, None, 2, None])
+        self.assertEqual([result.item for result in report.failed],
+                         [1, 3, 5])
+        self.assertEqual(len(report.succeeded), 3)
+
+    def test_rate_limited_calls_slow_the_pool(self):
+        attempts = []
+
+        def limited():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise stripe.error.RateLimitError('Too many requests.',
+                                                  http_status=429)
+            return 'ok'
+
+        progress = []
+        executor = StripeExecutor(workers=1, rate=100)
+        report = executor.map(lambda item: call(limited), ['only'],
+                              progress=lambda *args: progress.append(args))
+        self.assertEqual(report.results[0].value, 'ok')
+        self.assertEqual(report.throttled, 1)
+        self.assertEqual(executor.bucket.rate, 55)
+        self.assertEqual(progress, [(1, 1)])
+
+
+class StripeBulkUnitTest(FakeStripeTestMixin, TestCase):
+
+    def test_subscriptions_are_canceled(self):
+        user = MyUser.objects.create_user(
+            email='test@user.com', first_name='John', last_name='Doe',
+            password='pbkdf2_sha256$12000$64NIBRztT1eL$ip9P9F2vYdCvIXM')
+        customer = Customer.objects.create(user=user, account_balance=0)
+        token = stripe.Token.create(card={
+            'number': '4242424242424242', 'exp_month': 8,
+            'exp_year': timezone.now().year + 1, 'cvc': '111'})
+        customer.ensure_stripe_customer(source=token['id'])
+        paid = Subscription.objects.create(
+            customer=customer, plan=Plan.objects.create(
+                name='Paid plan', amount=1000, interval='year'))
+        free = Subscription.objects.create(
+            customer=customer, plan=Plan.objects.create(
+                name='Free plan', amount=0, interval='year'))
+
+        report = cancel_subscriptions([paid.pk, free.pk])
+        self.assertEqual(report.failed, [])
+        self.assertEqual(
+            set(Subscription.objects.values_list('status', flat=True)),
+            {'canceled'})
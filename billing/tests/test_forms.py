@@ -1,44 +1,61 @@
+import stripe
+
 from django.test import TestCase
 from django.utils import timezone
 
 from accounts.models import MyUser
+from billing.models import Customer
+from ..fakestripe import FakeStripeTestMixin
 from ..forms import StripeCreditCardForm
 
 
-class StripeCreditCardFormUnitTest(TestCase):
+class StripeCreditCardFormUnitTest(FakeStripeTestMixin, TestCase):
 
     def setUp(self):
+        super(StripeCreditCardFormUnitTest, self).setUp()
         self.user = MyUser.objects.create_user(
             email='test@user.com', first_name='John', last_name='Doe',
             password='pbkdf2_sha256$12000$64NIBRztT1eL$ip9P9F2vYdCvIXM')
 
-    def test_strip_non_numeric_characters(self):
-        value = '1111-1111-1111-1111'
-        expected_result = value.replace('-', '')
-        form = StripeCreditCardForm(user=self.user)
-        actual_result = form.strip_non_numbers(value)
-        self.assertEqual(expected_result, actual_result,
-                         'Expected result: {} did not match actual '
-                         'result: {}'.format(expected_result, actual_result))
-
-    def test_luhn_checksum(self):
-        card_data = {
-            'expire_month': '12',
-            'expire_year': str(timezone.now().year + 1),
-            'cvc': '111'
-        }
-
-        # bad credit card number
-        card_data['card_number'] = '0123-4567-9089-0000'
-        form1 = StripeCreditCardForm(user=self.user, data=card_data)
-        # call .is_valid() to populate cleaned data
-        form1.is_valid()
-        self.assertFalse(form1.card_luhn_checksum_valid(),
-                         'Card number should not be valid.')
-
-        # good credit card number
-        card_data['card_number'] = '4242-4242-4242-4242'
-        form2 = StripeCreditCardForm(user=self.user, data=card_data)
-        form2.is_valid()
-        self.assertTrue(form2.card_luhn_checksum_valid(),
-                        'Card number should be valid.')
+    def card_form(self, number, customer=None):
+        # Stands in for Stripe.js, which tokenizes the card in the browser.
+        token = stripe.Token.create(card={
+            'number': number, 'exp_month': 8,
+            'exp_year': timezone.now().year + 1, 'cvc': '111'})
+        form = StripeCreditCardForm(
+            {'email': 'test@user.com', 'stripe_token': token['id']},
+            user=self.user, customer=customer)
+        self.assertTrue(form.is_valid(), form.errors)
+        return form
+
+    def test_token_is_required(self):
+        form = StripeCreditCardForm({'email': 'test@user.com'},
+                                    user=self.user)
+        self.assertFalse(form.is_valid())
+        self.assertIn('stripe_token', form.errors)
+
+    def test_charge_is_created_once(self):
+        form = self.card_form('4242424242424242')
+
+        first = form.charge_customer(1000, 'Test charge', 'test@user.com')
+        second = form.charge_customer(1000, 'Test charge', 'test@user.com')
+        self.assertEqual(first.charge_id, second.charge_id)
+        self.assertTrue(first.paid)
+
+    def test_declined_card_is_not_charged(self):
+        form = self.card_form('4000000000000002')
+        self.assertIsNone(
+            form.charge_customer(1000, 'Test charge', 'test@user.com'))
+
+    def test_card_is_attached_to_member_in_one_request(self):
+        customer = Customer.objects.create(user=self.user, account_balance=0)
+        requests = self.fake_stripe.fake.requests
+        form = self.card_form('4242424242424242', customer=customer)
+        # One request for the token (Stripe.js), one to create the customer
+        # with the card attached.
+        self.assertEqual(self.fake_stripe.fake.requests, requests + 2)
+
+        charge = form.charge_customer(1000, 'Test charge', 'test@user.com')
+        self.assertTrue(charge.paid)
+        cu = stripe.Customer.retrieve(customer.cu_id)
+        self.assertEqual(len(cu.sources.data), 1)
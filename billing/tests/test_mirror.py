@@ -0,0 +1,30 @@
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from ..mirror import changed_fields, forget, recall, remember
+
+# Create your mirror tests here.
+
+
+class StripeMirrorUnitTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_unknown_objects_send_every_field(self):
+        fields = {'email': 'test@user.com', 'description': None}
+        self.assertEqual(changed_fields('customer', 'cus_1', fields), fields)
+
+    def test_only_changed_fields_are_sent(self):
+        remember({'id': 'sub_1', 'object': 'subscription', 'quantity': 1,
+                  'plan': {'id': 'individual', 'object': 'plan'}})
+        self.assertEqual(
+            changed_fields('subscription', 'sub_1',
+                           {'quantity': 1, 'plan': 'individual'}), {})
+        self.assertEqual(
+            changed_fields('subscription', 'sub_1',
+                           {'quantity': 2, 'plan': 'future'}),
+            {'quantity': 2, 'plan': 'future'})
+
+        forget('subscription', 'sub_1')
+        self.assertIsNone(recall('subscription', 'sub_1'))
@@ -0,0 +1,91 @@
+import stripe
+
+from datetime import timedelta
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from events.models import Event, Registration, SeatHold
+from ..fakestripe import DECLINED_CARD, FakeStripeTestMixin
+from ..models import Charge, RegistrationIntent
+from ..pipeline import process_intent
+
+# Create your pipeline tests here.
+
+
+class CheckoutPipelineUnitTest(FakeStripeTestMixin, TestCase):
+
+    def setUp(self):
+        super(CheckoutPipelineUnitTest, self).setUp()
+        start = timezone.now() + timedelta(days=7)
+        self.event = Event.objects.create(
+            name='Test event', start_date=start,
+            end_date=start + timedelta(hours=2), member_fee=0,
+            non_member_fee=1000, email_description='Test event')
+
+    def checkout(self, number='4242424242424242'):
+        # Stands in for Stripe.js, which tokenizes the card in the browser.
+        token = stripe.Token.create(card={
+            'number': number, 'exp_month': 8,
+            'exp_year': timezone.now().year + 1, 'cvc': '111'})
+        response = self.client.post(
+            reverse('billing:checkout', kwargs={'event_pk': self.event.pk}),
+            {'email': 'Test@User.com', 'first_name': 'John',
+             'last_name': 'Doe', 'stripe_token': token['id']})
+        return response, RegistrationIntent.objects.latest('pk')
+
+    def status(self, intent):
+        return self.client.get(reverse('billing:checkout_status',
+                                       kwargs={'key': intent.key})).json()
+
+    def test_checkout_returns_before_charging(self):
+        response, intent = self.checkout()
+        self.assertRedirects(response, reverse(
+            'billing:checkout_processing', kwargs={'key': intent.key}))
+        self.assertEqual(intent.status, RegistrationIntent.PENDING)
+        self.assertEqual(self.status(intent), {'status': 'pending'})
+        self.assertFalse(Registration.objects.exists())
+
+    def test_intent_is_confirmed_once(self):
+        response, intent = self.checkout()
+
+        intent = process_intent(intent.pk)
+        self.assertEqual(intent.status, RegistrationIntent.CONFIRMED)
+        self.assertTrue(intent.charge.paid)
+        self.assertTrue(Registration.objects.is_registered(
+            self.event, 'test@user.com'))
+        self.assertEqual(SeatHold.objects.get().status, SeatHold.COMMITTED)
+        self.assertEqual(self.status(intent)['redirect'],
+                         self.event.get_reg_success_url())
+
+        self.assertIsNone(process_intent(intent.pk))
+
+    def test_second_intent_for_the_email_is_refunded(self):
+        # Two tabs check out with the same email before either is charged.
+        response, first = self.checkout()
+        response, second = self.checkout()
+
+        self.assertEqual(process_intent(first.pk).status,
+                         RegistrationIntent.CONFIRMED)
+        second = process_intent(second.pk)
+        self.assertEqual(second.status, RegistrationIntent.FAILED)
+        self.assertIn('already registered', second.error)
+        self.assertTrue(
+            stripe.Charge.retrieve(second.charge.charge_id)['refunded'])
+        self.assertTrue(Charge.objects.get(pk=second.charge.pk).refunded)
+
+        self.assertEqual(Registration.objects.count(), 1)
+        self.assertEqual(
+            sorted(SeatHold.objects.values_list('status', flat=True)),
+            [SeatHold.COMMITTED, SeatHold.RELEASED])
+        self.assertEqual(Event.objects.get(pk=self.event.pk).seats_held, 0)
+
+    def test_declined_card_releases_the_seat(self):
+        response, intent = self.checkout(DECLINED_CARD)
+
+        intent = process_intent(intent.pk)
+        self.assertEqual(intent.status, RegistrationIntent.FAILED)
+        self.assertEqual(SeatHold.objects.get().status, SeatHold.RELEASED)
+        self.assertFalse(Registration.objects.exists())
+        self.assertEqual(self.status(intent)['status'], 'failed')
@@ -0,0 +1,64 @@
+import stripe
+
+from django.test import TestCase
+
+from billing.models import Plan
+from ..fakestripe import FakeStripeTestMixin
+from ..plan_sync import load_manifest, sync_plans
+
+# Create your plan sync tests here.
+
+
+class PlanSyncUnitTest(FakeStripeTestMixin, TestCase):
+
+    def setUp(self):
+        super(PlanSyncUnitTest, self).setUp()
+        self.manifest = load_manifest()
+
+    def test_manifest_plans_are_created(self):
+        report = sync_plans(self.manifest)
+        self.assertEqual(report.errors, [])
+        self.assertEqual(
+            sorted(Plan.objects.values_list('plan_id', flat=True)),
+            sorted(spec['id'] for spec in self.manifest))
+        self.assertFalse(Plan.objects.get(plan_id='admin').is_active)
+        self.assertEqual(stripe.Plan.retrieve('individual')['amount'], 15000)
+
+    def test_second_sync_makes_no_writes(self):
+        sync_plans(self.manifest)
+        modified = list(Plan.objects.values_list('modified', flat=True))
+        requests = self.fake_stripe.fake.requests
+
+        report = sync_plans(self.manifest)
+        self.assertFalse(report.has_changes)
+        # Only the list call.
+        self.assertEqual(self.fake_stripe.fake.requests, requests + 1)
+        self.assertEqual(
+            list(Plan.objects.values_list('modified', flat=True)), modified)
+
+    def test_only_changed_plans_are_updated(self):
+        sync_plans(self.manifest)
+        self.manifest[0]['name'] = 'Individual Member'
+        requests = self.fake_stripe.fake.requests
+
+        report = sync_plans(self.manifest)
+        self.assertEqual([c.plan_id for c in report.update], ['individual'])
+        self.assertEqual(self.fake_stripe.fake.requests, requests + 2)
+        self.assertEqual(stripe.Plan.retrieve('individual')['name'],
+                         'Individual Member')
+        self.assertEqual(Plan.objects.get(plan_id='individual').name,
+                         'Individual Member')
+
+    def test_price_change_is_a_conflict(self):
+        sync_plans(self.manifest)
+        self.manifest[0]['amount'] = 20000
+
+        report = sync_plans(self.manifest)
+        self.assertEqual(report.conflicts[0].fields, {'amount': 20000})
+        self.assertEqual(report.update, [])
+        self.assertEqual(stripe.Plan.retrieve('individual')['amount'], 15000)
+
+    def test_dry_run_changes_nothing(self):
+        report = sync_plans(self.manifest, dry_run=True)
+        self.assertEqual(len(report.create), len(self.manifest))
+        self.assertFalse(Plan.objects.exists())
@@ -0,0 +1,45 @@
+from django.test import TestCase
+
+from accounts.models import MyUser
+from billing.models import Customer, Plan, Subscription
+from ..fakestripe import FakeStripeTestMixin
+from ..reconcile import (apply_changes, reconcile_customers,
+                         reconcile_subscriptions)
+
+# Create your reconcile tests here.
+
+
+class StripeReconcileUnitTest(FakeStripeTestMixin, TestCase):
+
+    def create_customer(self, email):
+        user = MyUser.objects.create_user(
+            email=email, first_name='John', last_name='Doe',
+            password='pbkdf2_sha256$12000$64NIBRztT1eL$ip9P9F2vYdCvIXM')
+        customer = Customer.objects.create(user=user, account_balance=0)
+        customer.ensure_stripe_customer()
+        return customer
+
+    def test_pages_through_every_object(self):
+        self.create_customer('first@user.com')
+        self.create_customer('second@user.com')
+        Customer.objects.update(description='Edited locally')
+
+        report = reconcile_customers(page_size=1)
+        self.assertEqual(report.remote, 2)
+        self.assertEqual(len(report.changes), 2)
+
+    def test_drift_is_corrected(self):
+        plan = Plan.objects.create(name='Test plan', amount=1000,
+                                   interval='year', description='Test plan')
+        sub = Subscription.objects.create(
+            customer=self.create_customer('test@user.com'), plan=plan)
+        Subscription.objects.filter(pk=sub.pk).update(status='past_due')
+
+        report = reconcile_subscriptions()
+        self.assertEqual([c.fields for c in report.changes],
+                         [{'status': 'active'}])
+
+        apply_changes(Subscription, report.changes)
+        sub.refresh_from_db()
+        self.assertEqual(sub.status, 'active')
+        self.assertEqual(reconcile_subscriptions().changes, [])
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import stripe
+
+from datetime import timedelta
+
+from django.http import HttpResponse
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.encoding import force_text
+from django.utils.six import StringIO
+
+from events.models import Event
+from ..fakestripe import FakeStripeTestMixin
+from ..models import Charge, Refund, RefundBatch
+from ..pipeline import add_to_event
+from ..refunds import cancel_event, refund_batch, write_report
+
+# Create your refund tests here.
+
+
+class RefundBatchUnitTest(FakeStripeTestMixin, TestCase):
+
+    def setUp(self):
+        super(RefundBatchUnitTest, self).setUp()
+        start = timezone.now() + timedelta(days=7)
+        self.event = Event.objects.create(
+            name='Test event', start_date=start,
+            end_date=start + timedelta(hours=2), member_fee=0,
+            non_member_fee=1000, email_description='Test event')
+        for i in range(3):
+            self.register('attendee{}@user.com'.format(i))
+
+    def register(self, email, first_name='John'):
+        token = stripe.Token.create(card={
+            'number': '4242424242424242', 'exp_month': 8,
+            'exp_year': timezone.now().year + 1, 'cvc': '111'})
+        charge = Charge.objects.create(amount=1000, source=token['id'],
+                                       receipt_email=email)
+        add_to_event(self.event, email, first_name, 'Doe', charge=charge)
+        return charge
+
+    def test_event_charges_are_refunded(self):
+        batch = refund_batch(cancel_event(self.event).pk)
+        self.assertEqual(batch.status, RefundBatch.REFUNDED)
+        self.assertEqual(batch.refunded_count, 3)
+        self.assertEqual(batch.amount_refunded, 3000)
+        self.assertFalse(Event.objects.get(pk=self.event.pk).is_active)
+
+        for charge in Charge.objects.all():
+            self.assertTrue(charge.refunded)
+            self.assertEqual(charge.amount_refunded, 1000)
+            self.assertTrue(stripe.Charge.retrieve(charge.charge_id)
+                            ['refunded'])
+
+    def test_resumed_batch_skips_refunded_charges(self):
+        batch = refund_batch(cancel_event(self.event).pk)
+        requests = self.fake_stripe.fake.requests
+
+        RefundBatch.objects.filter(pk=batch.pk) \
+            .update(status=RefundBatch.REFUNDING)
+        batch = refund_batch(batch.pk)
+        self.assertEqual(self.fake_stripe.fake.requests, requests)
+        self.assertEqual(Refund.objects.count(), 3)
+
+    def test_failures_are_reported(self):
+        # Refunded from the dashboard already.
+        charge = Charge.objects.first()
+        stripe.Refund.create(charge=charge.charge_id)
+
+        batch = refund_batch(cancel_event(self.event).pk)
+        self.assertEqual(batch.status, RefundBatch.FAILED)
+        self.assertEqual((batch.refunded_count, batch.failed_count), (2, 1))
+
+        out = StringIO()
+        write_report(batch, out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].startswith(charge.charge_id))
+        self.assertIn('failed', lines[1])
+
+    def test_report_writes_non_ascii_names(self):
+        self.register('jose@user.com', first_name='José')
+        batch = refund_batch(cancel_event(self.event).pk)
+
+        response = HttpResponse(content_type='text/csv')
+        write_report(batch, response)
+        lines = force_text(response.content).splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertIn('jose@user.com,José,Doe', lines[4])
@@ -2,18 +2,21 @@ import stripe
 
 from datetime import date
 
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
 
 from accounts.models import MyUser
 from billing.models import Plan, Customer, Subscription
+from .. import breaker
+from ..fakestripe import FakeStripeTestMixin
 from ..utils import delete_stripe_plan
 from ..utils import delete_stripe_cus
-from ..utils import cancel_stripe_sub
+from ..utils import cancel_stripe_sub, get_or_create_stripe_sub
+from ..utils import call, idempotency_key
 
 # Create your utils tests here.
 
 
-class StripeUnitTest(TestCase):
+class StripeUnitTest(FakeStripeTestMixin, TestCase):
 
     def create_user(self):
         return MyUser.objects.create_user(
@@ -23,7 +26,7 @@ class StripeUnitTest(TestCase):
     def create_customer(self):
         customer = Customer.objects.create(
             user=self.create_user(), account_balance=10000)
-        cu = stripe.Customer.retrieve(customer.cu_id)
+        cu = stripe.Customer.retrieve(customer.ensure_stripe_customer())
         cu.sources.create(source={
             'object': 'card',
             'number': '4242-4242-4242-4242',
@@ -42,7 +45,7 @@ class StripeUnitTest(TestCase):
                                    interval='year', description='Test plan')
 
     def setUp(self):
-        pass
+        super(StripeUnitTest, self).setUp()
 
     def test_create_and_delete_plan(self):
         plan = self.create_plan()
@@ -59,6 +62,69 @@ class StripeUnitTest(TestCase):
         cu.delete()
         self.assertTrue(deleted, 'Customer should be deleted.')
 
+    def test_customer_is_created_on_stripe_when_first_needed(self):
+        requests = self.fake_stripe.fake.requests
+        cu = Customer.objects.create(user=self.create_user(),
+                                     account_balance=0)
+        self.assertIsNone(cu.cu_id)
+        self.assertEqual(self.fake_stripe.fake.requests, requests)
+
+        cu_id = cu.ensure_stripe_customer()
+        self.assertTrue(cu_id)
+        self.assertEqual(Customer.objects.get(pk=cu.pk).cu_id, cu_id)
+        self.assertEqual(cu.ensure_stripe_customer(), cu_id)
+        self.assertEqual(self.fake_stripe.fake.requests, requests + 1)
+
+    def test_reused_pk_gets_a_new_stripe_customer(self):
+        user = self.create_user()
+        cu = Customer.objects.create(user=user, account_balance=0)
+        first = cu.ensure_stripe_customer()
+        delete_stripe_cus(first)
+        pk = cu.pk
+        cu.delete()
+
+        # Databases may hand out the pk again, e.g. after a rollback.
+        cu = Customer.objects.create(user=user, account_balance=0, pk=pk)
+        second = cu.ensure_stripe_customer()
+        self.assertNotEqual(second, first)
+        self.assertFalse(stripe.Customer.retrieve(second).get('deleted'))
+
+    def test_free_subscription_stays_off_stripe(self):
+        plan = Plan.objects.create(name='Free plan', amount=0,
+                                   interval='year', description='Free plan')
+        requests = self.fake_stripe.fake.requests
+        cu = Customer.objects.create(user=self.create_user(),
+                                     account_balance=0)
+
+        sub = Subscription.objects.create(customer=cu, plan=plan)
+        self.assertEqual(sub.status, 'active')
+        self.assertIsNone(sub.sub_id)
+        self.assertIsNone(Customer.objects.get(pk=cu.pk).cu_id)
+        self.assertEqual(self.fake_stripe.fake.requests, requests)
+
+    def test_current_subscription_follows_changes(self):
+        cu = Customer.objects.create(user=self.create_user(),
+                                     account_balance=0)
+        first = Subscription.objects.create(
+            customer=cu, plan=Plan.objects.create(
+                name='First plan', amount=0, interval='year'))
+        second = Subscription.objects.create(
+            customer=cu, plan=Plan.objects.create(
+                name='Second plan', amount=0, interval='year'))
+        cu.refresh_from_db()
+        self.assertEqual(cu.current_subscription, second)
+        self.assertEqual(cu.subscription_status, 'active')
+
+        second.status = 'canceled'
+        second.save()
+        cu.refresh_from_db()
+        self.assertEqual(cu.current_subscription, first)
+
+        with self.assertNumQueries(1):
+            cu = Customer.objects.with_subscription().get(user=cu.user)
+            self.assertEqual(cu.current_subscription.plan.name, 'First plan')
+            self.assertEqual(cu.user.email, 'test@user.com')
+
     def test_create_and_delete_subscription(self):
         cu = self.create_customer()
         plan = self.create_plan()
@@ -74,3 +140,118 @@ class StripeUnitTest(TestCase):
 
         deleted_plan = delete_stripe_plan(plan.plan_id)
         self.assertTrue(deleted_plan, 'Plan should be deleted.')
+
+    def test_subscription_is_reactivated_with_its_plan(self):
+        cu = self.create_customer()
+        plan = self.create_plan()
+        sub = Subscription.objects.create(customer=cu, plan=plan)
+        cancel_stripe_sub(sub.sub_id, at_period_end=True)
+
+        # The plan matches the mirror, yet the update must be sent.
+        requests = self.fake_stripe.fake.requests
+        stripe_sub = get_or_create_stripe_sub(
+            subscription_id=sub.sub_id, customer=cu.cu_id, plan=plan.plan_id)
+        self.assertEqual(self.fake_stripe.fake.requests, requests + 1)
+        self.assertFalse(stripe_sub['cancel_at_period_end'])
+        self.assertFalse(
+            stripe.Subscription.retrieve(sub.sub_id)['cancel_at_period_end'])
+
+    def test_resubscribing_creates_a_new_subscription(self):
+        cu = self.create_customer()
+        plan = self.create_plan()
+
+        first = Subscription.objects.create(customer=cu, plan=plan)
+        cancel_stripe_sub(first.sub_id)
+        Subscription.objects.filter(pk=first.pk).update(status='canceled')
+
+        # Same customer, plan and day as the canceled subscription.
+        second = Subscription.objects.create(customer=cu, plan=plan)
+        self.assertNotEqual(second.sub_id, first.sub_id)
+        self.assertEqual(second.status, 'active')
+
+
+@override_settings(STRIPE_MAX_ATTEMPTS=3, STRIPE_RETRY_BACKOFF=0)
+class StripeRetryUnitTest(SimpleTestCase):
+
+    def setUp(self):
+        breaker.reset()
+
+    def test_idempotency_key_is_deterministic(self):
+        key = idempotency_key('charge', 1, 'test@user.com', 1000)
+        self.assertEqual(key, idempotency_key('charge', 1, 'test@user.com',
+                                              1000))
+        self.assertNotEqual(key, idempotency_key('charge', 1,
+                                                 'test@user.com', 2000))
+
+    def test_transient_errors_are_retried(self):
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise stripe.error.APIConnectionError('Connection reset.')
+            return 'ok'
+
+        self.assertEqual(call(flaky), 'ok')
+        self.assertEqual(len(attempts), 3)
+
+    def test_card_errors_are_not_retried(self):
+        attempts = []
+
+        def declined():
+            attempts.append(1)
+            raise stripe.error.CardError('Declined.', 'number', 'declined')
+
+        with self.assertRaises(stripe.error.CardError):
+            call(declined)
+        self.assertEqual(len(attempts), 1)
+
+
+@override_settings(STRIPE_MAX_ATTEMPTS=1, STRIPE_BREAKER_THRESHOLD=2,
+                   STRIPE_BREAKER_RESET_SECONDS=60)
+class StripeBreakerUnitTest(SimpleTestCase):
+
+    def setUp(self):
+        breaker.reset()
+        self.attempts = []
+
+        def outage():
+            self.attempts.append(1)
+            raise stripe.error.APIConnectionError('Connection timed out.')
+        self.outage = outage
+
+    def test_breaker_opens_and_fails_fast(self):
+        for i in range(2):
+            with self.assertRaises(stripe.error.APIConnectionError):
+                call(self.outage)
+        with self.assertRaises(breaker.PaymentsUnavailable):
+            call(self.outage)
+        self.assertEqual(len(self.attempts), 2)
+
+        stats = breaker.stats()['stripe.outage']
+        self.assertEqual(stats['state'], breaker.OPEN)
+        self.assertEqual(stats['trips'], 1)
+        self.assertEqual(stats['rejected'], 1)
+        self.assertFalse(breaker.is_available('stripe.outage'))
+
+    def test_half_open_probe_closes_the_breaker(self):
+        for i in range(2):
+            with self.assertRaises(stripe.error.APIConnectionError):
+                call(self.outage)
+        cb = breaker.get_breaker('stripe.outage')
+        cb.opened_at -= 60
+
+        def outage():
+            return 'ok'
+        self.assertEqual(call(outage), 'ok')
+        self.assertEqual(cb.state, breaker.CLOSED)
+
+    def test_card_errors_do_not_trip(self):
+        def declined():
+            raise stripe.error.CardError('Declined.', 'number', 'declined')
+
+        for i in range(3):
+            with self.assertRaises(stripe.error.CardError):
+                call(declined)
+        self.assertEqual(breaker.stats()['stripe.declined']['state'],
+                         breaker.CLOSED)
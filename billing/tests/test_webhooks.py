@@ -0,0 +1,60 @@
+import json
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import MyUser
+from billing.models import Customer, Plan, StripeEvent, Subscription
+from ..webhooks import apply_pending_events, sign_payload
+
+# Create your webhook tests here.
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookUnitTest(TestCase):
+
+    def setUp(self):
+        user = MyUser.objects.create_user(
+            email='test@user.com', first_name='John', last_name='Doe',
+            password='pbkdf2_sha256$12000$64NIBRztT1eL$ip9P9F2vYdCvIXM')
+        customer = Customer(user=user, cu_id='cus_1', account_balance=0,
+                            email=user.email)
+        customer.save()
+        plan = Plan(plan_id='individual', name='Individual', amount=15000,
+                    description='Individual')
+        plan.save()
+        Subscription(sub_id='sub_1', customer=customer, plan=plan,
+                     status='active').save()
+
+    def post_event(self, event_id, created, status, secret='whsec_test'):
+        payload = json.dumps({
+            'id': event_id, 'type': 'customer.subscription.updated',
+            'created': created,
+            'data': {'object': {'id': 'sub_1', 'object': 'subscription',
+                                'status': status, 'quantity': 1,
+                                'plan': {'id': 'individual'}}},
+        })
+        return self.client.post(
+            reverse('billing:webhook'), payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=sign_payload(payload, secret))
+
+    def test_unsigned_events_are_rejected(self):
+        response = self.post_event('evt_1', 1500000000, 'past_due',
+                                   secret='whsec_wrong')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_events_are_deduplicated_and_applied_in_order(self):
+        self.assertEqual(
+            self.post_event('evt_2', 1500000100, 'canceled').status_code, 200)
+        self.post_event('evt_1', 1500000000, 'past_due')
+        self.post_event('evt_2', 1500000100, 'canceled')
+        self.assertEqual(StripeEvent.objects.count(), 2)
+
+        apply_pending_events()
+        self.assertEqual(Subscription.objects.get(sub_id='sub_1').status,
+                         'canceled')
+        self.assertEqual(
+            StripeEvent.objects.get(event_id='evt_1').status,
+            StripeEvent.IGNORED)
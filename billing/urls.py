@@ -7,6 +7,9 @@ from . import views
 
 app_name = 'billing'
 
+INTENT_KEY = r'(?P<key>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-' \
+             r'[0-9a-f]{12})'
+
 
 urlpatterns = [
     url(
@@ -14,6 +17,26 @@ urlpatterns = [
         view=views.checkout,
         name='checkout'
     ),
+    url(
+        regex=r'^checkout/processing/' + INTENT_KEY + r'/$',
+        view=views.checkout_processing,
+        name='checkout_processing'
+    ),
+    url(
+        regex=r'^checkout/status/' + INTENT_KEY + r'/$',
+        view=views.checkout_status,
+        name='checkout_status'
+    ),
+    url(
+        regex=r'^stripe/status/$',
+        view=views.stripe_status,
+        name='stripe_status'
+    ),
+    url(
+        regex=r'^webhook/$',
+        view=views.webhook,
+        name='webhook'
+    ),
     url(
         regex=r'^update_auto_renew/$',
         view=views.update_auto_renew,
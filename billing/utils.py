@@ -1,119 +1,388 @@
+import hashlib
+import logging
+import random
 import stripe
+import time
+import uuid
 
 from datetime import datetime
 
 from django.conf import settings
+from django.utils.encoding import force_text
 from django.utils.text import slugify
 from django.utils.translation import ugettext_lazy as _
 
+from .breaker import get_breaker, operation_name
+from .client import deadline
+from .executor import current_bucket
+from .mirror import changed_fields, forget, recall, remember
+
 # Create you utilities here.
 
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+logger = logging.getLogger(__name__)
+
+
+def idempotency_key(operation, *parts):
+    """Returns the Stripe idempotency key for a local intent, so that
+    repeating the same intent (a retry, a resubmitted form, a restarted
+    worker) never performs the mutation twice."""
+    intent = u'|'.join([operation] + [force_text(part) for part in parts])
+    return '{0}-{1}'.format(
+        operation, hashlib.sha256(intent.encode('utf-8')).hexdigest()[:40])
+
+
+def _retry_after(error):
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _is_retryable(error):
+    if isinstance(error, (stripe.error.APIConnectionError,
+                          stripe.error.RateLimitError)):
+        return True
+    # APIError covers 5xx responses and unparseable ones.
+    status = getattr(error, 'http_status', None)
+    return isinstance(error, stripe.error.APIError) and \
+        (status is None or status >= 500)
+
+
+def call(func, *args, **kwargs):
+    """Calls a Stripe function, retrying connection errors, rate limits
+    and server errors with jittered exponential backoff.
+
+    The whole call, retries included, is bounded by STRIPE_RETRY_BUDGET
+    seconds and STRIPE_MAX_ATTEMPTS attempts. Mutations must carry an
+    idempotency key for the retries to be safe.
+
+    Each attempt goes through the operation's circuit breaker, which
+    raises PaymentsUnavailable at once while Stripe is known to be
+    down. Calls made on a StripeExecutor's workers also wait for its
+    rate limit."""
+    max_attempts = getattr(settings, 'STRIPE_MAX_ATTEMPTS', 3)
+    backoff = getattr(settings, 'STRIPE_RETRY_BACKOFF', 0.5)
+    give_up_at = time.time() + getattr(settings, 'STRIPE_RETRY_BUDGET', 20)
+    breaker = get_breaker(operation_name(func))
+    bucket = current_bucket()
+
+    attempt = 0
+    while True:
+        attempt += 1
+        if bucket is not None:
+            bucket.acquire()
+        breaker.before_call()
+        try:
+            with deadline(give_up_at):
+                result = func(*args, **kwargs)
+        except Exception as e:
+            breaker.record_failure(e)
+            if bucket is not None and \
+                    isinstance(e, stripe.error.RateLimitError):
+                bucket.slow_down(_retry_after(e))
+            if not isinstance(e, stripe.error.StripeError) or \
+                    not _is_retryable(e) or attempt >= max_attempts:
+                raise
+            delay = max(random.uniform(0, backoff * 2 ** (attempt - 1)),
+                        _retry_after(e))
+            if time.time() + delay >= give_up_at:
+                raise
+            logger.warning('Stripe call %s failed (%s), retrying in %.2fs.',
+                           breaker.name, e, delay)
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            if bucket is not None:
+                bucket.speed_up()
+            return result
 
 
 def convert_tstamp(timestamp):
     return datetime.fromtimestamp(timestamp) if timestamp else None
 
 
+def customer_values(obj):
+    """Returns the Customer fields kept in sync with a Stripe customer."""
+    return {
+        'account_balance': max(obj.get('account_balance') or 0, 0),
+        'currency': obj.get('currency') or '',
+        'description': obj.get('description') or '',
+    }
+
+
+def subscription_values(obj):
+    """Returns the Subscription fields kept in sync with a Stripe
+    subscription, apart from its plan."""
+    return {
+        'status': obj.get('status') or '',
+        'quantity': obj.get('quantity') or 1,
+        'cancel_at_period_end': bool(obj.get('cancel_at_period_end')),
+        'canceled_at': convert_tstamp(obj.get('canceled_at')),
+        'current_period_start': convert_tstamp(
+            obj.get('current_period_start')),
+        'current_period_end': convert_tstamp(obj.get('current_period_end')),
+        'ended_at': convert_tstamp(obj.get('ended_at')),
+        'start': convert_tstamp(obj.get('start')),
+        'trial_start': convert_tstamp(obj.get('trial_start')),
+        'trial_end': convert_tstamp(obj.get('trial_end')),
+    }
+
+
+def charge_values(obj):
+    """Returns the Charge fields kept in sync with a Stripe charge."""
+    return {
+        'amount_refunded': obj.get('amount_refunded') or 0,
+        'paid': obj.get('paid'),
+        'refunded': obj.get('refunded'),
+        'captured': obj.get('captured'),
+        'disputed': bool(obj.get('dispute')),
+    }
+
+
+def _update(resource, object_id, always=(), **fields):
+    """Updates the Stripe object without retrieving it first. The request
+    is always sent: the mirror only trims the fields known to be
+    unchanged, and when none is known to differ every field is sent.
+    Fields named in `always` are sent regardless, for updates that do
+    more than set a value (sending a subscription's plan reactivates
+    it)."""
+    fields = dict((name, None if value == '' else value)
+                  for name, value in fields.items() if value != {})
+    object_name = resource.class_name()
+    changed = changed_fields(object_name, object_id, fields)
+    changed.update((name, fields[name]) for name in always if name in fields)
+    if not changed:
+        # A stale mirror must never drop a write.
+        changed = fields
+
+    obj = resource.construct_from({'id': object_id}, stripe.api_key)
+    for name, value in changed.items():
+        setattr(obj, name, value)
+    try:
+        # Updates are keyed per call: retries of this call are safe, while
+        # setting the same values again later still goes through.
+        call(obj.save, idempotency_key='update-{}'.format(uuid.uuid4().hex))
+    except stripe.error.InvalidRequestError:
+        forget(object_name, object_id)
+        raise
+    return remember(obj)
+
+
+def _object_id(value):
+    """Returns the id of a Stripe object or reference."""
+    return value.get('id') if isinstance(value, dict) else value
+
+
+def _delete(resource, object_id, **params):
+    """Deletes the Stripe object without retrieving it first."""
+    obj = resource.construct_from({'id': object_id}, stripe.api_key)
+    try:
+        # DELETE is idempotent, no key needed.
+        call(obj.delete, **params)
+    finally:
+        forget(resource.class_name(), object_id)
+    return obj
+
+
+def create_stripe_plan(name, amount, interval, currency='usd',
+                       interval_count=1, metadata={},
+                       statement_descriptor=None, trial_period_days=0,
+                       plan_id=None):
+    if statement_descriptor == '':
+        statement_descriptor = None
+    plan_id = plan_id or slugify(name)
+    return remember(call(
+        stripe.Plan.create,
+        idempotency_key=idempotency_key('plan', plan_id, amount,
+                                        currency, interval, interval_count),
+        id=plan_id,
+        name=name,
+        amount=amount,
+        interval=interval,
+        currency=currency,
+        interval_count=interval_count,
+        metadata=metadata,
+        statement_descriptor=statement_descriptor,
+        trial_period_days=trial_period_days
+    ))
+
+
+def update_stripe_plan(plan_id, name, metadata={}, statement_descriptor=None,
+                       trial_period_days=0):
+    return _update(stripe.Plan, plan_id, name=name, metadata=metadata,
+                   statement_descriptor=statement_descriptor,
+                   trial_period_days=trial_period_days)
+
+
 def get_or_create_stripe_plan(plan_id, name, amount, interval, currency='usd',
                               interval_count=1, metadata={},
                               statement_descriptor=None,
                               trial_period_days=0):
-    try:
-        plan = stripe.Plan.retrieve(plan_id)
-        plan.plan = plan_id
-        plan.name = name
-        plan.metadata = metadata
-        if statement_descriptor == '':
-            statement_descriptor = None
-        plan.statement_descriptor = statement_descriptor
-        plan.trial_period_days = trial_period_days
-        plan.save()
-    except stripe.error.InvalidRequestError:
-        plan = stripe.Plan.create(
-            id=slugify(name),
-            name=name,
-            amount=amount,
-            interval=interval,
-            currency=currency,
-            interval_count=interval_count,
-            metadata=metadata,
-            statement_descriptor=statement_descriptor,
-            trial_period_days=trial_period_days
-        )
-    return plan
+    if plan_id:
+        try:
+            return update_stripe_plan(
+                plan_id, name=name, metadata=metadata,
+                statement_descriptor=statement_descriptor,
+                trial_period_days=trial_period_days)
+        except stripe.error.InvalidRequestError:
+            pass
+    return create_stripe_plan(
+        name=name, amount=amount, interval=interval, currency=currency,
+        interval_count=interval_count, metadata=metadata,
+        statement_descriptor=statement_descriptor,
+        trial_period_days=trial_period_days)
 
 
 def delete_stripe_plan(plan_id):
     try:
-        plan = stripe.Plan.retrieve(plan_id)
-        plan.delete()
+        _delete(stripe.Plan, plan_id)
         return True
     except stripe.error.InvalidRequestError:
         return False
 
 
+def create_stripe_cus(account_balance=0, description=None, email=None,
+                      metadata={}, shipping={}, source={}, key=None):
+    # Without a key from the caller's local row, only this call's own
+    # retries share one.
+    return remember(call(
+        stripe.Customer.create,
+        idempotency_key=key or idempotency_key('customer', uuid.uuid4()),
+        account_balance=account_balance, description=description,
+        email=email, metadata=metadata, shipping=shipping, source=source
+    ))
+
+
+def update_stripe_cus(customer_id, account_balance=0, description=None,
+                      email=None, metadata={}, shipping={}, source={}):
+    fields = {'description': description, 'email': email,
+              'metadata': metadata, 'shipping': shipping, 'source': source}
+    if account_balance > 0:
+        fields['account_balance'] = account_balance
+    return _update(stripe.Customer, customer_id, **fields)
+
+
+def attach_stripe_source(customer_id, source):
+    """Makes the source (usually a Stripe.js card token) the customer's
+    default card."""
+    return _update(stripe.Customer, customer_id, always=('source',),
+                   source=source)
+
+
 def get_or_create_stripe_cus(customer_id, account_balance=0, description=None,
                              email=None, metadata={}, shipping={}, source={}):
-
-    try:
-        cu = stripe.Customer.retrieve(customer_id)
-        if account_balance > 0:
-            cu.account_balance = account_balance
-        cu.description = description
-        cu.email = email
-        cu.metadata = metadata
-        cu.shipping = shipping
-        cu.source = source
-        cu.save()
-    except stripe.error.InvalidRequestError:
-        cu = stripe.Customer.create(
-            account_balance=account_balance, description=description,
-            email=email, metadata=metadata, shipping=shipping, source=source
-        )
-    return cu
+    if customer_id:
+        try:
+            return update_stripe_cus(
+                customer_id, account_balance=account_balance,
+                description=description, email=email, metadata=metadata,
+                shipping=shipping, source=source)
+        except stripe.error.InvalidRequestError:
+            pass
+    return create_stripe_cus(
+        account_balance=account_balance, description=description,
+        email=email, metadata=metadata, shipping=shipping, source=source)
 
 
 def delete_stripe_cus(customer_id):
     try:
-        cu = stripe.Customer.retrieve(customer_id)
-        cu.delete()
+        _delete(stripe.Customer, customer_id)
         return True
     except stripe.error.InvalidRequestError:
         return False
 
 
+def create_stripe_sub(customer, metadata={}, plan=None, quantity=1, source={},
+                      trial_end=None, trial_period_days=0, key=None):
+    return remember(call(
+        stripe.Subscription.create,
+        idempotency_key=key or idempotency_key('subscription', uuid.uuid4()),
+        customer=customer,
+        metadata=metadata,
+        plan=plan,
+        quantity=quantity,
+        source=source,
+        trial_end=trial_end,
+        trial_period_days=trial_period_days
+    ))
+
+
+def update_stripe_sub(subscription_id, metadata={}, plan=None, quantity=1,
+                      source={}):
+    # Sending the plan also reactivates a subscription set to cancel at
+    # the end of its period.
+    return _update(stripe.Subscription, subscription_id,
+                   always=('plan', 'source'), metadata=metadata, plan=plan,
+                   quantity=quantity, source=source)
+
+
 def get_or_create_stripe_sub(subscription_id, customer, metadata={}, plan=None,
                              quantity=1, source={}, trial_end=None,
                              trial_period_days=0):
+    if subscription_id:
+        try:
+            return update_stripe_sub(subscription_id, metadata=metadata,
+                                     plan=plan, quantity=quantity,
+                                     source=source)
+        except stripe.error.InvalidRequestError:
+            pass
+    return create_stripe_sub(
+        customer=customer, metadata=metadata, plan=plan, quantity=quantity,
+        source=source, trial_end=trial_end,
+        trial_period_days=trial_period_days)
+
+
+def cancel_stripe_sub(subscription_id, at_period_end=False):
     try:
-        sub = stripe.Subscription.retrieve(subscription_id)
-        sub.metadata = metadata
-        sub.plan = plan
-        sub.quantity = quantity
-        sub.source = source
-        sub.save()
+        sub = _delete(stripe.Subscription, subscription_id,
+                      at_period_end=at_period_end)
     except stripe.error.InvalidRequestError:
-        sub = stripe.Subscription.create(
-            customer=customer,
+        return None
+    return remember(sub)
+
+
+def create_stripe_charge(amount, currency='usd', application_fee=None,
+                         capture=True, description=None, destination=None,
+                         metadata={}, receipt_email=None, shipping={},
+                         customer=None, source={}, statement_descriptor=None,
+                         key=None):
+    """Creates the charge. `key` should identify what is being paid for;
+    without one the key is derived from the charge itself."""
+    if not source and not customer:
+        raise ValueError(_('Charges must have a source or a customer.'))
+
+    if key is None:
+        key = idempotency_key('charge', customer or _object_id(source),
+                              amount, currency, description)
+    try:
+        charge = call(
+            stripe.Charge.create,
+            idempotency_key=key,
+            amount=amount,
+            currency=currency,
+            application_fee=application_fee,
+            capture=capture,
+            description=description,
+            destination=destination,
             metadata=metadata,
-            plan=plan,
-            quantity=quantity,
+            receipt_email=receipt_email,
+            shipping=shipping,
+            customer=customer,
             source=source,
-            trial_end=trial_end,
-            trial_period_days=trial_period_days
+            statement_descriptor=statement_descriptor
         )
-    return sub
+    except stripe.CardError:
+        return None
+    return remember(charge)
 
 
-def cancel_stripe_sub(subscription_id, at_period_end=False):
-    try:
-        sub = stripe.Subscription.retrieve(subscription_id)
-        sub.delete(at_period_end=at_period_end)
-    except stripe.error.InvalidRequestError:
-        sub = None
-    return sub
+def update_stripe_charge(charge_id, description=None, metadata={},
+                         receipt_email=None, fraud_details={}, shipping={}):
+    return _update(stripe.Charge, charge_id, description=description,
+                   metadata=metadata, receipt_email=receipt_email,
+                   fraud_details=fraud_details, shipping=shipping)
 
 
 def get_or_create_stripe_charge(charge_id, amount, currency='usd',
@@ -121,34 +390,36 @@ def get_or_create_stripe_charge(charge_id, amount, currency='usd',
                                 description=None, destination=None,
                                 metadata={}, fraud_details={},
                                 receipt_email=None, shipping={}, customer=None,
-                                source={}, statement_descriptor=None):
-    if not source and not customer:
-        raise ValueError(_('Charges must have a source or a customer.'))
-
-    try:
-        charge = stripe.Charge.retrieve(charge_id)
-        charge.description = description
-        charge.metadata = metadata
-        charge.receipt_email = receipt_email
-        charge.fraud_details = fraud_details
-        charge.shipping = shipping
-        charge.save()
-    except stripe.error.InvalidRequestError:
+                                source={}, statement_descriptor=None,
+                                key=None):
+    if charge_id:
         try:
-            charge = stripe.Charge.create(
-                amount=amount,
-                currency=currency,
-                application_fee=application_fee,
-                capture=capture,
-                description=description,
-                destination=destination,
-                metadata=metadata,
-                receipt_email=receipt_email,
-                shipping=shipping,
-                customer=customer,
-                source=source,
-                statement_descriptor=statement_descriptor
-            )
-        except stripe.CardError:
-            charge = None
-    return charge
+            return update_stripe_charge(
+                charge_id, description=description, metadata=metadata,
+                receipt_email=receipt_email, fraud_details=fraud_details,
+                shipping=shipping)
+        except stripe.error.InvalidRequestError:
+            pass
+    return create_stripe_charge(
+        amount=amount, currency=currency, application_fee=application_fee,
+        capture=capture, description=description, destination=destination,
+        metadata=metadata, receipt_email=receipt_email, shipping=shipping,
+        customer=customer, source=source,
+        statement_descriptor=statement_descriptor, key=key)
+
+
+def create_stripe_refund(charge_id, amount=None, reason=None, metadata={}):
+    """Refunds the charge, in full unless `amount` is given. The key only
+    depends on the charge and amount, so the same refund is never issued
+    twice however often it is retried."""
+    refund = call(
+        stripe.Refund.create,
+        idempotency_key=idempotency_key('refund', charge_id, amount or ''),
+        charge=charge_id,
+        amount=amount,
+        reason=reason,
+        metadata=metadata
+    )
+    # The charge's refund fields changed on Stripe.
+    forget('charge', charge_id)
+    return remember(refund)
@@ -1,38 +1,88 @@
+import logging
+
+from django.conf import settings
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseForbidden, JsonResponse
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         HttpResponseForbidden, JsonResponse)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
-from contact.models import Newsletter
-from events.models import Attendee, Event
+from core.tasks import enqueue_on_commit
+from events.models import Event, Registration, SeatHold
+from .breaker import PaymentsUnavailable, is_available
+from .breaker import stats as breaker_stats
+from .client import get_client
 from .forms import StripeCreditCardForm
-from .models import Customer, Subscription
+from .models import Customer, RegistrationIntent
+from .pipeline import add_to_event, submit_intent
 from .utils import get_or_create_stripe_sub, cancel_stripe_sub
+from .webhooks import (SignatureError, apply_pending_events, record_event,
+                       verify_signature)
 
 # Create your views here.
 
 
+logger = logging.getLogger(__name__)
+
+
+@staff_member_required
+def stripe_status(request):
+    """Reports how well this worker is reusing its Stripe connections."""
+    return JsonResponse({'client': get_client().stats(),
+                         'breakers': breaker_stats()})
+
+
+@csrf_exempt
+@require_http_methods(['POST'])
+def webhook(request):
+    """Receives Stripe events. They are stored and acknowledged right
+    away, and applied on a background task."""
+    try:
+        verify_signature(request.body,
+                         request.META.get('HTTP_STRIPE_SIGNATURE'),
+                         getattr(settings, 'STRIPE_WEBHOOK_SECRET', ''))
+        event, created = record_event(request.body)
+    except SignatureError as e:
+        logger.warning('Rejected Stripe webhook: %s', e)
+        return HttpResponseBadRequest()
+    except (ValueError, KeyError):
+        return HttpResponseBadRequest()
+
+    if created:
+        enqueue_on_commit(apply_pending_events)
+    return HttpResponse(status=200)
+
+
 @login_required
 @require_http_methods(['POST'])
 def update_auto_renew(request):
-    customer = get_object_or_404(Customer, user=request.user)
+    customer = get_object_or_404(Customer.objects.with_subscription(),
+                                 user=request.user)
     customer.auto_renew = False if customer.auto_renew else True
-    customer.save(update_fields=['auto_renew'])
-    sub = Subscription.objects.filter(
-        customer=customer).order_by('created').first()
+    sub = customer.current_subscription
 
     if sub:
-        if sub.cancel_at_period_end:
-            stripe_sub = get_or_create_stripe_sub(subscription_id=sub.sub_id,
-                                                  customer=customer.cu_id,
-                                                  plan=sub.plan.plan_id)
+        if not sub.sub_id:
+            # Free memberships only exist locally.
+            sub.cancel_at_period_end = not customer.auto_renew
+        elif sub.cancel_at_period_end:
+            stripe_sub = get_or_create_stripe_sub(
+                subscription_id=sub.sub_id,
+                customer=customer.ensure_stripe_customer(),
+                plan=sub.plan.plan_id)
+            sub.cancel_at_period_end = stripe_sub['cancel_at_period_end']
         else:
             stripe_sub = cancel_stripe_sub(subscription_id=sub.sub_id,
                                            at_period_end=True)
-
-        sub.cancel_at_period_end = stripe_sub['cancel_at_period_end']
+            sub.cancel_at_period_end = stripe_sub['cancel_at_period_end']
+        # Saved only once Stripe has taken the change.
+        customer.save(update_fields=['auto_renew'])
         sub.save(update_fields=['cancel_at_period_end'])
 
         messages.success(request, _("You have updated your preferences."))
@@ -42,23 +92,12 @@ def update_auto_renew(request):
     return JsonResponse(_('Error.'))
 
 
-def _add_to_event(event, email, first_name, last_name):
-    """
-    Adds a user to the event, and adds them to the newsletter.
-    """
-    attendee = Attendee.objects.create(email=email, first_name=first_name,
-                                       last_name=last_name)
-    event.attendees.add(attendee)
-    Newsletter.objects.get_or_create(email=email, first_name=first_name,
-                                     last_name=last_name)
-    return True
-
-
 def checkout(request, event_pk):
     user = request.user
     event = get_object_or_404(Event, pk=event_pk)
     is_auth = user.is_authenticated()
-    is_attending = event.attendees.filter(email__iexact=user.email).exists()
+    is_attending = is_auth and Registration.objects.is_registered(event,
+                                                                  user.email)
     event_price = event.member_fee if is_auth else event.non_member_fee
 
     # Forbid if user is already attending
@@ -67,44 +106,88 @@ def checkout(request, event_pk):
 
     # User is authenticated and not registered for the event
     if is_auth and event_price == 0 and not is_attending:
-        _add_to_event(event=event, email=user.email,
-                      first_name=user.first_name, last_name=user.last_name)
+        hold = SeatHold.objects.reserve(event, user.email)
+        if hold is None:
+            messages.error(request, _('Sorry, this event is sold out.'))
+            return redirect(event.get_absolute_url())
+        if not add_to_event(event=event, email=user.email,
+                            first_name=user.first_name,
+                            last_name=user.last_name):
+            # A concurrent submit registered the user first.
+            hold.release()
+            messages.error(
+                request, _('This email is already registered for this event.'))
+            return redirect(event.get_absolute_url())
+        hold.commit()
         return redirect(event.get_reg_success_url())
 
-    try:
-        cu = Customer.objects.get(user=user if is_auth else None)
-    except Customer.DoesNotExist:
-        cu = None
+    if event.is_sold_out:
+        messages.error(request, _('Sorry, this event is sold out.'))
+        return redirect(event.get_absolute_url())
 
+    # Don't take a seat and a card while charges are failing.
+    if not is_available('charge.create'):
+        raise PaymentsUnavailable('charge.create')
+
+    # The card token is charged directly; members' saved cards are left
+    # alone.
     form = StripeCreditCardForm(request.POST or None,
-                                user=user if is_auth else None,
-                                customer=cu)
+                                user=user if is_auth else None)
 
-    # Create the charge
     if request.method == 'POST' and form.is_valid():
         email = form.cleaned_data['email']
 
         # User is not authenticated and not registered for the event
-        if not event.attendees.filter(email__iexact=email).exists():
-            charge = form.charge_customer(
-                amount=event_price,
-                description='Charge from {} for {}'.format(email, event.name),
-                receipt_email=email
-            )
-
-            # Charge was created
-            if charge:
-                _add_to_event(event=event, email=email,
-                              first_name=form.cleaned_data['first_name'],
-                              last_name=form.cleaned_data['last_name'])
-                return redirect(event.get_reg_success_url())
-
-            # Error creating charge
-            messages.error(request,
-                           _('There was an error processing your request.'))
-        # User already registered for event
-        messages.error(request,
-                       _('This email is already registered for this event.'))
+        if Registration.objects.is_registered(event, email):
+            messages.error(
+                request, _('This email is already registered for this event.'))
+        else:
+            # Hold a seat before charging, so a full event is never charged
+            hold = SeatHold.objects.reserve(event, email)
+            if hold is None:
+                messages.error(request, _('Sorry, this event is sold out.'))
+                return redirect(event.get_absolute_url())
+
+            # The charge runs on a background worker; the buyer waits on
+            # the processing page.
+            intent = submit_intent(event, hold, form, event_price)
+            return redirect('billing:checkout_processing', key=intent.key)
+    elif form.errors:
+        for error in form.non_field_errors():
+            messages.error(request, error)
+        for field in form:
+            for error in field.errors:
+                messages.error(request, error)
 
     ctx = {'form': form, 'event_price': event_price}
     return render(request, 'billing/checkout.html', ctx)
+
+
+@never_cache
+def checkout_processing(request, key):
+    intent = get_object_or_404(
+        RegistrationIntent.objects.select_related('event'), key=key)
+    if intent.status == RegistrationIntent.CONFIRMED:
+        return redirect(intent.event.get_reg_success_url())
+    return render(request, 'billing/processing.html', {'intent': intent})
+
+
+@never_cache
+def checkout_status(request, key):
+    """Polled by the processing page. Reads a single row and renders no
+    template, so it stays cheap however often it is called."""
+    try:
+        intent = RegistrationIntent.objects \
+            .values('status', 'event_id', 'error').get(key=key)
+    except RegistrationIntent.DoesNotExist:
+        raise Http404
+
+    data = {'status': intent['status']}
+    if intent['status'] == RegistrationIntent.CONFIRMED:
+        data['redirect'] = reverse('events:reg_success',
+                                   kwargs={'event_pk': intent['event_id']})
+    elif intent['status'] == RegistrationIntent.FAILED:
+        data['error'] = intent['error']
+        data['redirect'] = reverse('billing:checkout',
+                                   kwargs={'event_pk': intent['event_id']})
+    return JsonResponse(data)
@@ -0,0 +1,236 @@
+"""
+Stripe webhook ingestion.
+
+The webhook view only verifies the signature and stores the event
+(`record_event`), so Stripe gets its response right away. The events are
+then applied to the local Customer, Subscription and Charge rows by
+`apply_pending_events`, which runs on a background task after each
+delivery and from `manage.py apply_stripe_events`.
+
+Events are applied in batches, oldest first. Every Stripe event carries
+a full snapshot of its object, so within a batch only the newest event
+per object needs applying. An event older than one already applied to
+the same object is skipped, which keeps concurrent workers from rolling
+a row back.
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import time
+
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.encoding import force_bytes, force_text
+
+from .mirror import remember
+from .models import Charge, Customer, Plan, StripeEvent, Subscription
+from .signals import update_rows
+from .utils import (charge_values, convert_tstamp, customer_values,
+                    subscription_values)
+
+# Create your webhooks here.
+
+
+logger = logging.getLogger(__name__)
+
+
+class SignatureError(Exception):
+    pass
+
+
+def verify_signature(payload, header, secret, tolerance=None):
+    """Checks a Stripe-Signature header against the raw request body.
+    Raises SignatureError unless one of its v1 signatures matches and its
+    timestamp is recent enough."""
+    if tolerance is None:
+        tolerance = getattr(settings, 'STRIPE_WEBHOOK_TOLERANCE', 5 * 60)
+    if not secret:
+        raise SignatureError('STRIPE_WEBHOOK_SECRET is not set.')
+
+    timestamp = None
+    signatures = []
+    for item in (header or '').split(','):
+        name, _, value = item.strip().partition('=')
+        if name == 't':
+            timestamp = value
+        elif name == 'v1':
+            signatures.append(value)
+    if not timestamp or not signatures:
+        raise SignatureError('Malformed Stripe-Signature header.')
+
+    try:
+        age = time.time() - int(timestamp)
+    except ValueError:
+        raise SignatureError('Malformed Stripe-Signature timestamp.')
+    if tolerance and age > tolerance:
+        raise SignatureError('Stripe-Signature timestamp is too old.')
+
+    expected = hmac.new(force_bytes(secret),
+                        force_bytes(timestamp) + b'.' + force_bytes(payload),
+                        hashlib.sha256).hexdigest()
+    if not any(constant_time_compare(expected, signature)
+               for signature in signatures):
+        raise SignatureError('No matching Stripe-Signature.')
+
+
+def record_event(payload):
+    """Stores the raw event. Returns (event, created); a redelivered event
+    is returned with created=False and is not stored twice."""
+    data = json.loads(force_text(payload))
+    obj = data.get('data', {}).get('object', {})
+    try:
+        with transaction.atomic():
+            event = StripeEvent.objects.create(
+                event_id=data['id'], type=data.get('type', ''),
+                object_id=obj.get('id') or '',
+                event_created=convert_tstamp(data.get('created')) or
+                timezone.now(),
+                payload=force_text(payload))
+    except IntegrityError:
+        return StripeEvent.objects.get(event_id=data['id']), False
+    return event, True
+
+
+def apply_pending_events(batch_size=None):
+    """Applies pending events in batches until none are left. Returns the
+    number of events processed."""
+    if batch_size is None:
+        batch_size = getattr(settings, 'STRIPE_WEBHOOK_BATCH_SIZE', 100)
+    processed = 0
+    while True:
+        count = _apply_batch(batch_size)
+        if not count:
+            return processed
+        processed += count
+
+
+def retry_failed_events():
+    StripeEvent.objects.filter(status=StripeEvent.FAILED) \
+        .update(status=StripeEvent.PENDING)
+    return apply_pending_events()
+
+
+def _apply_batch(batch_size):
+    with transaction.atomic():
+        events = StripeEvent.objects \
+            .filter(status=StripeEvent.PENDING) \
+            .order_by('event_created', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            # Concurrent workers take disjoint batches.
+            events = events.select_for_update(skip_locked=True)
+        events = list(events[:batch_size])
+        if not events:
+            return 0
+
+        # Only the newest snapshot of each object matters.
+        latest = OrderedDict()
+        superseded = []
+        for event in events:
+            key = event.object_id or event.event_id
+            if key in latest:
+                superseded.append(latest[key].pk)
+            latest[key] = event
+
+        now = timezone.now()
+        if superseded:
+            StripeEvent.objects.filter(pk__in=superseded).update(
+                status=StripeEvent.IGNORED, processed_at=now,
+                attempts=F('attempts') + 1)
+
+        for event in latest.values():
+            status, error = _apply_event(event)
+            StripeEvent.objects.filter(pk=event.pk).update(
+                status=status, error=error, processed_at=now,
+                attempts=F('attempts') + 1)
+    return len(events)
+
+
+def _apply_event(event):
+    """Applies one event in its own savepoint. Returns (status, error)."""
+    newer = StripeEvent.objects \
+        .filter(object_id=event.object_id, status=StripeEvent.APPLIED,
+                event_created__gt=event.event_created) \
+        .exclude(object_id='') \
+        .exists()
+    if newer:
+        return StripeEvent.IGNORED, ''
+
+    handler = _handler_for(event.type)
+    if handler is None:
+        return StripeEvent.IGNORED, ''
+
+    try:
+        with transaction.atomic():
+            obj = json.loads(event.payload)['data']['object']
+            handler(event.type, obj)
+            if obj.get('object') in ('customer', 'subscription', 'charge'):
+                remember(obj)
+    except Exception as e:
+        logger.exception('Failed to apply Stripe event %s.', event.event_id)
+        return StripeEvent.FAILED, force_text(e) or e.__class__.__name__
+    return StripeEvent.APPLIED, ''
+
+
+def _update_rows(model, lookup, fields):
+    pks = list(model.objects.filter(**lookup).values_list('pk', flat=True))
+    update_rows(model, pks, **fields)
+
+
+def _handler_for(event_type):
+    if event_type.startswith('customer.subscription.'):
+        return _apply_subscription
+    elif event_type.startswith('charge.dispute.'):
+        return _apply_dispute
+    elif event_type.startswith('charge.'):
+        return _apply_charge
+    elif event_type in ('customer.created', 'customer.updated',
+                        'customer.deleted'):
+        return _apply_customer
+    return None
+
+
+def _apply_subscription(event_type, obj):
+    fields = subscription_values(obj)
+    fields['modified'] = timezone.now()
+    plan_id = (obj.get('plan') or {}).get('id')
+    if plan_id:
+        plan = Plan.objects.filter(plan_id=plan_id).first()
+        if plan is not None:
+            fields['plan'] = plan
+    # Subscriptions are created locally; events for others are ignored.
+    _update_rows(Subscription, {'sub_id': obj['id']}, fields)
+
+
+def _apply_charge(event_type, obj):
+    _update_rows(Charge, {'charge_id': obj['id']}, charge_values(obj))
+
+
+def _apply_dispute(event_type, obj):
+    # A dispute the platform won no longer counts against the charge.
+    Charge.objects.filter(charge_id=obj.get('charge')).update(
+        disputed=obj.get('status') != 'won')
+
+
+def _apply_customer(event_type, obj):
+    customers = Customer.objects.filter(cu_id=obj['id'])
+    if event_type == 'customer.deleted':
+        customers.update(is_active=False, modified=timezone.now())
+        return
+    customers.update(modified=timezone.now(), **customer_values(obj))
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """Returns a Stripe-Signature header for the payload, as Stripe would
+    send it, for tests."""
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(force_bytes(secret),
+                         force_bytes(timestamp) + b'.' + force_bytes(payload),
+                         hashlib.sha256).hexdigest()
+    return 't={0},v1={1}'.format(timestamp, signature)
@@ -1,10 +1,8 @@
-import stripe
-
-from django.conf import settings
 from django.core.management.base import BaseCommand
 
 from accounts.models import MyUser
 from billing.models import Customer, Plan, Subscription
+from billing.plan_sync import sync_plans
 from events.models import Event
 
 # Create your commands here.
@@ -22,42 +20,13 @@ class Command(BaseCommand):
 
 
 def _create_stripe_plans(command):
-    stripe.api_key = settings.STRIPE_SECRET_KEY
-    plans = [
-        ['Individual', 15000, "Any person interested in the promotion and "
-                              "development of the professional liability "
-                              "industry is eligible for membership"
-                              "<br/><br/><br/><br/>"],
-        ['Corporate Member', 100000, "Must be an employee of a Corporate "
-                                     "Sponsor\n\nCorporate affiliates hold "
-                                     "the same rights as an individual "
-                                     "member"],
-        ['Future', 5000, "Must be 35 years of age or younger and involved in "
-                         "the professional liability industry\n\nFull "
-                         "membership benefits, including member discounts for "
-                         "event registration"],
-        ['Academic', 0, "Website access only\n\nMust be a student or teacher "
-                        "at an academic institution"],
-        ['Admin', 0, "Used for administrative purposes only"]
-    ]
-
-    for plan in plans:
-        if not Plan.objects.filter(name=plan[0]).exists():
-            new_p = Plan.objects.create(
-                name=plan[0],
-                amount=plan[1],
-                interval='year',
-                description=plan[2] if plan[2] else ''
-            )
-            if plan[0] == 'Admin':
-                new_p.is_active = False
-                new_p.save(update_fields=['is_active'])
-            command.stdout.write(
-                command.style.WARNING('Created {} plan.'.format(new_p.name))
-            )
+    report = sync_plans()
+    for spec in report.local_create:
+        command.stdout.write(
+            command.style.WARNING('Created {} plan.'.format(spec['name'])))
     command.stdout.write(
         command.style.SUCCESS('Successfully created all plans on Stripe.'))
-    return True
+    return not report.errors
 
 
 def _create_demo_accounts(command):
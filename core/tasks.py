@@ -0,0 +1,73 @@
+"""
+A small in-process task queue.
+
+Work handed to `enqueue` runs on a pool of daemon threads in the current
+process, outside of the request/response cycle. Tasks are expected to keep
+their own progress in the database so that a management command can pick
+up anything a restarted worker dropped.
+
+Set TASKS_ALWAYS_EAGER = True to run tasks inline (tests, shell sessions).
+"""
+
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils.six.moves import queue
+
+# Create your tasks here.
+
+
+logger = logging.getLogger(__name__)
+
+_queue = queue.Queue()
+_workers = []
+_workers_pid = None
+_lock = threading.Lock()
+
+
+def enqueue(func, *args, **kwargs):
+    """Schedules `func(*args, **kwargs)` on the background workers."""
+    if getattr(settings, 'TASKS_ALWAYS_EAGER', False):
+        return func(*args, **kwargs)
+    _ensure_workers()
+    _queue.put((func, args, kwargs))
+
+
+def enqueue_on_commit(func, *args, **kwargs):
+    """Schedules the task once the current transaction has committed, so
+    the worker never sees rows that are not there yet."""
+    transaction.on_commit(lambda: enqueue(func, *args, **kwargs))
+
+
+def _ensure_workers():
+    global _queue, _workers, _workers_pid
+
+    with _lock:
+        # Threads do not survive a fork (e.g. gunicorn --preload).
+        if _workers_pid != os.getpid():
+            _queue = queue.Queue()
+            _workers = []
+            _workers_pid = os.getpid()
+
+        _workers = [w for w in _workers if w.is_alive()]
+        for i in range(getattr(settings, 'TASK_WORKERS', 2) - len(_workers)):
+            worker = threading.Thread(target=_work, name='task-worker')
+            worker.daemon = True
+            worker.start()
+            _workers.append(worker)
+
+
+def _work():
+    while True:
+        func, args, kwargs = _queue.get()
+        close_old_connections()
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception('Task %s failed.', getattr(func, '__name__', func))
+        finally:
+            close_old_connections()
+            _queue.task_done()
@@ -1,13 +1,24 @@
-from django.conf import settings
 from django.contrib import admin, messages
+from django.utils import timezone
 from django.utils.translation import ugettext as _
 
-from .models import Event
-from .utils import send_event_email
+from billing.refunds import cancel_event
+from .models import (Attendee, EmailBatch, EmailCampaign, Event, Registration,
+                     SeatHold)
+from .search import search_events
+from .utils import resume_campaign, retry_campaign, send_event_email
 
 # Register your models here.
 
 
+class RegistrationInline(admin.TabularInline):
+    model = Registration
+    extra = 0
+    fields = ('attendee', 'registered_at', 'charge',)
+    raw_id_fields = ('attendee', 'charge',)
+    readonly_fields = ('registered_at',)
+
+
 @admin.register(Event)
 class EventAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'start_date', 'end_date',
@@ -15,79 +26,166 @@ class EventAdmin(admin.ModelAdmin):
     list_display_links = ('id', 'name',)
     list_filter = ('start_date', 'end_date', 'created', 'modified',
                    'is_active',)
-    raw_id_fields = ['sponsors', 'attendees']
+    raw_id_fields = ['sponsors']
     fieldsets = (
         (None,
             {'fields': ('name', 'start_date', 'end_date', 'description',
                         'email_description', 'member_fee', 'non_member_fee',
-                        'sponsors', 'attendees',)}),
+                        'sponsors',)}),
+        (_('Registration'),
+            {'fields': ('capacity', 'attendee_count', 'seats_held',)}),
         (_('Permissions'),
             {'fields': ('is_active',)}),
         (_('Dates'),
             {'fields': ('created', 'modified',)}),
     )
-    readonly_fields = ('created', 'modified', 'attendees',)
-    search_fields = ('name', 'sponsors__name', 'sponsors__email',
-                     'attendees__first_name', 'attendees_last_name',
-                     'attendees__email',)
-    actions = ('send_email_to_list', 'enable', 'disable',)
+    readonly_fields = ('created', 'modified', 'attendee_count', 'seats_held',)
+    # Matched through the search index; see get_search_results.
+    search_fields = ('name', 'sponsors__name', 'attendees__first_name',
+                     'attendees__last_name', 'attendees__email',)
+    actions = ('send_email_to_list', 'enable', 'disable', 'cancel_and_refund',)
+    inlines = [RegistrationInline]
 
     class Meta:
         model = Event
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_events(search_term, queryset,
+                             include_attendees=True), False
+
     def save_model(self, request, obj, form, change):
-        if not obj.pk:
-            obj.save()
+        is_new = not obj.pk
+        obj.save()
+        if is_new:
             # send email about new event
-            send_event_email({
-                'protocol': 'https' if request.is_secure() else 'http',
-                'domain': request.get_host(),
-                'event_name': obj.name,
-                'event_start_date': obj.event_start_date,
-                'event_end_date': obj.event_end_date,
-                'event_pk': obj.pk,
-                'event_member_fee': obj.member_fee,
-                'event_non_member_fee': obj.non_member_fee,
-                'event_email_description': obj.email_description,
-                'event_sponsors': obj.get_sponsors_info,
-                'event_url': obj.get_absolute_url,
-                'contact_email': settings.DEFAULT_HR_EMAIL
-            })
-        else:
-            obj.save()
+            send_event_email(obj, protocol=request.scheme,
+                             domain=request.get_host())
         return obj
 
     def send_email_to_list(self, request, queryset):
         """Sends an email about the event to the mailing list."""
         for obj in queryset:
-            send_event_email({
-                'protocol': 'https' if request.is_secure() else 'http',
-                'domain': request.get_host(),
-                'event_name': obj.name,
-                'event_start_date': obj.event_start_date,
-                'event_end_date': obj.event_end_date,
-                'event_pk': obj.pk,
-                'event_member_fee': obj.member_fee,
-                'event_non_member_fee': obj.non_member_fee,
-                'event_email_description': obj.email_description,
-                'event_sponsors': obj.get_sponsors_info,
-                'event_url': obj.get_absolute_url,
-                'contact_email': settings.DEFAULT_HR_EMAIL
-            })
+            send_event_email(obj, protocol=request.scheme,
+                             domain=request.get_host())
         messages.add_message(
-            request, messages.SUCCESS, _('Emails have been sent.'))
+            request, messages.SUCCESS, _('Emails are being sent.'))
     send_email_to_list.short_description = _("Send event email")
 
     def enable(self, request, queryset):
         """Updates is_active to be True."""
-        queryset.update(is_active=True)
+        queryset.update(is_active=True, modified=timezone.now())
+        Event.objects.invalidate_cache()
         messages.add_message(
             request, messages.SUCCESS, _('Events have been enabled.'))
     enable.short_description = _("Make events public")
 
     def disable(self, request, queryset):
         """Updates is_active to be False."""
-        queryset.update(is_active=False)
+        queryset.update(is_active=False, modified=timezone.now())
+        Event.objects.invalidate_cache()
         messages.add_message(
             request, messages.SUCCESS, _('Events have been disabled.'))
     disable.short_description = _("Disable events")
+
+    def cancel_and_refund(self, request, queryset):
+        """Disables the events and refunds every paid registration in the
+        background."""
+        for obj in queryset:
+            cancel_event(obj)
+        messages.add_message(
+            request, messages.SUCCESS,
+            _('Events have been cancelled and their registrations are being '
+              'refunded.'))
+    cancel_and_refund.short_description = _("Cancel events and refund "
+                                            "registrations")
+
+
+@admin.register(Attendee)
+class AttendeeAdmin(admin.ModelAdmin):
+    list_display = ('id', 'email', 'full_name', 'event_name', 'created',)
+    list_display_links = ('id', 'email',)
+    list_filter = ('created',)
+    readonly_fields = ('created', 'modified',)
+    search_fields = ('email', 'first_name', 'last_name',)
+
+    class Meta:
+        model = Attendee
+
+    def get_queryset(self, request):
+        return Attendee.objects.with_events()
+
+
+@admin.register(SeatHold)
+class SeatHoldAdmin(admin.ModelAdmin):
+    list_display = ('id', 'event', 'email', 'status', 'created',
+                    'expires_at',)
+    list_display_links = ('id', 'email',)
+    list_filter = ('status', 'created',)
+    readonly_fields = ('event', 'email', 'status', 'created', 'expires_at',)
+    search_fields = ('email',)
+    actions = ('release',)
+
+    class Meta:
+        model = SeatHold
+
+    def has_add_permission(self, request):
+        return False
+
+    def release(self, request, queryset):
+        """Gives the seats of the selected holds back to their events."""
+        for hold in queryset.filter(status=SeatHold.HELD):
+            hold.release()
+        messages.add_message(
+            request, messages.SUCCESS, _('Seats have been released.'))
+    release.short_description = _("Release seats")
+
+
+class EmailBatchInline(admin.TabularInline):
+    model = EmailBatch
+    extra = 0
+    can_delete = False
+    fields = ('first_recipient_pk', 'last_recipient_pk', 'recipient_count',
+              'status', 'attempts', 'error', 'modified',)
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(EmailCampaign)
+class EmailCampaignAdmin(admin.ModelAdmin):
+    list_display = ('id', 'event', 'status', 'sent_count', 'failed_count',
+                    'created', 'finished_at',)
+    list_display_links = ('id', 'event',)
+    list_filter = ('status', 'created',)
+    fields = ('event', 'status', 'protocol', 'domain', 'chunk_size',
+              'last_recipient_pk', 'sent_count', 'failed_count', 'created',
+              'modified', 'finished_at',)
+    readonly_fields = fields
+    inlines = [EmailBatchInline]
+    actions = ('resume', 'retry_failed',)
+
+    class Meta:
+        model = EmailCampaign
+
+    def has_add_permission(self, request):
+        return False
+
+    def resume(self, request, queryset):
+        """Continues unfinished campaigns from their last sent batch."""
+        for campaign in queryset.exclude(status__in=[EmailCampaign.SENT,
+                                                     EmailCampaign.FAILED]):
+            resume_campaign(campaign)
+        messages.add_message(
+            request, messages.SUCCESS, _('Campaigns have been resumed.'))
+    resume.short_description = _("Resume sending")
+
+    def retry_failed(self, request, queryset):
+        """Resends the failed batches of the selected campaigns."""
+        for campaign in queryset.filter(status=EmailCampaign.FAILED):
+            retry_campaign(campaign)
+        messages.add_message(
+            request, messages.SUCCESS, _('Failed batches are being retried.'))
+    retry_failed.short_description = _("Retry failed batches")
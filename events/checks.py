@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core import checks
+
+# Create your checks here.
+
+
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """The event listings are invalidated through a generation counter in
+    the default cache. A per-process cache leaves every other worker
+    serving stale listings until they expire. Run with
+    `manage.py check --deploy`."""
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PER_PROCESS_CACHES:
+        return []
+    return [checks.Error(
+        'The default cache ({0}) is not shared between processes, so '
+        'event listings would be served stale.'.format(backend),
+        hint='Configure a shared CACHES backend such as the database, '
+             'memcached or redis cache.',
+        id='events.E001',
+    )]
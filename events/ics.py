@@ -0,0 +1,103 @@
+"""
+iCalendar (RFC 5545) output for events.
+
+Calendars are written line by line by `iter_calendar`, so a view can
+stream them without building the whole document or touching a template.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.encoding import force_text
+from django.utils.html import strip_tags
+
+# Create your calendar here.
+
+
+PRODID = '-//TRIP//Events//EN'
+CALENDAR_CACHE_KEY = 'events:ics:{0}:{1}'
+
+
+def escape_text(value):
+    """Escapes a TEXT property value."""
+    return force_text(value) \
+        .replace('\\', '\\\\') \
+        .replace(';', '\\;') \
+        .replace(',', '\\,') \
+        .replace('\r\n', '\\n') \
+        .replace('\n', '\\n') \
+        .replace('\r', '\\n')
+
+
+def fold_line(line):
+    """Returns the content line as CRLF terminated bytes, folded so that
+    no physical line is longer than 75 octets."""
+    encoded = line.encode('utf-8')
+    chunks = []
+    limit = 75
+    while len(encoded) > limit:
+        cut = limit
+        # Never split a multi-byte character.
+        while cut and (ord(encoded[cut:cut + 1]) & 0xC0) == 0x80:
+            cut -= 1
+        chunks.append(encoded[:cut])
+        encoded = encoded[cut:]
+        limit = 74  # continuation lines start with a space
+    chunks.append(encoded)
+    return b'\r\n '.join(chunks) + b'\r\n'
+
+
+def format_datetime(value):
+    """Returns the datetime as a UTC DATE-TIME value."""
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.get_default_timezone(),
+                                    is_dst=False)
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def event_lines(event, protocol, domain):
+    """Yields the content lines of the VEVENT for the event."""
+    yield 'BEGIN:VEVENT'
+    yield 'UID:event-{0}@{1}'.format(event.pk, domain)
+    yield 'DTSTAMP:{0}'.format(format_datetime(event.modified))
+    yield 'DTSTART:{0}'.format(format_datetime(event.start_date))
+    yield 'DTEND:{0}'.format(format_datetime(event.end_date))
+    yield u'SUMMARY:{0}'.format(escape_text(event.name))
+    if event.description:
+        yield u'DESCRIPTION:{0}'.format(
+            escape_text(strip_tags(event.description)))
+    yield 'URL:{0}://{1}{2}'.format(protocol, domain,
+                                    event.get_absolute_url())
+    yield 'END:VEVENT'
+
+
+def iter_calendar(events, protocol, domain, name=None):
+    """Yields the calendar for the events as folded, encoded lines."""
+    yield fold_line('BEGIN:VCALENDAR')
+    yield fold_line('VERSION:2.0')
+    yield fold_line('PRODID:{0}'.format(PRODID))
+    yield fold_line('CALSCALE:GREGORIAN')
+    if name:
+        yield fold_line(u'X-WR-CALNAME:{0}'.format(escape_text(name)))
+    for event in events:
+        for line in event_lines(event, protocol, domain):
+            yield fold_line(line)
+    yield fold_line('END:VCALENDAR')
+
+
+def cached_calendar(key, chunks):
+    """Returns the cached calendar for the key, or an iterator over the
+    chunks that stores the calendar once it has been fully consumed."""
+    content = cache.get(key)
+    if content is not None:
+        return [content]
+    return _caching_iterator(key, chunks)
+
+
+def _caching_iterator(key, chunks):
+    written = []
+    for chunk in chunks:
+        written.append(chunk)
+        yield chunk
+    cache.set(key, b''.join(written),
+              getattr(settings, 'EVENTS_CALENDAR_CACHE_SECONDS', 60 * 60))
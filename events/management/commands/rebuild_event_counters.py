@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from events.models import Event
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the attendee and sponsor counters for every event.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of events updated per query.')
+
+    def handle(self, *args, **options):
+        Event.objects.refresh_counts(chunk_size=options['chunk_size'])
+        self.stdout.write(
+            self.style.SUCCESS('Successfully rebuilt event counters.'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from events.models import Event
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = """Re-renders the stored display fields (dates, excerpt and
+    description HTML) of every event. Run after changing events.rendering."""
+
+    def handle(self, *args, **options):
+        updated = 0
+        for event in Event.objects.order_by('pk').iterator():
+            changed = event.render_fields()
+            if changed:
+                # Only the rendered columns are written; skips signals.
+                Event.objects.filter(pk=event.pk).update(
+                    **{field: getattr(event, field) for field in changed})
+                updated += 1
+
+        if updated:
+            Event.objects.invalidate_cache()
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully re-rendered {} events.'.format(updated)))
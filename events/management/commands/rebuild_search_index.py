@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from events.models import Event
+from events.search import index_events
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the search entry of every event.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Number of events indexed at a time.')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        event_pks = list(Event.objects.order_by('pk')
+                                      .values_list('pk', flat=True))
+        indexed = 0
+        for i in range(0, len(event_pks), chunk_size):
+            indexed += index_events(event_pks[i:i + chunk_size])
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully indexed {} events.'.format(indexed)))
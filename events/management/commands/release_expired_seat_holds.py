@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from events.models import SeatHold
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = 'Gives back the seats of checkouts that never finished.'
+
+    def handle(self, *args, **options):
+        released = SeatHold.objects.release_expired()
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully released {} seat holds.'.format(released)))
@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from events.models import EmailCampaign
+from events.utils import claim_campaign, retry_failed_batches, send_campaign
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = """Sends pending event announcement emails, resuming any campaign
+    whose worker stopped before it finished."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-after', type=int, default=10,
+                            help='Minutes without progress before a '
+                                 'sending campaign is resumed.')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Also resend the failed batches of '
+                                 'finished campaigns.')
+
+    def handle(self, *args, **options):
+        stale = timezone.now() - timedelta(minutes=options['stale_after'])
+        campaigns = EmailCampaign.objects.filter(
+            status__in=[EmailCampaign.PENDING, EmailCampaign.SENDING],
+            modified__lt=stale).order_by('pk')
+
+        for campaign in campaigns:
+            # Claim the campaign so that two workers never resume it twice.
+            if not claim_campaign(campaign.pk, stale=stale):
+                continue
+            campaign = send_campaign(campaign.pk, claimed=True)
+            self.stdout.write(self.style.WARNING(
+                'Sent {0} ({1} sent, {2} failed).'.format(
+                    campaign.event, campaign.sent_count,
+                    campaign.failed_count)))
+
+        if options['retry_failed']:
+            failed = EmailCampaign.objects.filter(status=EmailCampaign.FAILED)
+            for campaign in failed.order_by('pk'):
+                campaign = retry_failed_batches(campaign.pk)
+                self.stdout.write(self.style.WARNING(
+                    'Retried {0} ({1} still failing).'.format(
+                        campaign.event, campaign.failed_count)))
+
+        self.stdout.write(
+            self.style.SUCCESS('Successfully sent event emails.'))
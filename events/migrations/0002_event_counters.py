@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_counters(apps, schema_editor):
+    Event = apps.get_model('events', 'Event')
+
+    for field, through in (('attendee_count', Event.attendees.through),
+                           ('sponsor_count', Event.sponsors.through)):
+        counts = through.objects.values_list('event_id') \
+                                .annotate(total=Count('pk'))
+        for event_id, total in counts:
+            Event.objects.filter(pk=event_id).update(**{field: total})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='attendee_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='sponsor_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 10:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0002_event_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailCampaign',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('protocol', models.CharField(default='https', max_length=5)),
+                ('domain', models.CharField(max_length=255)),
+                ('chunk_size', models.PositiveIntegerField(default=1000)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Sent with failures')], db_index=True, default='pending', max_length=10)),
+                ('last_recipient_pk', models.PositiveIntegerField(default=0)),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='email_campaigns', to='events.Event')),
+            ],
+            options={
+                'verbose_name': 'email campaign',
+                'verbose_name_plural': 'email campaigns',
+            },
+        ),
+        migrations.CreateModel(
+            name='EmailBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('first_recipient_pk', models.PositiveIntegerField()),
+                ('last_recipient_pk', models.PositiveIntegerField()),
+                ('recipient_count', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('sent', 'Sent'), ('failed', 'Failed')], db_index=True, max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=1)),
+                ('error', models.TextField(blank=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='events.EmailCampaign')),
+            ],
+            options={
+                'ordering': ('first_recipient_pk',),
+                'verbose_name': 'email batch',
+                'verbose_name_plural': 'email batches',
+            },
+        ),
+    ]
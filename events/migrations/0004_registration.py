@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 11:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    """Promotes the auto-created Event.attendees table to the Registration
+    model. The table, its columns and its unique constraint already exist,
+    so only the state changes; the new columns and indexes are added
+    afterwards."""
+
+    dependencies = [
+        ('billing', '0001_initial'),
+        ('events', '0003_email_campaigns'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Registration',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('attendee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='registrations', to='events.Attendee')),
+                        ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='registrations', to='events.Event')),
+                    ],
+                    options={
+                        'db_table': 'events_event_attendees',
+                        'verbose_name': 'registration',
+                        'verbose_name_plural': 'registrations',
+                    },
+                ),
+                migrations.AlterUniqueTogether(
+                    name='registration',
+                    unique_together=set([('event', 'attendee')]),
+                ),
+                migrations.AlterField(
+                    model_name='event',
+                    name='attendees',
+                    field=models.ManyToManyField(blank=True, related_name='event_attendees', through='events.Registration', to='events.Attendee'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='registration',
+            name='registered_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='registration',
+            name='charge',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='registrations', to='billing.Charge'),
+        ),
+        migrations.AddIndex(
+            model_name='registration',
+            index=models.Index(fields=['event', 'registered_at'], name='events_reg_event_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registration',
+            index=models.Index(fields=['attendee', 'event'], name='events_reg_attendee_idx'),
+        ),
+    ]
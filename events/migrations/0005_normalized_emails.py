@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 12:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Func, OuterRef, Subquery
+from django.db.models.functions import Lower
+
+
+class Trim(Func):
+    # django.db.models.functions only gains Trim in Django 2.1.
+    function = 'TRIM'
+
+
+def backfill_emails(apps, schema_editor):
+    """Fills the normalized email columns, the same way
+    events.models.normalize_email does. Stops if an email is registered
+    for the same event more than once, since those registrations may
+    carry charges and must be merged by hand before the unique (event,
+    email) constraint can be added."""
+    Attendee = apps.get_model('events', 'Attendee')
+    Registration = apps.get_model('events', 'Registration')
+
+    Attendee.objects.update(normalized_email=Lower(Trim('email')))
+    Registration.objects.update(email=Subquery(
+        Attendee.objects.filter(pk=OuterRef('attendee_id'))
+                        .values('normalized_email')[:1]))
+
+    conflicts = Registration.objects.order_by() \
+        .values('event_id', 'email') \
+        .annotate(count=Count('pk')) \
+        .filter(count__gt=1)
+    if not conflicts:
+        return
+
+    lines = []
+    for conflict in conflicts:
+        registrations = Registration.objects \
+            .filter(event_id=conflict['event_id'], email=conflict['email']) \
+            .order_by('registered_at', 'pk') \
+            .values_list('pk', 'charge_id')
+        lines.append('  event {0}, {1}: registrations {2}'.format(
+            conflict['event_id'], conflict['email'], ', '.join(
+                '{0} (charge {1})'.format(pk, charge_pk or '-')
+                for pk, charge_pk in registrations)))
+    raise RuntimeError(
+        'Some emails are registered more than once for the same event. '
+        'Merge or delete the duplicate registrations, keeping the one '
+        'with the charge, then migrate again:\n' + '\n'.join(lines))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0004_registration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendee',
+            name='normalized_email',
+            field=models.EmailField(db_index=True, default='', editable=False, max_length=120),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='registration',
+            name='email',
+            field=models.EmailField(default='', editable=False, max_length=120),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_emails, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='registration',
+            unique_together=set([('event', 'attendee'), ('event', 'email')]),
+        ),
+    ]
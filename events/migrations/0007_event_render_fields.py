@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 15:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.template.defaultfilters import linebreaksbr, truncatewords_html
+from django.utils.safestring import mark_safe
+
+
+# Frozen copy of events.rendering as of this migration, so later changes
+# to that module cannot change what this migration does.
+EXCERPT_WORDS = 75
+
+
+def format_date_range(start, end):
+    if start.date() == end.date():
+        return "{0} | {1}-{2}".format(
+            start.strftime("%B %d, %Y"),
+            start.strftime("%I:%M %p").lstrip('0'),
+            end.strftime("%I:%M %p").lstrip('0'))
+    return "{0} - {1}".format(
+        start.strftime("%B %d, %Y"), end.strftime("%B %d, %Y"))
+
+
+def format_datetime(d):
+    return d.strftime("%B %d, %Y | ") + d.strftime("%I:%M %p").lstrip('0')
+
+
+def render_fields(start, end, description):
+    return {
+        'date_display': format_date_range(start, end),
+        'start_date_display': format_datetime(start),
+        'end_date_display': format_datetime(end),
+        'excerpt_html': truncatewords_html(mark_safe(description),
+                                           EXCERPT_WORDS),
+        'description_html': linebreaksbr(mark_safe(description)),
+    }
+
+
+def populate_render_fields(apps, schema_editor):
+    Event = apps.get_model('events', 'Event')
+    events = Event.objects.values_list('pk', 'start_date', 'end_date',
+                                       'description')
+    for pk, start_date, end_date, description in events.iterator():
+        Event.objects.filter(pk=pk).update(
+            **render_fields(start_date, end_date, description))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0006_event_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='date_display',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='start_date_display',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='end_date_display',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='excerpt_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='description_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(populate_render_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 17:05
+from __future__ import unicode_literals
+
+import re
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.utils.html import strip_tags
+import django.db.models.deletion
+
+
+# Frozen copies of events.search as of this migration, so later changes
+# to that module cannot change what this migration does.
+SEARCH_INDEXES = (
+    ('events_search_public_idx', "to_tsvector('english', {document})"),
+    ('events_search_admin_idx',
+     "to_tsvector('simple', {document} || ' ' || {attendee_document})"),
+)
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def build_documents(name, description, sponsor_names, attendees):
+    document = u' '.join(
+        [name or '', strip_tags(description or '')] + list(sponsor_names))
+
+    attendee_words = []
+    for first_name, last_name, email in attendees:
+        attendee_words.extend([first_name or '', last_name or '',
+                               email or ''])
+        attendee_words.extend(TERM_RE.findall((email or '').lower()))
+    return document, u' '.join(attendee_words)
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, vector in SEARCH_INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX {0} ON events_eventsearchentry USING GIN ({1})'
+            .format(name, vector.format(document='document',
+                                     attendee_document='attendee_document')))
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in SEARCH_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {0}'.format(name))
+
+
+def populate_search_entries(apps, schema_editor):
+    Event = apps.get_model('events', 'Event')
+    EventSearchEntry = apps.get_model('events', 'EventSearchEntry')
+    Registration = apps.get_model('events', 'Registration')
+
+    attendees = defaultdict(list)
+    registrations = Registration.objects.order_by('pk').values_list(
+        'event_id', 'attendee__first_name', 'attendee__last_name',
+        'attendee__email')
+    for event_pk, first_name, last_name, email in registrations.iterator():
+        attendees[event_pk].append((first_name, last_name, email))
+
+    entries = []
+    for event in Event.objects.prefetch_related('sponsors'):
+        document, attendee_document = build_documents(
+            event.name, event.description,
+            [sponsor.name for sponsor in event.sponsors.all()],
+            attendees[event.pk])
+        entries.append(EventSearchEntry(
+            event_id=event.pk, document=document,
+            attendee_document=attendee_document))
+    EventSearchEntry.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('events', '0008_event_capacity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventSearchEntry',
+            fields=[
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_entry', serialize=False, to='events.Event')),
+                ('document', models.TextField(blank=True)),
+                ('attendee_document', models.TextField(blank=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'event search entry',
+                'verbose_name_plural': 'event search entries',
+            },
+        ),
+        migrations.RunPython(populate_search_entries,
+                             migrations.RunPython.noop),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
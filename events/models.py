@@ -1,9 +1,15 @@
 from __future__ import unicode_literals
 
-from datetime import datetime
+import time
 
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
 from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.functional import cached_property
@@ -11,15 +17,40 @@ from django.utils.translation import ugettext_lazy as _
 
 from accounts.models import Sponsor
 from core.models import TimeStampedModel
+from .pagination import paginate_events
+from .rendering import format_date_range, format_datetime, render_fields
 
 # Create your models here.
 
 
+EVENTS_GENERATION_KEY = 'events:generation'
+
+
+def normalize_email(email):
+    """Returns the form of an email used for case-insensitive lookups."""
+    return (email or '').strip().lower()
+
+
+class AttendeeManager(models.Manager):
+    def with_events(self):
+        """Returns attendees with their registrations and events loaded up
+        front, so resolving each attendee's event costs no query."""
+        registrations = Registration.objects.select_related('event') \
+            .order_by('registered_at')
+        return super(AttendeeManager, self).get_queryset() \
+            .prefetch_related(models.Prefetch('registrations',
+                                              queryset=registrations))
+
+
 class Attendee(TimeStampedModel):
     email = models.EmailField(max_length=120)
+    normalized_email = models.EmailField(max_length=120, db_index=True,
+                                         editable=False)
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
 
+    objects = AttendeeManager()
+
     class Meta:
         app_label = 'events'
         verbose_name = _('attendee')
@@ -28,6 +59,17 @@ class Attendee(TimeStampedModel):
     def __str__(self):
         return str(self.email)
 
+    def save(self, *args, **kwargs):
+        normalized_email = normalize_email(self.email)
+        changed = self.pk and normalized_email != self.normalized_email
+        self.normalized_email = normalized_email
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'email' in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['normalized_email']
+        super(Attendee, self).save(*args, **kwargs)
+        if changed:
+            self.registrations.update(email=normalized_email)
+
     @cached_property
     def full_name(self):
         """Returns the first_name plus the last_name, with a space in
@@ -36,8 +78,13 @@ class Attendee(TimeStampedModel):
 
     @cached_property
     def event_name(self):
-        event = Event.objects.get(attendees__pk=self.pk)
-        return str(event.name)
+        """Returns the name of the event(s) the attendee registered for."""
+        if 'registrations' in getattr(self, '_prefetched_objects_cache', {}):
+            registrations = self.registrations.all()
+        else:
+            registrations = self.registrations.select_related('event') \
+                .order_by('registered_at')
+        return ', '.join(str(r.event.name) for r in registrations)
 
 
 class EventManager(models.Manager):
@@ -79,6 +126,116 @@ class EventManager(models.Manager):
             .prefetch_related('sponsors') \
             .order_by('start_date', 'end_date')[:num_returned]
 
+    def generation(self):
+        """Returns the current generation of the event cache. Every cached
+        result is keyed on it, so bumping it invalidates them all at once.
+        This only holds if every process shares the cache, which
+        `manage.py check --deploy` verifies (events.checks).
+        A missing counter restarts from the clock, never from a number an
+        older, stale generation may have used."""
+        generation = cache.get(EVENTS_GENERATION_KEY)
+        if generation is None:
+            cache.add(EVENTS_GENERATION_KEY, int(time.time() * 1000), None)
+            generation = cache.get(EVENTS_GENERATION_KEY)
+        return generation
+
+    def invalidate_cache(self):
+        """Starts a new cache generation. Called whenever an event, its
+        sponsors or its registrations change."""
+        try:
+            cache.incr(EVENTS_GENERATION_KEY)
+        except ValueError:
+            cache.set(EVENTS_GENERATION_KEY, int(time.time() * 1000), None)
+
+    def _cached(self, name, query, timeout=None):
+        key = 'events:{0}:{1}'.format(self.generation(), name)
+        results = cache.get(key)
+        if results is None:
+            results = query()
+            if timeout is None:
+                timeout = getattr(settings, 'EVENTS_CACHE_TIMEOUT', 60 * 60)
+            cache.set(key, results, timeout)
+        return results
+
+    def cached_featured(self, num_returned=None):
+        """Returns featured() as a list, with sponsors prefetched, from the
+        cache when possible."""
+        def query():
+            return list(self.featured(num_returned=num_returned))
+        name = 'featured:{0}'.format(num_returned)
+        results = self._cached(name, query)
+
+        # The list also changes, without any save, when one of its events
+        # ends. Refetch instead of serving it past that moment.
+        now = timezone.now()
+        if any(event.end_date < now for event in results):
+            results = query()
+            cache.set('events:{0}:{1}'.format(self.generation(), name),
+                      results,
+                      getattr(settings, 'EVENTS_CACHE_TIMEOUT', 60 * 60))
+        return results
+
+    def cached_active_page(self, cursor=None, per_page=10):
+        """Returns a keyset page of active(). Only the first page is
+        cached: cursors come from the query string, and a later page costs
+        no more than the first one anyway."""
+        if cursor:
+            return paginate_events(self.active(), cursor=cursor,
+                                   per_page=per_page)
+        return self._cached(
+            'active:{0}'.format(int(per_page)),
+            lambda: paginate_events(self.active(), per_page=per_page))
+
+    def adjust_counts(self, field, event_pks, sign=1):
+        """Adds `sign` to the counter `field` of every event in
+        `event_pks`, once per occurrence. The UPDATE uses F(), so
+        concurrent registrations add up instead of overwriting each
+        other."""
+        by_delta = defaultdict(list)
+        for pk, count in Counter(event_pks).items():
+            by_delta[sign * count].append(pk)
+        for delta, pks in by_delta.items():
+            super(EventManager, self).get_queryset() \
+                .filter(pk__in=pks) \
+                .update(**{field: F(field) + delta})
+
+    def refresh_counts(self, event_pks=None, chunk_size=500):
+        """Recomputes the denormalized attendee and sponsor counters, to
+        repair drift (`manage.py rebuild_event_counters`). The signals keep
+        them current with adjust_counts; a recount overwrites concurrent
+        changes, so it is not used for that.
+
+        Counts are aggregated per chunk of events and written back with a
+        single UPDATE per chunk, so rebuilding every event stays cheap."""
+        if event_pks is None:
+            event_pks = super(EventManager, self).get_queryset() \
+                .order_by('pk').values_list('pk', flat=True)
+        event_pks = list(event_pks)
+
+        for i in range(0, len(event_pks), chunk_size):
+            chunk = event_pks[i:i + chunk_size]
+            attendees = self._counts_for(self.model.attendees.through, chunk)
+            sponsors = self._counts_for(self.model.sponsors.through, chunk)
+            super(EventManager, self).get_queryset() \
+                .filter(pk__in=chunk) \
+                .update(attendee_count=self._case_for(attendees),
+                        sponsor_count=self._case_for(sponsors))
+
+    def _counts_for(self, through, event_pks):
+        """Returns a dict of event pk to number of rows in `through`."""
+        return dict(
+            through.objects.filter(event_id__in=event_pks)
+                           .values_list('event_id')
+                           .annotate(total=Count('pk'))
+        )
+
+    def _case_for(self, counts):
+        if not counts:
+            return Value(0)
+        return Case(*[When(pk=pk, then=Value(total))
+                      for pk, total in counts.items()],
+                    default=Value(0), output_field=IntegerField())
+
     def own(self, user):
         """Returns all events the user is sponsoring."""
         return super(EventManager, self).get_queryset() \
@@ -99,24 +256,71 @@ class Event(TimeStampedModel):
                                                  help_text='Enter amount in cents.')
     sponsors = models.ManyToManyField(Sponsor, related_name='event_sponsors',
                                       blank=True)
-    attendees = models.ManyToManyField(Attendee, related_name='event_attendees',
+    attendees = models.ManyToManyField(Attendee, through='Registration',
+                                       related_name='event_attendees',
                                        blank=True)
 
     start_date = models.DateTimeField(_('start date of event'))
     end_date = models.DateTimeField(_('end date of event'))
 
+    # Display values rendered on save by events.rendering.
+    date_display = models.CharField(max_length=100, blank=True,
+                                    editable=False)
+    start_date_display = models.CharField(max_length=50, blank=True,
+                                          editable=False)
+    end_date_display = models.CharField(max_length=50, blank=True,
+                                        editable=False)
+    excerpt_html = models.TextField(blank=True, editable=False)
+    description_html = models.TextField(blank=True, editable=False)
+
+    # Denormalized counters, kept in sync by events.signals.
+    attendee_count = models.PositiveIntegerField(default=0, editable=False)
+    sponsor_count = models.PositiveIntegerField(default=0, editable=False)
+
+    capacity = models.PositiveIntegerField(
+        null=True, blank=True, help_text='Leave blank for no limit.')
+    # Seats reserved by checkouts that have not finished yet, see SeatHold.
+    seats_held = models.PositiveIntegerField(default=0, editable=False)
+
     is_active = models.BooleanField(default=True)
 
+    # Only ever changed with F() updates, never written back by save().
+    COUNTER_FIELDS = ('attendee_count', 'sponsor_count', 'seats_held')
+
     objects = EventManager()
 
     class Meta:
         app_label = 'events'
+        indexes = [
+            # EventManager.active(), paged by (start_date, id).
+            models.Index(fields=['is_active', 'start_date', 'id'],
+                         name='events_active_start_idx'),
+            # EventManager.featured().
+            models.Index(fields=['is_active', 'end_date', 'start_date'],
+                         name='events_active_end_idx'),
+        ]
         verbose_name = _('event')
         verbose_name_plural = _('events')
 
     def __str__(self):
         return u'{0}'.format(self.name)
 
+    def save(self, *args, **kwargs):
+        changed = self.render_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding \
+                and not kwargs.get('force_insert'):
+            # The in-memory counters may be stale by now, and writing them
+            # back would undo concurrent registrations and seat holds.
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                f.attname for f in self._meta.concrete_fields
+                if not f.primary_key and f.attname not in deferred and
+                f.attname not in self.COUNTER_FIELDS]
+        elif update_fields is not None and changed:
+            kwargs['update_fields'] = set(update_fields) | set(changed)
+        super(Event, self).save(*args, **kwargs)
+
     def get_absolute_url(self):
         """Returns the url for the event."""
         return reverse('events:detail', kwargs={'event_pk': self.pk})
@@ -139,29 +343,41 @@ class Event(TimeStampedModel):
             return _("Upcoming")
         return _("Completed")
 
-    @cached_property
+    @property
     def event_date(self):
-        start = self.start_date
-        end = self.end_date
-        if start.date() == end.date():
-            return "{0} | {1}-{2}".format(
-                start.strftime("%B %d, %Y"),
-                start.strftime("%I:%M %p").lstrip('0'),
-                end.strftime("%I:%M %p").lstrip('0'))
-        return "{0} - {1}".format(
-            start.strftime("%B %d, %Y"), end.strftime("%B %d, %Y"))
+        return self.date_display or format_date_range(self.start_date,
+                                                      self.end_date)
 
-    @cached_property
+    @property
     def event_start_date(self):
-        d = self.start_date
-        # d.strftime("%A | %B %d, %Y | ") + d.strftime("%I:%M %p").lstrip('0')
-        return d.strftime("%B %d, %Y | ") + d.strftime("%I:%M %p").lstrip('0')
+        return self.start_date_display or format_datetime(self.start_date)
 
-    @cached_property
+    @property
     def event_end_date(self):
-        d = self.end_date
-        # d.strftime("%A | %B %d, %Y | ") + d.strftime("%I:%M %p").lstrip('0')
-        return d.strftime("%B %d, %Y | ") + d.strftime("%I:%M %p").lstrip('0')
+        return self.end_date_display or format_datetime(self.end_date)
+
+    @property
+    def seats_available(self):
+        """Returns the number of seats left, or None if there is no limit."""
+        if self.capacity is None:
+            return None
+        return max(self.capacity - self.attendee_count - self.seats_held, 0)
+
+    @property
+    def is_sold_out(self):
+        return self.seats_available == 0
+
+    def render_fields(self):
+        """Recomputes the stored display fields. Returns the names of the
+        fields that changed."""
+        changed = []
+        rendered = render_fields(self.start_date, self.end_date,
+                                 self.description)
+        for field, value in rendered.items():
+            if getattr(self, field) != value:
+                setattr(self, field, value)
+                changed.append(field)
+        return changed
 
     @cached_property
     def get_sponsors_info(self):
@@ -173,12 +389,247 @@ class Event(TimeStampedModel):
         """Returns the information for each user registered for the event."""
         return self.attendees.values('id', 'first_name', 'last_name')
 
-    @property
-    def sponsor_count(self):
-        """Returns the number of sponsors for the event.."""
-        return self.get_sponsors_info.count()
 
-    @property
-    def attendee_count(self):
-        """Returns the number of attendees of the event."""
-        return self.get_attendees_info.count()
+class RegistrationManager(models.Manager):
+    def is_registered(self, event, email):
+        """Returns True if the email is registered for the event. This is a
+        single probe of the unique (event, email) index."""
+        if not email:
+            return False
+        return super(RegistrationManager, self).get_queryset() \
+            .filter(event=event, email=normalize_email(email)) \
+            .exists()
+
+
+@python_2_unicode_compatible
+class Registration(models.Model):
+    """An attendee's registration for an event, and the charge that paid
+    for it. Stored in the table of the former auto-created M2M."""
+    event = models.ForeignKey(Event, on_delete=models.CASCADE,
+                              related_name='registrations')
+    attendee = models.ForeignKey(Attendee, on_delete=models.CASCADE,
+                                 related_name='registrations')
+    # Copy of Attendee.normalized_email, backing the (event, email) index.
+    email = models.EmailField(max_length=120, editable=False)
+    registered_at = models.DateTimeField(default=timezone.now)
+    charge = models.ForeignKey('billing.Charge', on_delete=models.SET_NULL,
+                               related_name='registrations', null=True,
+                               blank=True)
+
+    objects = RegistrationManager()
+
+    class Meta:
+        app_label = 'events'
+        db_table = 'events_event_attendees'
+        unique_together = (('event', 'attendee'), ('event', 'email'),)
+        indexes = [
+            models.Index(fields=['event', 'registered_at'],
+                         name='events_reg_event_time_idx'),
+            models.Index(fields=['attendee', 'event'],
+                         name='events_reg_attendee_idx'),
+        ]
+        verbose_name = _('registration')
+        verbose_name_plural = _('registrations')
+
+    def __str__(self):
+        return u'{0} @ {1}'.format(self.email, self.event_id)
+
+    def save(self, *args, **kwargs):
+        self.email = self.attendee.normalized_email
+        super(Registration, self).save(*args, **kwargs)
+
+
+class SeatHoldManager(models.Manager):
+    def reserve(self, event, email, ttl=None):
+        """Holds a seat at the event for the email while its checkout runs.
+        Returns the SeatHold, or None if the event is sold out.
+
+        The seat is taken with a single conditional UPDATE of the event
+        row, so concurrent checkouts only ever wait on that row for the
+        length of one statement."""
+        if ttl is None:
+            ttl = getattr(settings, 'SEAT_HOLD_SECONDS', 10 * 60)
+
+        taken = self._take_seat(event)
+        if not taken and self.release_expired(event=event):
+            taken = self._take_seat(event)
+        if not taken:
+            return None
+
+        try:
+            return self.create(
+                event=event, email=normalize_email(email),
+                expires_at=timezone.now() + timedelta(seconds=ttl))
+        except Exception:
+            Event.objects.filter(pk=event.pk) \
+                .update(seats_held=F('seats_held') - 1)
+            raise
+
+    def _take_seat(self, event):
+        # attendee_count and seats_held only change through F() updates
+        # (see Event.COUNTER_FIELDS), so the guard and the increment see
+        # the same committed row and concurrent checkouts cannot oversell.
+        return Event.objects \
+            .filter(pk=event.pk) \
+            .filter(Q(capacity__isnull=True) |
+                    Q(capacity__gt=F('attendee_count') + F('seats_held'))) \
+            .update(seats_held=F('seats_held') + 1)
+
+    def release_expired(self, event=None):
+        """Releases every hold whose checkout never finished. Returns the
+        number of seats freed."""
+        holds = super(SeatHoldManager, self).get_queryset().filter(
+            status=SeatHold.HELD, expires_at__lt=timezone.now())
+        if event is not None:
+            holds = holds.filter(event=event)
+        return sum(1 for hold in holds if hold.release())
+
+
+@python_2_unicode_compatible
+class SeatHold(models.Model):
+    """A seat reserved for a checkout in progress. It is committed once
+    the attendee is registered, or released if the checkout fails or
+    expires."""
+    HELD = 'held'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+    STATUS_CHOICES = (
+        (HELD, _('Held')),
+        (COMMITTED, _('Committed')),
+        (RELEASED, _('Released')),
+    )
+
+    event = models.ForeignKey(Event, on_delete=models.CASCADE,
+                              related_name='seat_holds')
+    email = models.EmailField(max_length=120)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=HELD)
+    created = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    objects = SeatHoldManager()
+
+    class Meta:
+        app_label = 'events'
+        indexes = [
+            models.Index(fields=['status', 'expires_at'],
+                         name='events_hold_expiry_idx'),
+        ]
+        verbose_name = _('seat hold')
+        verbose_name_plural = _('seat holds')
+
+    def __str__(self):
+        return u'{0} @ {1}'.format(self.email, self.event_id)
+
+    def commit(self):
+        """Turns the hold into a registered seat. Call after the
+        Registration has been created."""
+        return self._finish(SeatHold.COMMITTED)
+
+    def release(self):
+        """Gives the seat back."""
+        return self._finish(SeatHold.RELEASED)
+
+    def _finish(self, status):
+        # Only the first of commit/release/expiry moves the counter.
+        with transaction.atomic():
+            finished = SeatHold.objects \
+                .filter(pk=self.pk, status=SeatHold.HELD) \
+                .update(status=status)
+            if finished:
+                Event.objects.filter(pk=self.event_id) \
+                    .update(seats_held=F('seats_held') - 1)
+        if finished:
+            self.status = status
+        return bool(finished)
+
+
+@python_2_unicode_compatible
+class EmailCampaign(TimeStampedModel):
+    """An announcement email for an event, fanned out to the newsletter in
+    fixed-size batches. `last_recipient_pk` is the resume cursor."""
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('Pending')),
+        (SENDING, _('Sending')),
+        (SENT, _('Sent')),
+        (FAILED, _('Sent with failures')),
+    )
+
+    event = models.ForeignKey(Event, on_delete=models.CASCADE,
+                              related_name='email_campaigns')
+    protocol = models.CharField(max_length=5, default='https')
+    domain = models.CharField(max_length=255)
+    chunk_size = models.PositiveIntegerField(default=1000)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING, db_index=True)
+    last_recipient_pk = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'events'
+        verbose_name = _('email campaign')
+        verbose_name_plural = _('email campaigns')
+
+    def __str__(self):
+        return u'{0} ({1})'.format(self.event, self.get_status_display())
+
+
+@python_2_unicode_compatible
+class EmailBatch(TimeStampedModel):
+    """One ESP send covering the subscribers with pks in
+    [first_recipient_pk, last_recipient_pk]."""
+    SENT = EmailCampaign.SENT
+    FAILED = EmailCampaign.FAILED
+    STATUS_CHOICES = (
+        (SENT, _('Sent')),
+        (FAILED, _('Failed')),
+    )
+
+    campaign = models.ForeignKey(EmailCampaign, on_delete=models.CASCADE,
+                                 related_name='batches')
+    first_recipient_pk = models.PositiveIntegerField()
+    last_recipient_pk = models.PositiveIntegerField()
+    recipient_count = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              db_index=True)
+    attempts = models.PositiveIntegerField(default=1)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        app_label = 'events'
+        ordering = ('first_recipient_pk',)
+        verbose_name = _('email batch')
+        verbose_name_plural = _('email batches')
+
+    def __str__(self):
+        return u'{0}-{1}'.format(self.first_recipient_pk,
+                                 self.last_recipient_pk)
+
+
+@python_2_unicode_compatible
+class EventSearchEntry(models.Model):
+    """Denormalized search text for an event, maintained by events.search.
+
+    The public document only holds what the event page already shows;
+    attendee names and emails are kept apart so only the admin matches
+    on them."""
+    event = models.OneToOneField(Event, on_delete=models.CASCADE,
+                                 primary_key=True,
+                                 related_name='search_entry')
+    document = models.TextField(blank=True)
+    attendee_document = models.TextField(blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = 'events'
+        verbose_name = _('event search entry')
+        verbose_name_plural = _('event search entries')
+
+    def __str__(self):
+        return u'{}'.format(self.event_id)
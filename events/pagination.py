@@ -0,0 +1,72 @@
+"""
+Keyset (seek) pagination for event listings.
+
+Pages are ordered by (start_date, id) and each page remembers the last row
+it returned. The next page is fetched with an index range scan that starts
+after that row, so page N costs the same as page 1.
+"""
+
+import base64
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_text
+
+# Create your paginators here.
+
+
+class KeysetPage(object):
+    def __init__(self, object_list, next_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def encode_cursor(event):
+    """Returns an opaque cursor pointing just after the event."""
+    value = '{0}|{1}'.format(event.start_date.isoformat(), event.pk)
+    return force_text(base64.urlsafe_b64encode(force_bytes(value)))
+
+
+def decode_cursor(cursor):
+    """Returns the (start_date, pk) pair encoded in the cursor, or None if
+    the cursor is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        value = force_text(base64.urlsafe_b64decode(force_bytes(cursor)))
+        start_date, pk = value.rsplit('|', 1)
+        start_date = parse_datetime(start_date)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        return None
+    if start_date is None:
+        return None
+    return start_date, pk
+
+
+def paginate_events(queryset, cursor=None, per_page=10):
+    """Returns the page of `queryset` that follows `cursor`."""
+    queryset = queryset.order_by('start_date', 'pk')
+    position = decode_cursor(cursor)
+
+    if position:
+        start_date, pk = position
+        # Equivalent to (start_date, id) > (%s, %s), written so that the
+        # leading start_date bound can drive the index scan.
+        queryset = queryset.filter(start_date__gte=start_date) \
+                           .filter(Q(start_date__gt=start_date) | Q(pk__gt=pk))
+
+    rows = list(queryset[:per_page + 1])
+    if len(rows) > per_page:
+        return KeysetPage(rows[:per_page], encode_cursor(rows[per_page - 1]))
+    return KeysetPage(rows)
@@ -0,0 +1,54 @@
+"""
+Formatting used to display events.
+
+Event.save() stores the output of these functions on the event, so pages
+never run them per request. After changing anything here, run the
+rebuild_event_render_fields management command.
+"""
+
+from django.template.defaultfilters import linebreaksbr, truncatewords_html
+from django.utils.safestring import mark_safe
+
+# Create your renderers here.
+
+
+EXCERPT_WORDS = 75
+
+
+def format_date_range(start, end):
+    """Returns e.g. 'May 13, 2017 | 9:00 AM-5:00 PM' for a one day event,
+    or 'May 13, 2017 - May 15, 2017' otherwise."""
+    if start.date() == end.date():
+        return "{0} | {1}-{2}".format(
+            start.strftime("%B %d, %Y"),
+            start.strftime("%I:%M %p").lstrip('0'),
+            end.strftime("%I:%M %p").lstrip('0'))
+    return "{0} - {1}".format(
+        start.strftime("%B %d, %Y"), end.strftime("%B %d, %Y"))
+
+
+def format_datetime(d):
+    """Returns e.g. 'May 13, 2017 | 9:00 AM'."""
+    # d.strftime("%A | %B %d, %Y | ") + d.strftime("%I:%M %p").lstrip('0')
+    return d.strftime("%B %d, %Y | ") + d.strftime("%I:%M %p").lstrip('0')
+
+
+def render_excerpt(description):
+    """Same output as {{ description|safe|truncatewords_html:75 }}."""
+    return truncatewords_html(mark_safe(description), EXCERPT_WORDS)
+
+
+def render_description(description):
+    """Same output as {{ description|safe|linebreaksbr }}."""
+    return linebreaksbr(mark_safe(description))
+
+
+def render_fields(start, end, description):
+    """Returns the stored display fields for an event."""
+    return {
+        'date_display': format_date_range(start, end),
+        'start_date_display': format_datetime(start),
+        'end_date_display': format_datetime(end),
+        'excerpt_html': render_excerpt(description),
+        'description_html': render_description(description),
+    }
@@ -0,0 +1,157 @@
+"""
+Full-text search over events.
+
+Each event has an EventSearchEntry holding the text it can be found by.
+On PostgreSQL the entries are matched with full-text search against the
+expression indexes created in migration 0009; on other databases (SQLite
+in development) every search term is matched with icontains instead.
+
+Entries are rebuilt by `index_events`, which the signals in
+events.signals queue through `index_events_later` whenever an event, its
+sponsors or its attendees change. Events queued while a rebuild is
+waiting to run are merged into it, so a burst of sign-ups rebuilds a
+large event's entry a few times rather than once per registration.
+"""
+
+import os
+import re
+import threading
+
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.html import strip_tags
+
+from core.tasks import enqueue
+from .models import Event, EventSearchEntry, Registration
+
+# Create your search here.
+
+
+# These must stay identical to the indexed expressions in migration 0009,
+# or PostgreSQL will not use the indexes.
+PUBLIC_VECTOR = "to_tsvector('english', {document})"
+ADMIN_VECTOR = "to_tsvector('simple', {document} || ' ' || {attendee_document})"
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+_pending = set()
+_pending_lock = threading.Lock()
+# The pid of the process with a rebuild queued; queued tasks do not
+# survive a fork.
+_scheduled_pid = None
+
+
+def search_terms(query):
+    """Splits a user supplied query into the words to search for."""
+    return TERM_RE.findall((query or '').lower())
+
+
+def build_documents(name, description, sponsor_names, attendees):
+    """Returns the (document, attendee_document) pair for an event.
+
+    `attendees` is an iterable of (first_name, last_name, email). Emails
+    are also written out word by word so a partial address matches."""
+    document = u' '.join(
+        [name or '', strip_tags(description or '')] + list(sponsor_names))
+
+    attendee_words = []
+    for first_name, last_name, email in attendees:
+        attendee_words.extend([first_name or '', last_name or '',
+                               email or ''])
+        attendee_words.extend(search_terms(email))
+    return document, u' '.join(attendee_words)
+
+
+def index_events(event_pks):
+    """Rebuilds the search entries of the given events."""
+    event_pks = set(event_pks)
+    events = Event.objects.filter(pk__in=event_pks) \
+        .only('pk', 'name', 'description') \
+        .prefetch_related('sponsors')
+
+    attendees = defaultdict(list)
+    registrations = Registration.objects \
+        .filter(event_id__in=event_pks) \
+        .order_by('pk') \
+        .values_list('event_id', 'attendee__first_name',
+                     'attendee__last_name', 'attendee__email')
+    for event_pk, first_name, last_name, email in registrations:
+        attendees[event_pk].append((first_name, last_name, email))
+
+    indexed = 0
+    for event in events:
+        document, attendee_document = build_documents(
+            event.name, event.description,
+            [sponsor.name for sponsor in event.sponsors.all()],
+            attendees[event.pk])
+        EventSearchEntry.objects.update_or_create(
+            event=event, defaults={'document': document,
+                                   'attendee_document': attendee_document})
+        indexed += 1
+    return indexed
+
+
+def index_events_later(event_pks):
+    """Queues the events to be reindexed once the current transaction
+    has committed."""
+    event_pks = set(event_pks)
+    if event_pks:
+        transaction.on_commit(lambda: _schedule(event_pks))
+
+
+def _schedule(event_pks):
+    global _scheduled_pid
+    with _pending_lock:
+        _pending.update(event_pks)
+        if _scheduled_pid == os.getpid():
+            # The queued rebuild will pick these up too.
+            return
+        _scheduled_pid = os.getpid()
+    enqueue(_index_pending)
+
+
+def _index_pending():
+    global _scheduled_pid
+    with _pending_lock:
+        event_pks = set(_pending)
+        _pending.clear()
+        _scheduled_pid = None
+    index_events(event_pks)
+
+
+def search_events(query, queryset=None, include_attendees=False):
+    """Returns the events of `queryset` that match every word of `query`.
+
+    Attendee names and emails are only searched with `include_attendees`,
+    which is meant for the admin."""
+    if queryset is None:
+        queryset = Event.objects.all()
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+
+    entries = EventSearchEntry.objects.all()
+    if connection.vendor == 'postgresql':
+        vector = ADMIN_VECTOR if include_attendees else PUBLIC_VECTOR
+        config = 'simple' if include_attendees else 'english'
+        table = connection.ops.quote_name(EventSearchEntry._meta.db_table)
+        columns = {
+            'document': '{}.document'.format(table),
+            'attendee_document': '{}.attendee_document'.format(table),
+        }
+        # Prefix matches, so "conf" finds "conference" as the user types.
+        tsquery = u' & '.join(u'{}:*'.format(term) for term in terms)
+        entries = entries.extra(
+            where=["{} @@ to_tsquery('{}', %s)".format(
+                vector.format(**columns), config)],
+            params=[tsquery])
+    else:
+        for term in terms:
+            match = Q(document__icontains=term)
+            if include_attendees:
+                match |= Q(attendee_document__icontains=term)
+            entries = entries.filter(match)
+
+    return queryset.filter(pk__in=entries.values('event_id'))
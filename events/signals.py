@@ -0,0 +1,128 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from accounts.models import Sponsor
+from .models import Attendee, Event, Registration
+from .search import index_events_later
+
+# Create your signals here.
+
+
+def _related_event_pks(through, instance):
+    """Returns the pks of every event the attendee or sponsor is linked to."""
+    lookup = {instance._meta.model_name: instance}
+    return list(through.objects.filter(**lookup)
+                               .values_list('event_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Event.sponsors.through)
+def update_sponsor_counts(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    """Keeps Event.sponsor_count up to date."""
+    if action in ('pre_remove', 'pre_clear'):
+        # Only the links that exist are removed, so collect them first.
+        links = sender.objects.filter(
+            **{'sponsor' if reverse else 'event': instance})
+        if action == 'pre_remove':
+            links = links.filter(
+                **{'event_id__in' if reverse else 'sponsor_id__in': pk_set})
+        instance._removed_event_pks = list(
+            links.values_list('event_id', flat=True))
+        if reverse and action == 'pre_clear':
+            instance._cleared_event_pks = instance._removed_event_pks
+    elif action == 'post_add' and pk_set:
+        event_pks = pk_set if reverse else [instance.pk] * len(pk_set)
+        Event.objects.adjust_counts('sponsor_count', event_pks)
+    elif action in ('post_remove', 'post_clear'):
+        Event.objects.adjust_counts(
+            'sponsor_count', getattr(instance, '_removed_event_pks', []), -1)
+
+
+@receiver(post_save, sender=Registration)
+def count_new_registration(sender, instance, created, **kwargs):
+    """Registrations are created directly rather than through
+    Event.attendees.add(), so they do not send m2m_changed. Clearing an
+    attendee's events deletes their registrations, which lands here
+    too."""
+    if created:
+        Event.objects.adjust_counts('attendee_count', [instance.event_id])
+
+
+@receiver(post_delete, sender=Registration)
+def count_deleted_registration(sender, instance, **kwargs):
+    Event.objects.adjust_counts('attendee_count', [instance.event_id], -1)
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=Registration)
+@receiver(post_delete, sender=Registration)
+@receiver(post_save, sender=Sponsor)
+@receiver(post_delete, sender=Sponsor)
+@receiver(m2m_changed, sender=Event.attendees.through)
+@receiver(m2m_changed, sender=Event.sponsors.through)
+def invalidate_event_cache(sender, **kwargs):
+    """Cached event listings embed sponsors and counters, so any change to
+    them starts a new cache generation."""
+    if kwargs.get('action', 'post_').startswith('post_'):
+        Event.objects.invalidate_cache()
+
+
+@receiver(pre_delete, sender=Sponsor)
+def collect_counted_events(sender, instance, **kwargs):
+    """Remembers the events to count down once the sponsor is gone, since
+    the cascade on the through table does not send m2m_changed."""
+    instance._counted_event_pks = _related_event_pks(Event.sponsors.through,
+                                                     instance)
+
+
+@receiver(post_delete, sender=Sponsor)
+def count_down_deleted_sponsor(sender, instance, **kwargs):
+    event_pks = getattr(instance, '_counted_event_pks', [])
+    if event_pks:
+        Event.objects.adjust_counts('sponsor_count', event_pks, -1)
+        index_events_later(event_pks)
+
+
+@receiver(post_save, sender=Event)
+def index_saved_event(sender, instance, **kwargs):
+    index_events_later([instance.pk])
+
+
+@receiver(post_save, sender=Registration)
+@receiver(post_delete, sender=Registration)
+def index_registration_event(sender, instance, **kwargs):
+    index_events_later([instance.event_id])
+
+
+@receiver(post_save, sender=Attendee)
+@receiver(post_save, sender=Sponsor)
+def index_related_events(sender, instance, created, **kwargs):
+    """Attendee and sponsor names are part of their events' search
+    entries."""
+    if created:
+        return
+    through = Event.attendees.through if sender is Attendee \
+        else Event.sponsors.through
+    event_pks = _related_event_pks(through, instance)
+    if event_pks:
+        index_events_later(event_pks)
+
+
+@receiver(m2m_changed, sender=Event.sponsors.through)
+def index_sponsored_events(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        event_pks = [instance.pk]
+    elif action == 'post_clear':
+        # Collected on pre_clear by update_sponsor_counts.
+        event_pks = getattr(instance, '_cleared_event_pks', [])
+    else:
+        event_pks = list(pk_set or [])
+
+    if event_pks:
+        index_events_later(event_pks)
@@ -1,3 +1,417 @@
-from django.test import TestCase
+import os
+import threading
+
+from datetime import timedelta
+
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import Sponsor
+from contact.models import Newsletter
+from . import search
+from .ics import fold_line
+from .models import (Attendee, EmailCampaign, Event, Registration,
+                     SeatHold)
+from .pagination import decode_cursor, paginate_events
+from .rendering import format_date_range
+from .search import index_events, search_events
+from .utils import claim_campaign, send_campaign
 
 # Create your tests here.
+
+
+class EventCounterUnitTest(TestCase):
+
+    def create_event(self):
+        start = timezone.now() + timedelta(days=7)
+        return Event.objects.create(
+            name='Test event', start_date=start,
+            end_date=start + timedelta(hours=2), member_fee=0,
+            non_member_fee=1000, email_description='Test event')
+
+    def create_attendee(self, email):
+        return Attendee.objects.create(email=email, first_name='John',
+                                       last_name='Doe')
+
+    def test_attendee_count_follows_m2m_changes(self):
+        event = self.create_event()
+        first = self.create_attendee('first@user.com')
+        second = self.create_attendee('second@user.com')
+
+        Registration.objects.create(event=event, attendee=first)
+        Registration.objects.create(event=event, attendee=second)
+        event.refresh_from_db()
+        self.assertEqual(event.attendee_count, 2)
+
+        first.event_attendees.clear()
+        event.refresh_from_db()
+        self.assertEqual(event.attendee_count, 1)
+
+        second.delete()
+        event.refresh_from_db()
+        self.assertEqual(event.attendee_count, 0)
+
+    def test_sponsor_count_follows_m2m_changes(self):
+        event = self.create_event()
+        first = Sponsor.objects.create(name='First sponsor')
+        second = Sponsor.objects.create(name='Second sponsor')
+
+        event.sponsors.add(first, second)
+        event.sponsors.add(first)
+        event.refresh_from_db()
+        self.assertEqual(event.sponsor_count, 2)
+
+        # Removing a sponsor the event does not have changes nothing.
+        first.event_sponsors.remove(event)
+        first.event_sponsors.remove(event)
+        event.refresh_from_db()
+        self.assertEqual(event.sponsor_count, 1)
+
+        second.delete()
+        event.refresh_from_db()
+        self.assertEqual(event.sponsor_count, 0)
+
+    def test_counters_are_incremented_in_the_database(self):
+        event = self.create_event()
+        # Another worker registered someone since `event` was loaded.
+        Event.objects.filter(pk=event.pk).update(attendee_count=5)
+
+        Registration.objects.create(
+            event=event, attendee=self.create_attendee('first@user.com'))
+        event.refresh_from_db()
+        self.assertEqual(event.attendee_count, 6)
+
+    def test_saving_a_stale_event_keeps_the_counters(self):
+        event = self.create_event()
+        Event.objects.filter(pk=event.pk).update(attendee_count=5,
+                                                 seats_held=2)
+
+        event.name = 'Renamed'
+        event.save()
+        event.refresh_from_db()
+        self.assertEqual(event.name, 'Renamed')
+        self.assertEqual(event.attendee_count, 5)
+        self.assertEqual(event.seats_held, 2)
+
+    def test_refresh_counts_repairs_drift(self):
+        event = self.create_event()
+        Registration.objects.create(
+            event=event, attendee=self.create_attendee('first@user.com'))
+        Event.objects.filter(pk=event.pk).update(attendee_count=42)
+
+        Event.objects.refresh_counts()
+        event.refresh_from_db()
+        self.assertEqual(event.attendee_count, 1)
+        self.assertEqual(event.sponsor_count, 0)
+
+
+class AttendeeEventUnitTest(TestCase):
+
+    def test_with_events_resolves_events_without_queries(self):
+        start = timezone.now() + timedelta(days=7)
+        for i in range(3):
+            event = Event.objects.create(
+                name='Event {}'.format(i), start_date=start,
+                end_date=start + timedelta(hours=2), member_fee=0,
+                non_member_fee=0, email_description='Test event')
+            attendee = Attendee.objects.create(
+                email='user{}@user.com'.format(i), first_name='John',
+                last_name='Doe')
+            Registration.objects.create(event=event, attendee=attendee)
+
+        attendees = list(Attendee.objects.with_events())
+        with self.assertNumQueries(0):
+            names = sorted(a.event_name for a in attendees)
+        self.assertEqual(names, ['Event 0', 'Event 1', 'Event 2'])
+
+
+class RegistrationLookupUnitTest(TestCase):
+
+    def test_is_registered_ignores_case(self):
+        start = timezone.now() + timedelta(days=7)
+        event = Event.objects.create(
+            name='Test event', start_date=start,
+            end_date=start + timedelta(hours=2), member_fee=0,
+            non_member_fee=0, email_description='Test event')
+        attendee = Attendee.objects.create(email='John.Doe@User.com',
+                                           first_name='John', last_name='Doe')
+        Registration.objects.create(event=event, attendee=attendee)
+
+        self.assertTrue(
+            Registration.objects.is_registered(event, 'john.doe@user.com'))
+        self.assertTrue(
+            Registration.objects.is_registered(event, ' JOHN.DOE@USER.COM'))
+        self.assertFalse(
+            Registration.objects.is_registered(event, 'jane@user.com'))
+
+
+class EventPaginationUnitTest(TestCase):
+
+    def test_pages_follow_start_date_then_id(self):
+        start = timezone.now() + timedelta(days=7)
+        # Two events share a start date to exercise the id tie-breaker.
+        for i, days in enumerate([3, 1, 1, 2, 0]):
+            Event.objects.create(
+                name='Event {}'.format(i), start_date=start + timedelta(days),
+                end_date=start + timedelta(days, hours=2), member_fee=0,
+                non_member_fee=0, email_description='Test event')
+
+        seen = []
+        page = paginate_events(Event.objects.active(), per_page=2)
+        seen.extend(page)
+        while page.has_next:
+            page = paginate_events(Event.objects.active(),
+                                   cursor=page.next_cursor, per_page=2)
+            seen.extend(page)
+
+        expected = list(Event.objects.order_by('start_date', 'pk'))
+        self.assertEqual(seen, expected)
+
+    def test_malformed_cursor_starts_from_the_beginning(self):
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+
+
+class EventCacheUnitTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_featured_is_invalidated_by_saves(self):
+        start = timezone.now() + timedelta(days=7)
+        event = Event.objects.create(
+            name='Test event', start_date=start,
+            end_date=start + timedelta(hours=2), member_fee=0,
+            non_member_fee=0, email_description='Test event')
+
+        self.assertEqual(Event.objects.cached_featured(5), [event])
+        with self.assertNumQueries(0):
+            featured = Event.objects.cached_featured(5)
+            self.assertEqual([e.name for e in featured], ['Test event'])
+            self.assertEqual(list(featured[0].sponsors.all()), [])
+
+        event.name = 'Renamed event'
+        event.save()
+        featured = Event.objects.cached_featured(5)
+        self.assertEqual([e.name for e in featured], ['Renamed event'])
+
+    def test_only_the_first_page_is_cached(self):
+        start = timezone.now() + timedelta(days=7)
+        for i in range(3):
+            Event.objects.create(
+                name='Event {}'.format(i), start_date=start + timedelta(i),
+                end_date=start + timedelta(i, hours=2), member_fee=0,
+                non_member_fee=0, email_description='Test event')
+
+        page = Event.objects.cached_active_page(per_page=2)
+        with self.assertNumQueries(0):
+            Event.objects.cached_active_page(per_page=2)
+        # Later pages query the events and prefetch their sponsors every
+        # time.
+        for i in range(2):
+            with self.assertNumQueries(2):
+                Event.objects.cached_active_page(cursor=page.next_cursor,
+                                                 per_page=2)
+
+
+class EventRenderFieldsUnitTest(TestCase):
+
+    def test_display_fields_are_rendered_on_save(self):
+        start = timezone.now().replace(hour=9, minute=0) + timedelta(days=7)
+        event = Event.objects.create(
+            name='Test event', start_date=start,
+            end_date=start + timedelta(hours=2), member_fee=0,
+            non_member_fee=0, email_description='Test event',
+            description='First line\nSecond line')
+
+        self.assertEqual(event.date_display,
+                         format_date_range(event.start_date, event.end_date))
+        self.assertEqual(event.description_html,
+                         'First line<br />Second line')
+
+        event.description = ' '.join(['word'] * 100)
+        event.save(update_fields=['description'])
+        event.refresh_from_db()
+        self.assertEqual(event.excerpt_html,
+                         ' '.join(['word'] * 75) + ' ...')
+
+
+class SeatHoldUnitTest(TestCase):
+
+    def create_event(self, capacity):
+        start = timezone.now() + timedelta(days=7)
+        return Event.objects.create(
+            name='Test event', start_date=start,
+            end_date=start + timedelta(hours=2), member_fee=0,
+            non_member_fee=0, email_description='Test event',
+            capacity=capacity)
+
+    def test_reserve_stops_at_capacity(self):
+        event = self.create_event(capacity=2)
+        first = SeatHold.objects.reserve(event, 'first@user.com')
+        second = SeatHold.objects.reserve(event, 'second@user.com')
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertIsNone(SeatHold.objects.reserve(event, 'third@user.com'))
+
+        self.assertTrue(first.release())
+        self.assertFalse(first.commit())
+        self.assertIsNotNone(
+            SeatHold.objects.reserve(event, 'third@user.com'))
+
+    def test_expired_holds_give_their_seats_back(self):
+        event = self.create_event(capacity=1)
+        hold = SeatHold.objects.reserve(event, 'first@user.com', ttl=0)
+        SeatHold.objects.filter(pk=hold.pk).update(
+            expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertIsNotNone(
+            SeatHold.objects.reserve(event, 'second@user.com'))
+        hold.refresh_from_db()
+        self.assertEqual(hold.status, SeatHold.RELEASED)
+        event.refresh_from_db()
+        self.assertEqual(event.seats_held, 1)
+
+
+class ConcurrentSeatHoldUnitTest(TransactionTestCase):
+
+    def test_concurrent_checkouts_never_oversell(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('An in-memory SQLite database rejects concurrent '
+                          'writers instead of making them wait.')
+        start = timezone.now() + timedelta(days=7)
+        event = Event.objects.create(
+            name='Test event', start_date=start,
+            end_date=start + timedelta(hours=2), member_fee=0,
+            non_member_fee=0, email_description='Test event', capacity=3)
+        go = threading.Event()
+        registered = []
+
+        def checkout(i):
+            email = 'user{}@user.com'.format(i)
+            try:
+                go.wait()
+                hold = SeatHold.objects.reserve(event, email)
+                if hold is not None:
+                    attendee = Attendee.objects.create(
+                        email=email, first_name='John', last_name='Doe')
+                    Registration.objects.create(event=event,
+                                                attendee=attendee)
+                    hold.commit()
+                    registered.append(email)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(i,))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        go.set()
+        for thread in threads:
+            thread.join()
+
+        event.refresh_from_db()
+        self.assertEqual(len(registered), 3)
+        self.assertEqual(event.attendee_count, 3)
+        self.assertEqual(event.seats_held, 0)
+        self.assertEqual(Registration.objects.filter(event=event).count(), 3)
+
+
+class EventSearchUnitTest(TestCase):
+
+    def test_search_matches_indexed_text(self):
+        start = timezone.now() + timedelta(days=7)
+        event = Event.objects.create(
+            name='Spring mixer', start_date=start,
+            end_date=start + timedelta(hours=2), member_fee=0,
+            non_member_fee=0, email_description='Test event',
+            description='<p>Networking downtown</p>')
+        attendee = Attendee.objects.create(email='jane@user.com',
+                                           first_name='Jane',
+                                           last_name='Roe')
+        Registration.objects.create(event=event, attendee=attendee)
+        index_events([event.pk])
+
+        self.assertEqual(list(search_events('mixer networking')), [event])
+        self.assertEqual(list(search_events('mixer brunch')), [])
+        self.assertEqual(list(search_events('roe')), [])
+        self.assertEqual(
+            list(search_events('roe', include_attendees=True)), [event])
+
+    def test_queued_rebuilds_are_merged(self):
+        start = timezone.now() + timedelta(days=7)
+        event = Event.objects.create(
+            name='Spring mixer', start_date=start,
+            end_date=start + timedelta(hours=2), member_fee=0,
+            non_member_fee=0, email_description='Test event')
+
+        # A rebuild is already queued; sign-ups until it runs join it.
+        search._scheduled_pid = os.getpid()
+        with self.assertNumQueries(0):
+            for i in range(3):
+                search._schedule([event.pk])
+
+        search._index_pending()
+        self.assertEqual(list(search_events('mixer')), [event])
+        self.assertIsNone(search._scheduled_pid)
+
+
+class EmailCampaignUnitTest(TestCase):
+
+    def setUp(self):
+        start = timezone.now() + timedelta(days=7)
+        self.event = Event.objects.create(
+            name='Test event', start_date=start,
+            end_date=start + timedelta(hours=2), member_fee=0,
+            non_member_fee=0, email_description='Test event')
+        Newsletter.objects.create(email='test@user.com', first_name='John',
+                                  last_name='Doe')
+
+    def create_campaign(self, status):
+        return EmailCampaign.objects.create(
+            event=self.event, domain='testserver', status=status)
+
+    def test_campaign_is_sent_once(self):
+        campaign = self.create_campaign(EmailCampaign.PENDING)
+        self.assertEqual(send_campaign(campaign.pk).status,
+                         EmailCampaign.SENT)
+        send_campaign(campaign.pk)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_campaign_sending_elsewhere_is_left_alone(self):
+        campaign = self.create_campaign(EmailCampaign.SENDING)
+        self.assertEqual(send_campaign(campaign.pk).status,
+                         EmailCampaign.SENDING)
+        self.assertFalse(claim_campaign(
+            campaign.pk, stale=timezone.now() - timedelta(minutes=10)))
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class EventCalendarUnitTest(TestCase):
+
+    def test_long_lines_are_folded(self):
+        folded = fold_line('DESCRIPTION:' + 'x' * 200)
+        lines = folded.split(b'\r\n')
+        self.assertTrue(all(len(line) <= 75 for line in lines))
+        self.assertEqual(b''.join(line.lstrip(b' ') for line in lines),
+                         ('DESCRIPTION:' + 'x' * 200).encode('utf-8'))
+
+    def test_unchanged_feed_is_not_modified(self):
+        cache.clear()
+        start = timezone.now() + timedelta(days=7)
+        Event.objects.create(
+            name='Test event', start_date=start,
+            end_date=start + timedelta(hours=2), member_fee=0,
+            non_member_fee=0, email_description='Test event')
+
+        response = self.client.get(reverse('events:calendar'))
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content)
+        self.assertIn(b'SUMMARY:Test event', body)
+
+        response = self.client.get(reverse('events:calendar'),
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
@@ -14,11 +14,31 @@ urlpatterns = [
         view=views.detail,
         name='detail'
     ),
+    url(
+        regex=r'^(?P<event_pk>\d+)/calendar\.ics$',
+        view=views.event_calendar,
+        name='event_calendar'
+    ),
     url(
         regex=r'^(?P<event_pk>\d+)/success/$',
         view=views.reg_success,
         name='reg_success'
     ),
+    url(
+        regex=r'^calendar\.ics$',
+        view=views.calendar,
+        name='calendar'
+    ),
+    url(
+        regex=r'^feed/$',
+        view=views.feed,
+        name='feed'
+    ),
+    url(
+        regex=r'^search/$',
+        view=views.search,
+        name='search'
+    ),
     url(
         regex=r'^$',
         view=views.list,
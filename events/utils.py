@@ -1,9 +1,19 @@
+import logging
+
+from datetime import timedelta
+from itertools import islice
+
 from django.conf import settings
-from django.core.mail import BadHeaderError, EmailMultiAlternatives
-from django.http import HttpResponse
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import F, Q
 from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
 
 from contact.models import Newsletter
+from core.tasks import enqueue, enqueue_on_commit
+from .models import EmailBatch, EmailCampaign
 
 """
 from django.template import Context
@@ -20,35 +30,199 @@ msg.send()
 """
 
 
-def send_event_email(context):
-    """Sends an email to mailing list about creation of new event."""
-    email_recipients = Newsletter.objects.subscribed()
+logger = logging.getLogger(__name__)
+
+# ESP substitution tags, filled in per recipient from msg.merge_data.
+RECIPIENT_FIRST_NAME = '{{first_name}}'
+RECIPIENT_EMAIL = '{{email}}'
+
+
+def get_event_email_context(event, protocol, domain):
+    """Returns the template context shared by every recipient."""
+    unsubscribe_url = reverse('contact:unsubscribe',
+                              kwargs={'email': 'recipient@example.com'})
+    return {
+        'protocol': protocol,
+        'domain': domain,
+        'event_name': event.name,
+        'event_start_date': event.event_start_date,
+        'event_end_date': event.event_end_date,
+        'event_pk': event.pk,
+        'event_member_fee': event.member_fee,
+        'event_non_member_fee': event.non_member_fee,
+        'event_email_description': event.email_description,
+        'event_sponsors': event.get_sponsors_info,
+        'event_url': event.get_absolute_url,
+        'contact_email': settings.DEFAULT_HR_EMAIL,
+        'recipient_first_name': RECIPIENT_FIRST_NAME,
+        'unsubscribe_url': unsubscribe_url.replace('recipient@example.com',
+                                                   RECIPIENT_EMAIL),
+    }
+
+
+def send_event_email(event, protocol, domain):
+    """Queues an email to the mailing list about the event.
+
+    The send itself happens on a background worker once the current
+    transaction commits."""
+    campaign = EmailCampaign.objects.create(
+        event=event, protocol=protocol, domain=domain,
+        chunk_size=getattr(settings, 'EVENT_EMAIL_CHUNK_SIZE', 1000))
+    enqueue_on_commit(send_campaign, campaign.pk)
+    return campaign
+
+
+def resume_campaign(campaign):
+    """Queues an interrupted campaign to continue from its cursor. A
+    campaign whose worker is still making progress is left alone."""
+    enqueue(_resume_campaign, campaign.pk)
+
+
+def _resume_campaign(campaign_pk):
+    stale = timezone.now() - timedelta(
+        minutes=getattr(settings, 'EVENT_EMAIL_STALE_MINUTES', 10))
+    if claim_campaign(campaign_pk, stale=stale):
+        send_campaign(campaign_pk, claimed=True)
+
+
+def retry_campaign(campaign):
+    """Queues the failed batches of a campaign to be sent again."""
+    enqueue(retry_failed_batches, campaign.pk)
+
+
+def claim_campaign(campaign_pk, stale=None):
+    """Marks the campaign as sending with a conditional UPDATE, so only
+    one worker ever sends it. A pending campaign can always be claimed; a
+    sending one only once its worker has made no progress since `stale`.
+    Returns whether the campaign was claimed."""
+    claimable = Q(status=EmailCampaign.PENDING)
+    if stale is not None:
+        claimable |= Q(status=EmailCampaign.SENDING, modified__lt=stale)
+    return bool(EmailCampaign.objects
+                .filter(claimable, pk=campaign_pk)
+                .update(status=EmailCampaign.SENDING,
+                        modified=timezone.now()))
+
+
+def send_campaign(campaign_pk, claimed=False):
+    """Sends the campaign to every subscriber after its cursor, one batch
+    per chunk of recipients. Does nothing unless the campaign is pending
+    or was `claimed` by the caller with claim_campaign."""
+    if not claimed and not claim_campaign(campaign_pk):
+        return EmailCampaign.objects.get(pk=campaign_pk)
+    campaign = EmailCampaign.objects.select_related('event').get(
+        pk=campaign_pk)
+
+    context = get_event_email_context(campaign.event, campaign.protocol,
+                                      campaign.domain)
+    subject = "TRIP's {0} | {1}".format(context['event_name'],
+                                        context['event_start_date'])
+    html_content = render_to_string('events/new_event_email.html', context)
+
+    recipients = Newsletter.objects.subscribed() \
+        .filter(pk__gt=campaign.last_recipient_pk) \
+        .order_by('pk') \
+        .values_list('pk', 'email', 'first_name', 'last_name') \
+        .iterator()
+
+    while True:
+        chunk = list(islice(recipients, campaign.chunk_size))
+        if not chunk:
+            break
+        _send_batch(campaign, subject, html_content, chunk)
+
+    campaign.refresh_from_db()
+    campaign.status = EmailCampaign.FAILED if campaign.failed_count \
+        else EmailCampaign.SENT
+    campaign.finished_at = timezone.now()
+    campaign.save(update_fields=['status', 'finished_at', 'modified'])
+    return campaign
+
+
+def retry_failed_batches(campaign_pk):
+    """Resends every failed batch of the campaign to the recipients in its
+    range that are still subscribed."""
+    campaign = EmailCampaign.objects.select_related('event').get(
+        pk=campaign_pk)
+    context = get_event_email_context(campaign.event, campaign.protocol,
+                                      campaign.domain)
+    subject = "TRIP's {0} | {1}".format(context['event_name'],
+                                        context['event_start_date'])
+    html_content = render_to_string('events/new_event_email.html', context)
+
+    for batch in campaign.batches.filter(status=EmailBatch.FAILED):
+        chunk = list(
+            Newsletter.objects.subscribed()
+                      .filter(pk__gte=batch.first_recipient_pk,
+                              pk__lte=batch.last_recipient_pk)
+                      .order_by('pk')
+                      .values_list('pk', 'email', 'first_name', 'last_name')
+        )
+        # Claim the batch, so that a second retry never sends it twice.
+        claimed = EmailBatch.objects \
+            .filter(pk=batch.pk, status=EmailBatch.FAILED,
+                    attempts=batch.attempts) \
+            .update(attempts=F('attempts') + 1, modified=timezone.now())
+        if not claimed:
+            continue
+        error = _deliver(subject, html_content, chunk) if chunk else ''
+
+        with transaction.atomic():
+            EmailBatch.objects.filter(pk=batch.pk).update(
+                status=EmailBatch.FAILED if error else EmailBatch.SENT,
+                error=error, modified=timezone.now())
+            if not error:
+                EmailCampaign.objects.filter(pk=campaign.pk).update(
+                    sent_count=F('sent_count') + batch.recipient_count,
+                    failed_count=F('failed_count') - batch.recipient_count,
+                    modified=timezone.now())
+
+    campaign.refresh_from_db()
+    if not campaign.failed_count:
+        campaign.status = EmailCampaign.SENT
+        campaign.save(update_fields=['status', 'modified'])
+    return campaign
+
+
+def _send_batch(campaign, subject, html_content, chunk):
+    """Sends one chunk and records its outcome together with the new
+    cursor, so a restarted worker resumes after the last finished chunk."""
+    error = _deliver(subject, html_content, chunk)
+    count = len(chunk)
+
+    with transaction.atomic():
+        EmailBatch.objects.create(
+            campaign=campaign, first_recipient_pk=chunk[0][0],
+            last_recipient_pk=chunk[-1][0], recipient_count=count,
+            status=EmailBatch.FAILED if error else EmailBatch.SENT,
+            error=error)
+        counter = 'failed_count' if error else 'sent_count'
+        EmailCampaign.objects.filter(pk=campaign.pk).update(
+            last_recipient_pk=chunk[-1][0], modified=timezone.now(),
+            **{counter: F(counter) + count})
+
+
+def _deliver(subject, html_content, chunk):
+    """Sends a single ESP batch. Returns an error message, or '' on
+    success."""
     to_emails = []
     merged_data = {}
 
-    if email_recipients.exists():
-        # Add users to to_emails and merged_data
-        for p in email_recipients:
-            context.update({
-                'recipient_first_name': p.first_name,
-                'recipient_email': p.email
-            })
-            name = '{0} {1}'.format(p.first_name, p.last_name)
-            to_emails.append('{0} <{1}>'.format(name, p.email))
-            merged_data.update({p.email: {'name': name}})
-
-        from_email = settings.DEFAULT_FROM_EMAIL
-        subject = "TRIP's {0} | {1}".format(context['event_name'],
-                                            context['event_start_date'])
-        html_content = render_to_string('events/new_event_email.html', context)
-        msg = EmailMultiAlternatives(subject, html_content, from_email,
-                                     to_emails)
-        msg.attach_alternative(html_content, 'text/html')
-        msg.merge_data = merged_data  # Hides list from being shown when sent
-        # Sandbox from email: 'localpart@sparkpostbox.com'
-        # msg.esp_extra = {'use_sandbox': True if settings.DEBUG else False}
-        try:
-            msg.send(fail_silently=True)
-        except BadHeaderError:
-            return HttpResponse('Invalid header found.')
-    return False
+    for pk, email, first_name, last_name in chunk:
+        name = '{0} {1}'.format(first_name, last_name)
+        to_emails.append('{0} <{1}>'.format(name, email))
+        merged_data[email] = {'name': name, 'first_name': first_name,
+                              'email': email}
+
+    msg = EmailMultiAlternatives(subject, html_content,
+                                 settings.DEFAULT_FROM_EMAIL, to_emails)
+    msg.attach_alternative(html_content, 'text/html')
+    msg.merge_data = merged_data  # Hides list from being shown when sent
+    # Sandbox from email: 'localpart@sparkpostbox.com'
+    # msg.esp_extra = {'use_sandbox': True if settings.DEBUG else False}
+    try:
+        msg.send()
+    except Exception as e:
+        logger.exception('Failed to send event email batch.')
+        return str(e) or e.__class__.__name__
+    return ''
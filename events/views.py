@@ -1,22 +1,82 @@
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.views.decorators.http import condition
 
-from .models import Event
+from .ics import CALENDAR_CACHE_KEY, cached_calendar, iter_calendar
+from .models import Event, Registration
+from .pagination import decode_cursor
+from .search import search_events
 
 # Create your views here.
 
 
+def _events_page(request):
+    cursor = request.GET.get('after')
+    if cursor and decode_cursor(cursor) is None:
+        cursor = None
+    return Event.objects.cached_active_page(
+        cursor=cursor, per_page=getattr(settings, 'EVENTS_PER_PAGE', 10))
+
+
 def list(request):
+    page = _events_page(request)
     ctx = {
-        'events': Event.objects.active(),
-        'featured_events': Event.objects.featured(num_returned=5),
+        'events': page.object_list,
+        'next_cursor': page.next_cursor,
+        'featured_events': Event.objects.cached_featured(num_returned=5),
     }
     return render(request, 'events/list.html', ctx)
 
 
+def feed(request):
+    """Returns the same pages as the events list as JSON, for infinite
+    scrolling."""
+    page = _events_page(request)
+    next_url = None
+    if page.has_next:
+        next_url = '{0}?after={1}'.format(reverse('events:feed'),
+                                          page.next_cursor)
+    return JsonResponse({
+        'events': [{
+            'id': event.pk,
+            'name': event.name,
+            'url': event.get_absolute_url(),
+            'start_date': event.start_date.isoformat(),
+            'end_date': event.end_date.isoformat(),
+            'event_date': event.date_display,
+            'excerpt': event.excerpt_html,
+        } for event in page],
+        'html': render_to_string('events/_event_list_items.html',
+                                 {'events': page.object_list}),
+        'next_cursor': page.next_cursor,
+        'next': next_url,
+    })
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    events = []
+    if query:
+        events = search_events(query, Event.objects.active()) \
+            .order_by('-start_date')[:getattr(settings, 'EVENTS_SEARCH_LIMIT', 20)]
+    ctx = {
+        'query': query,
+        'events': events,
+        'featured_events': Event.objects.cached_featured(num_returned=5),
+    }
+    return render(request, 'events/search.html', ctx)
+
+
 def detail(request, event_pk):
     event = get_object_or_404(Event, pk=event_pk)
-    attending = event.attendees.filter(
-        email__iexact=request.user.email).exists()
+    attending = request.user.is_authenticated() and \
+        Registration.objects.is_registered(event, request.user.email)
     ctx = {
         'event': event,
         'member_attending': attending
@@ -27,3 +87,55 @@ def detail(request, event_pk):
 def reg_success(request, event_pk):
     event = get_object_or_404(Event, pk=event_pk)
     return render(request, 'events/success.html', {'event': event})
+
+
+def _calendar_etag(request):
+    """Changes whenever an active event is saved, added or removed."""
+    if not hasattr(request, '_calendar_etag'):
+        latest = Event.objects.filter(is_active=True) \
+            .aggregate(modified=Max('modified'), count=Count('pk'))
+        request._calendar_etag = hashlib.md5(
+            '{modified}:{count}'.format(**latest).encode('utf-8')).hexdigest()
+    return request._calendar_etag
+
+
+def _event_calendar_etag(request, event_pk):
+    if not hasattr(request, '_calendar_etag'):
+        modified = Event.objects.filter(pk=event_pk) \
+            .values_list('modified', flat=True).first()
+        request._calendar_etag = modified and hashlib.md5(
+            '{0}:{1}'.format(event_pk, modified).encode('utf-8')).hexdigest()
+    return request._calendar_etag
+
+
+def _calendar_response(request, etag, events, **kwargs):
+    """Streams the calendar, or replays it from the cache when another
+    client already fetched this version."""
+    domain = request.get_host()
+    chunks = cached_calendar(
+        CALENDAR_CACHE_KEY.format(domain, etag),
+        iter_calendar(events, request.scheme, domain, **kwargs))
+    return StreamingHttpResponse(chunks,
+                                 content_type='text/calendar; charset=utf-8')
+
+
+@condition(etag_func=_calendar_etag)
+def calendar(request):
+    """iCalendar feed of the active events, for calendar subscriptions."""
+    events = Event.objects.filter(is_active=True) \
+        .order_by('start_date', 'id') \
+        .only('pk', 'name', 'description', 'start_date', 'end_date',
+              'modified') \
+        .iterator()
+    return _calendar_response(request, _calendar_etag(request), events,
+                              name='TRIP Events')
+
+
+@condition(etag_func=_event_calendar_etag)
+def event_calendar(request, event_pk):
+    event = get_object_or_404(Event, pk=event_pk)
+    response = _calendar_response(
+        request, _event_calendar_etag(request, event_pk), [event])
+    response['Content-Disposition'] = \
+        'attachment; filename="event-{0}.ics"'.format(event.pk)
+    return response
@@ -0,0 +1,88 @@
+from datetime import date, datetime
+
+from django.conf.urls import url
+from django.contrib import admin
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.template.response import TemplateResponse
+from django.utils.translation import ugettext as _
+
+from .models import METRICS, DailyRollup
+
+# Register your models here.
+
+
+def _totals(rows):
+    """Adds the net revenue to each row of sums and converts the amounts
+    from cents."""
+    for row in rows:
+        row = dict((name, row[name] or 0) if name in METRICS
+                   else (name, row[name]) for name in row)
+        row['revenue'] = \
+            row['gross'] - row['refunded'] + row['subscription_revenue']
+        for name in ('gross', 'refunded', 'subscription_revenue', 'revenue'):
+            row[name] = row[name] / 100.0
+        yield row
+
+
+@admin.register(DailyRollup)
+class DailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'event', 'plan', 'registrations', 'gross',
+                    'refunded', 'new_subscriptions', 'canceled_subscriptions',
+                    'subscription_revenue',)
+    list_filter = ('day',)
+    date_hierarchy = 'day'
+    list_select_related = ('event', 'plan',)
+    readonly_fields = ('cell_key', 'day', 'event', 'plan') + METRICS + \
+        ('created', 'modified',)
+
+    class Meta:
+        model = DailyRollup
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        return [
+            url(r'^dashboard/$',
+                self.admin_site.admin_view(self.dashboard_view),
+                name='reports_dailyrollup_dashboard'),
+        ] + super(DailyRollupAdmin, self).get_urls()
+
+    def dashboard_view(self, request):
+        """Revenue per month, event and plan, read from the rollups
+        only."""
+        today = date.today()
+        start = date(today.year - 1, today.month, 1)
+        end = today
+        try:
+            if request.GET.get('start'):
+                start = datetime.strptime(request.GET['start'],
+                                          '%Y-%m-%d').date()
+            if request.GET.get('end'):
+                end = datetime.strptime(request.GET['end'], '%Y-%m-%d').date()
+        except ValueError:
+            pass
+
+        rollups = DailyRollup.objects.filter(day__range=(start, end))
+        sums = dict((name, Sum(name)) for name in METRICS)
+        context = dict(
+            self.admin_site.each_context(request),
+            title=_('Revenue'),
+            opts=self.model._meta,
+            start=start,
+            end=end,
+            total=next(_totals([rollups.aggregate(**sums)])),
+            months=list(_totals(
+                rollups.annotate(month=TruncMonth('day'))
+                       .values('month').annotate(**sums).order_by('month'))),
+            events=list(_totals(
+                rollups.exclude(event=None)
+                       .values('event', 'event__name').annotate(**sums)
+                       .order_by('-gross', 'event__name'))),
+            plans=list(_totals(
+                rollups.exclude(plan=None)
+                       .values('plan', 'plan__name').annotate(**sums)
+                       .order_by('plan__name'))),
+        )
+        return TemplateResponse(request, 'reports/dashboard.html', context)
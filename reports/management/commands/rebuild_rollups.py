@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reports.rollups import history_range, rebuild
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = """Recomputes the daily revenue and registration rollups for a
+    date range, a month at a time."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start',
+                            help='First day to rebuild (YYYY-MM-DD); '
+                                 'defaults to the start of the history.')
+        parser.add_argument('--end',
+                            help='Last day to rebuild (YYYY-MM-DD); '
+                                 'defaults to the end of the history.')
+
+    def handle(self, *args, **options):
+        first, last = history_range()
+        try:
+            start = self.parse_day(options['start']) or first
+            end = self.parse_day(options['end']) or last
+        except ValueError:
+            raise CommandError('Dates must be given as YYYY-MM-DD.')
+        if start > end:
+            raise CommandError('--start must not be after --end.')
+
+        total = 0
+        while start <= end:
+            # One transaction per month keeps the locks short.
+            month_end = min((start.replace(day=28) + timedelta(days=4))
+                            .replace(day=1) - timedelta(days=1), end)
+            count = rebuild(start, month_end)
+            total += count
+            if options['verbosity'] > 1:
+                self.stdout.write('{0:%Y-%m}: {1} cells'.format(start, count))
+            start = month_end + timedelta(days=1)
+        self.stdout.write(
+            self.style.SUCCESS('Rebuilt {} rollup cells.'.format(total)))
+
+    def parse_day(self, value):
+        if value:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        return None
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 23:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('events', '0009_event_search_entries'),
+        ('billing', '0004_refund_batches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('cell_key', models.CharField(max_length=64, unique=True)),
+                ('day', models.DateField()),
+                ('registrations', models.PositiveIntegerField(default=0)),
+                ('gross', models.PositiveIntegerField(default=0, help_text='Charged for the registrations.')),
+                ('refunded', models.PositiveIntegerField(default=0, help_text="Refunded of the registrations' charges.")),
+                ('new_subscriptions', models.PositiveIntegerField(default=0)),
+                ('canceled_subscriptions', models.PositiveIntegerField(default=0)),
+                ('subscription_revenue', models.PositiveIntegerField(default=0, help_text='First period of the new subscriptions.')),
+                ('event', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='events.Event')),
+                ('plan', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='billing.Plan')),
+            ],
+            options={
+                'verbose_name': 'daily rollup',
+                'verbose_name_plural': 'daily rollups',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dailyrollup',
+            index=models.Index(fields=['day'], name='reports_rollup_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyrollup',
+            index=models.Index(fields=['event', 'day'], name='reports_rollup_event_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyrollup',
+            index=models.Index(fields=['plan', 'day'], name='reports_rollup_plan_day_idx'),
+        ),
+    ]
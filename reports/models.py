@@ -0,0 +1,57 @@
+from __future__ import unicode_literals
+
+from django.db import models
+from django.utils.encoding import python_2_unicode_compatible
+from django.utils.translation import ugettext_lazy as _
+
+from core.models import TimeStampedModel
+
+# Create your models here.
+
+
+METRICS = ('registrations', 'gross', 'refunded', 'new_subscriptions',
+           'canceled_subscriptions', 'subscription_revenue')
+
+
+@python_2_unicode_compatible
+class DailyRollup(TimeStampedModel):
+    """Pre-aggregated totals of one day for one event or one plan, kept
+    up to date by reports.rollups. Amounts are in cents.
+
+    `cell_key` ("<day>:<event pk>:<plan pk>", with "-" for a missing
+    one) identifies the cell, since NULLs never collide in a unique
+    index."""
+    cell_key = models.CharField(max_length=64, unique=True)
+    day = models.DateField()
+    event = models.ForeignKey('events.Event', on_delete=models.CASCADE,
+                              related_name='rollups', null=True, blank=True)
+    plan = models.ForeignKey('billing.Plan', on_delete=models.CASCADE,
+                             related_name='rollups', null=True, blank=True)
+    registrations = models.PositiveIntegerField(default=0)
+    gross = models.PositiveIntegerField(
+        default=0, help_text=_('Charged for the registrations.'))
+    refunded = models.PositiveIntegerField(
+        default=0, help_text=_('Refunded of the registrations\' charges.'))
+    new_subscriptions = models.PositiveIntegerField(default=0)
+    canceled_subscriptions = models.PositiveIntegerField(default=0)
+    subscription_revenue = models.PositiveIntegerField(
+        default=0, help_text=_('First period of the new subscriptions.'))
+
+    class Meta:
+        app_label = 'reports'
+        indexes = [
+            models.Index(fields=['day'], name='reports_rollup_day_idx'),
+            models.Index(fields=['event', 'day'],
+                         name='reports_rollup_event_day_idx'),
+            models.Index(fields=['plan', 'day'],
+                         name='reports_rollup_plan_day_idx'),
+        ]
+        verbose_name = _('daily rollup')
+        verbose_name_plural = _('daily rollups')
+
+    def __str__(self):
+        return self.cell_key
+
+    @property
+    def revenue(self):
+        return self.gross - self.refunded + self.subscription_revenue
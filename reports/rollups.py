@@ -0,0 +1,191 @@
+"""
+Daily revenue and registration rollups.
+
+DailyRollup holds one row (a cell) per day and event, and one per day
+and plan:
+
+- event cells count the registrations made that day, with what was
+  charged and has been refunded for them;
+- plan cells count the subscriptions started that day, with the revenue
+  of their first period, and those canceled that day.
+
+Saving or deleting a Registration, Charge or Subscription queues
+`refresh_cells` for the cells it touches, which recomputes just those
+cells from the source tables on a core.tasks worker. Bulk UPDATEs
+(refunds, reconciliation, webhooks) send billing.signals.rows_updated
+instead of post_save. Both also refresh the cells a subscription was
+counted in before its start, canceled_at or plan changed. `rebuild`
+recomputes a whole date range in a few GROUP BY queries, e.g. after a
+backfill (`manage.py rebuild_rollups`).
+
+The dashboard only ever reads DailyRollup, so its cost depends on the
+date range shown rather than on the size of the history.
+"""
+
+from datetime import date, datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from billing.models import Subscription
+from events.models import Registration
+from .models import METRICS, DailyRollup
+
+# Create your rollups here.
+
+
+def cell_key(day, event_pk=None, plan_pk=None):
+    return '{0}:{1}:{2}'.format(day.isoformat(), event_pk or '-',
+                                plan_pk or '-')
+
+
+def _as_day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _compute(registrations, started, canceled):
+    """Aggregates the registrations, started and canceled subscriptions
+    into cells. Returns a dict of DailyRollup values by cell key."""
+    cells = {}
+
+    def cell(day, event_pk=None, plan_pk=None):
+        values = cells.get(cell_key(day, event_pk, plan_pk))
+        if values is None:
+            values = dict((name, 0) for name in METRICS)
+            values.update(day=day, event_id=event_pk, plan_id=plan_pk)
+            cells[cell_key(day, event_pk, plan_pk)] = values
+        return values
+
+    rows = registrations.order_by() \
+        .annotate(date=TruncDate('registered_at')) \
+        .values('date', 'event') \
+        .annotate(count=Count('pk'), gross=Sum('charge__amount'),
+                  refunded=Sum('charge__amount_refunded'))
+    for row in rows:
+        cell(row['date'], event_pk=row['event']).update(
+            registrations=row['count'], gross=int(row['gross'] or 0),
+            refunded=int(row['refunded'] or 0))
+
+    rows = started.order_by() \
+        .annotate(date=TruncDate('start')) \
+        .values('date', 'plan') \
+        .annotate(count=Count('pk'),
+                  revenue=Sum(F('plan__amount') * F('quantity'),
+                              output_field=IntegerField()))
+    for row in rows:
+        cell(row['date'], plan_pk=row['plan']).update(
+            new_subscriptions=row['count'],
+            subscription_revenue=int(row['revenue'] or 0))
+
+    rows = canceled.order_by() \
+        .annotate(date=TruncDate('canceled_at')) \
+        .values('date', 'plan') \
+        .annotate(count=Count('pk'))
+    for row in rows:
+        cell(row['date'], plan_pk=row['plan'])['canceled_subscriptions'] = \
+            row['count']
+    return cells
+
+
+def refresh_cells(cells):
+    """Recomputes the given (day, event pk, plan pk) cells, one of the
+    pks being None."""
+    cells = set((_as_day(day), event_pk, plan_pk)
+                for day, event_pk, plan_pk in cells)
+    if not cells:
+        return
+    days = set(day for day, event_pk, plan_pk in cells)
+    event_pks = set(event_pk for day, event_pk, plan_pk in cells if event_pk)
+    plan_pks = set(plan_pk for day, event_pk, plan_pk in cells if plan_pk)
+    computed = _compute(
+        Registration.objects.filter(event__in=event_pks,
+                                    registered_at__date__in=days),
+        Subscription.objects.filter(plan__in=plan_pks, start__date__in=days),
+        Subscription.objects.filter(plan__in=plan_pks,
+                                    canceled_at__date__in=days))
+
+    keys = [cell_key(*cell) for cell in cells]
+    with transaction.atomic():
+        existing = dict(DailyRollup.objects.filter(cell_key__in=keys)
+                                           .values_list('cell_key', 'pk'))
+        for key in keys:
+            values = computed.get(key)
+            if values is None:
+                # Nothing left in the cell.
+                if key in existing:
+                    DailyRollup.objects.filter(pk=existing[key]).delete()
+            elif key in existing:
+                DailyRollup.objects.filter(pk=existing[key]).update(
+                    modified=timezone.now(), **values)
+            else:
+                try:
+                    with transaction.atomic():
+                        DailyRollup.objects.create(cell_key=key, **values)
+                except IntegrityError:
+                    # Another worker created it first.
+                    DailyRollup.objects.filter(cell_key=key).update(
+                        modified=timezone.now(), **values)
+
+
+def refresh_charge_cells(charge_pks):
+    """Recomputes the cells of the registrations paid by the charges."""
+    refresh_cells(
+        (registered_at, event_pk, None)
+        for registered_at, event_pk in Registration.objects
+        .filter(charge__in=charge_pks)
+        .values_list('registered_at', 'event'))
+
+
+def subscription_cells(subscription_pks, previous=None):
+    """The cells the subscriptions started or ended in. `previous` maps
+    pks to the values rows_updated reported for them, so that the cells
+    they were counted in before are included too."""
+    cells = set()
+    for row in Subscription.objects.filter(pk__in=subscription_pks) \
+            .values('pk', 'start', 'canceled_at', 'plan_id'):
+        rows = [row]
+        if previous and previous.get(row['pk']):
+            rows.append(dict(row, **previous[row['pk']]))
+        for values in rows:
+            cells.update((day, None, values['plan_id'])
+                         for day in (values['start'], values['canceled_at'])
+                         if day is not None)
+    return list(cells)
+
+
+def rebuild(start, end):
+    """Recomputes every cell from `start` to `end`, both included.
+    Returns the number of cells written."""
+    computed = _compute(
+        Registration.objects.filter(registered_at__date__range=(start, end)),
+        Subscription.objects.filter(start__date__range=(start, end)),
+        Subscription.objects.filter(canceled_at__date__range=(start, end)))
+    with transaction.atomic():
+        DailyRollup.objects.filter(day__range=(start, end)).delete()
+        DailyRollup.objects.bulk_create(
+            [DailyRollup(cell_key=key, **values)
+             for key, values in computed.items()], batch_size=500)
+    return len(computed)
+
+
+def history_range():
+    """The first and last day with registrations or subscriptions."""
+    days = [_as_day(value) for value in (
+        Registration.objects.order_by('registered_at')
+        .values_list('registered_at', flat=True).first(),
+        Registration.objects.order_by('-registered_at')
+        .values_list('registered_at', flat=True).first(),
+        Subscription.objects.exclude(start=None).order_by('start')
+        .values_list('start', flat=True).first(),
+        Subscription.objects.exclude(start=None).order_by('-start')
+        .values_list('start', flat=True).first(),
+        Subscription.objects.exclude(canceled_at=None)
+        .order_by('-canceled_at')
+        .values_list('canceled_at', flat=True).first(),
+    ) if value is not None]
+    if not days:
+        today = date.today()
+        return today, today
+    return min(days), max(days)
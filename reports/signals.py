@@ -0,0 +1,60 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from billing.models import Charge, Subscription
+from billing.signals import rows_updated
+from core.tasks import enqueue_on_commit
+from events.models import Registration
+from .rollups import refresh_cells, refresh_charge_cells, subscription_cells
+
+# Create your signals here.
+
+
+@receiver(post_save, sender=Registration)
+@receiver(post_delete, sender=Registration)
+def refresh_registration_cell(sender, instance, **kwargs):
+    enqueue_on_commit(refresh_cells,
+                      [(instance.registered_at, instance.event_id, None)])
+
+
+@receiver(post_save, sender=Charge)
+def refresh_charge_cell(sender, instance, created, **kwargs):
+    # A new charge is counted once its registration is saved.
+    if not created:
+        enqueue_on_commit(refresh_charge_cells, [instance.pk])
+
+
+def _cells_of(subscription):
+    return [(day, None, subscription.plan_id)
+            for day in (subscription.start, subscription.canceled_at)
+            if day is not None]
+
+
+@receiver(pre_save, sender=Subscription)
+def collect_subscription_cells(sender, instance, raw, **kwargs):
+    """Remembers the cells of the saved row, which the new start,
+    canceled_at or plan may move the subscription out of."""
+    if raw or instance.pk is None:
+        return
+    instance._previous_cells = subscription_cells([instance.pk])
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def refresh_subscription_cell(sender, instance, **kwargs):
+    cells = _cells_of(instance) + getattr(instance, '_previous_cells', [])
+    instance._previous_cells = []
+    if cells:
+        enqueue_on_commit(refresh_cells, cells)
+
+
+@receiver(rows_updated, sender=Charge)
+def refresh_updated_charge_cells(sender, pks, **kwargs):
+    enqueue_on_commit(refresh_charge_cells, pks)
+
+
+@receiver(rows_updated, sender=Subscription)
+def refresh_updated_subscription_cells(sender, pks, previous=None,
+                                       **kwargs):
+    # Read now: once the task runs, later updates may have moved the rows.
+    enqueue_on_commit(refresh_cells, subscription_cells(pks, previous))
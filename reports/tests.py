@@ -0,0 +1,120 @@
+from datetime import date, datetime, timedelta
+
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import MyUser
+from billing.models import Charge, Customer, Plan, Subscription
+from billing.reconcile import Change, apply_changes
+from events.models import Attendee, Event, Registration
+from .models import DailyRollup
+from .rollups import cell_key, rebuild, refresh_cells, refresh_charge_cells
+
+# Create your tests here.
+
+
+class DailyRollupUnitTest(TestCase):
+
+    def setUp(self):
+        start = datetime(2026, 11, 1, 18)
+        self.event = Event.objects.create(
+            name='Test event', start_date=start,
+            end_date=start + timedelta(hours=2), member_fee=0,
+            non_member_fee=1000, email_description='Test event')
+        self.day = date(2026, 10, 1)
+
+    def register(self, email, amount=1000):
+        charge = Charge(charge_id='ch_{}'.format(email), amount=amount,
+                        amount_refunded=0, paid=True, refunded=False)
+        charge.save()
+        attendee = Attendee.objects.create(email=email, first_name='John',
+                                           last_name='Doe')
+        Registration.objects.create(
+            event=self.event, attendee=attendee, charge=charge,
+            registered_at=datetime.combine(self.day, datetime.min.time()))
+        return charge
+
+    def cell(self):
+        return DailyRollup.objects.get(
+            cell_key=cell_key(self.day, event_pk=self.event.pk))
+
+    def test_rebuild_aggregates_registrations(self):
+        self.register('first@user.com')
+        self.register('second@user.com', amount=1500)
+
+        self.assertEqual(rebuild(self.day, self.day), 1)
+        cell = self.cell()
+        self.assertEqual((cell.registrations, cell.gross, cell.refunded),
+                         (2, 2500, 0))
+
+    def test_refresh_follows_refunds_and_deletes(self):
+        charge = self.register('first@user.com')
+        refresh_cells([(self.day, self.event.pk, None)])
+        self.assertEqual(self.cell().gross, 1000)
+
+        Charge.objects.filter(pk=charge.pk).update(amount_refunded=1000,
+                                                   refunded=True)
+        refresh_charge_cells([charge.pk])
+        self.assertEqual(self.cell().revenue, 0)
+
+        Registration.objects.all().delete()
+        refresh_cells([(self.day, self.event.pk, None)])
+        self.assertFalse(DailyRollup.objects.exists())
+
+    def test_dashboard_reads_the_rollups(self):
+        self.register('first@user.com')
+        rebuild(self.day, self.day)
+        admin = MyUser.objects.create_user(
+            email='admin@user.com', first_name='Admin', last_name='User',
+            password='admin')
+        MyUser.objects.filter(pk=admin.pk).update(is_staff=True,
+                                                  is_superuser=True)
+        self.client.force_login(admin)
+
+        response = self.client.get(
+            reverse('admin:reports_dailyrollup_dashboard'),
+            {'start': '2026-10-01', 'end': '2026-10-31'})
+        self.assertContains(response, 'Test event')
+        self.assertEqual(response.context['total']['gross'], 10.0)
+
+
+@override_settings(TASKS_ALWAYS_EAGER=True)
+class SubscriptionRollupUnitTest(TransactionTestCase):
+
+    def setUp(self):
+        user = MyUser.objects.create_user(
+            email='member@user.com', first_name='John', last_name='Doe',
+            password='member')
+        self.customer = Customer.objects.create(user=user, account_balance=0)
+        self.plans = []
+        for name in ('Individual', 'Family'):
+            plan = Plan(name=name, amount=1000, description=name)
+            plan.save()
+            self.plans.append(plan)
+        self.day = datetime(2026, 10, 1, 12)
+
+    def plan_cells(self):
+        return dict(DailyRollup.objects.filter(event=None)
+                    .values_list('cell_key', 'new_subscriptions'))
+
+    def plan_cell(self, day, plan):
+        return cell_key(day.date(), None, plan.pk)
+
+    def test_changed_subscriptions_leave_their_old_cells(self):
+        subscription = Subscription(customer=self.customer,
+                                    plan=self.plans[0], status='active',
+                                    start=self.day)
+        subscription.save()
+        self.assertEqual(self.plan_cells(),
+                         {self.plan_cell(self.day, self.plans[0]): 1})
+
+        subscription.plan = self.plans[1]
+        subscription.save()
+        self.assertEqual(self.plan_cells(),
+                         {self.plan_cell(self.day, self.plans[1]): 1})
+
+        moved = self.day + timedelta(days=1)
+        apply_changes(Subscription, [
+            Change(subscription.pk, None, {'start': moved})])
+        self.assertEqual(self.plan_cells(),
+                         {self.plan_cell(moved, self.plans[1]): 1})
@@ -0,0 +1,54 @@
+/**
+ * Card tokenization with Stripe.js
+ *
+ * Card inputs are marked with data-stripe attributes and have no name,
+ * so the card number is never posted to our server. On submit the card
+ * is exchanged for a token, which is posted in the stripe_token field
+ * instead.
+ *
+ * Usage:
+ * $('form').stripeToken('pk_...');
+ */
+(function($){
+    $.fn.stripeToken = function(publishableKey){
+        Stripe.setPublishableKey(publishableKey);
+
+        return this.each(function(){
+            var $form = $(this);
+
+            $form.on('submit', function(e){
+                var $token = $form.find('input[name=stripe_token]');
+                var $number = $form.find('[data-stripe=number]');
+
+                // Forms without a card, free plans (disabled card inputs)
+                // and already tokenized forms go through.
+                if (!$token.length || $token.val() || $number.is(':disabled')) {
+                    return true;
+                }
+                e.preventDefault();
+
+                Stripe.card.createToken({
+                    number: $number.val(),
+                    exp: $form.find('[data-stripe=exp]').val(),
+                    cvc: $form.find('[data-stripe=cvc]').val(),
+                    name: $.trim($form.find('input[name=first_name]').val() + ' ' +
+                                 $form.find('input[name=last_name]').val()),
+                    address_line1: $form.find('[data-stripe=address_line1]').val(),
+                    address_city: $form.find('[data-stripe=address_city]').val(),
+                    address_zip: $form.find('[data-stripe=address_zip]').val()
+                }, function(status, response){
+                    if (response.error) {
+                        noty({theme: 'relax', type: 'error', text: response.error.message,
+                              timeout: 3000});
+                        $form.find('.register-submit').removeAttr('disabled')
+                             .removeClass('btn-disabled');
+                        return;
+                    }
+                    $token.val(response.id);
+                    $form.get(0).submit();
+                });
+                return false;
+            });
+        });
+    };
+})(jQuery);
@@ -83,6 +83,7 @@ INSTALLED_APPS = (
     'core',
     'events',
     'maintenancemode',
+    'reports',
 )
 
 
@@ -115,6 +116,7 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'maintenancemode.middleware.MaintenanceModeMiddleware',
+    'billing.middleware.PaymentsUnavailableMiddleware',
     'django.middleware.cache.FetchFromCacheMiddleware',
     'htmlmin.middleware.MarkRequestMiddleware',
 )
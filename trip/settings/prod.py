@@ -139,18 +139,18 @@ TEMPLATES = [
 #########
 # CACHE #
 #########
-# CACHES = {
-#     'default': {
-#         'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
-#         'LOCATION': [
-#             '127.0.0.1:11211',
-#         ],
-#         'TIMEOUT': 60,
-#         'OPTIONS': {
-#             'MAX_ENTRIES': 1000
-#         }
-#     }
-# }
+# The event listings are invalidated by bumping a counter in the cache,
+# so every gunicorn worker must share one cache whose incr is atomic
+# (`manage.py check --deploy` fails on a per-process cache, see
+# events.checks).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ.get('MEMCACHED_SERVERS',
+                                   '127.0.0.1:11211').split(','),
+        'TIMEOUT': 60 * 60,
+    }
+}
 # CACHE_MIDDLEWARE_ALIAS = 'default'
 # CACHE_MIDDLEWARE_SECONDS = 12
 # CACHE_MIDDLEWARE_KEY_PREFIX = ''
@@ -1,5 +1,4 @@
 from django.shortcuts import render
-from django.views.decorators.cache import cache_page
 
 from accounts.models import Sponsor
 from events.models import Event
@@ -7,10 +6,9 @@ from events.models import Event
 # Create views here.
 
 
-@cache_page(60 * 3)
 def home(request):
     ctx = {
-        'featured_events': Event.objects.featured(num_returned=5),
+        'featured_events': Event.objects.cached_featured(num_returned=5),
         'next': request.GET.get('next', '/'),
     }
     return render(request, 'general/index.html', ctx)